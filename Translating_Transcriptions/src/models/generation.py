@@ -4,8 +4,11 @@ import json
 from collections import deque
 from .embedder import make_a_rag
 import os
-import time
 from openai import OpenAI
+from .rate_limiter import RateLimiter, estimate_tokens, usage_tokens, ACQUIRE_TIMEOUT
+
+# Limits of the free GitHub Models tier for gpt-4o-mini, used unless keys/rate_limits.json sets others
+DEFAULT_RATE_LIMITS = {"requests_per_minute": 15, "requests_per_day": 150}
 
 class AIbot:
     def __init__(self, system_prompt, model):
@@ -19,9 +22,15 @@ class AIbot:
             base_url=self.endpoint,
             api_key=token,
         )
+        limits = DEFAULT_RATE_LIMITS
+        if os.path.exists(os.path.join("keys", "rate_limits.json")):
+            with open(os.path.join("keys", "rate_limits.json")) as file:
+                limits = json.load(file)
+        # Shared by every bot and process using the key, instead of sleeping after each request
+        self.rate_limiter = RateLimiter(f"{self.endpoint} {model}", limits)
 
     def generate(self, prompt, output_tokens):
-        response = self.client.chat.completions.create(
+        send = lambda: self.client.chat.completions.create(
         messages=[
             {
                 "role": "system",
@@ -37,7 +46,8 @@ class AIbot:
         max_tokens=output_tokens,
         model=self.model_name
         )
-        time.sleep(5)
+        response = self.rate_limiter.call(send, estimate_tokens([self.system_prompt, prompt], output_tokens),
+                                          usage_tokens, ACQUIRE_TIMEOUT)
 
         return response.choices[0].message.content
 
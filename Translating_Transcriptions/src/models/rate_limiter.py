@@ -0,0 +1,234 @@
+import datetime
+import email.utils
+import logging
+import pathlib
+import random
+import sqlite3
+import threading
+import time
+
+# Status codes worth retrying: rate limited, or the service is briefly unavailable
+RETRY_STATUS = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+BASE_DELAY = 1      # seconds before the first retry, doubled for every retry after it
+MAX_DELAY = 60      # longest wait between two retries
+# Longest wait for capacity of a bot's request, so a bot out of its daily requests fails instead of waiting hours
+ACQUIRE_TIMEOUT = 300
+
+BUCKETS = {
+    "requests_per_minute": 60,
+    "requests_per_day": 24 * 3600,
+    "tokens_per_minute": 60,
+    "tokens_per_day": 24 * 3600,
+}
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+def _status_code(error):
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status
+
+
+def retry_after(error):
+    """
+    Returns the seconds a rate limited response asks to wait before retrying, or None if it does not say.
+    """
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        if headers.get('retry-after-ms') is not None:
+            return float(headers['retry-after-ms']) / 1000
+        value = headers.get('retry-after')
+        if value is None:
+            return None
+        try:
+            return max(0., float(value))
+        except ValueError:
+            # An HTTP date instead of seconds
+            return max(0., (email.utils.parsedate_to_datetime(value) - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(texts, max_tokens=0):
+    """
+    Rough token count of a request before it is sent: about 4 characters per token of the prompt,
+    plus the most the response may use.
+    """
+    return sum(len(text) for text in texts) // 4 + max_tokens
+
+
+class RateLimiter:
+    """
+    Token buckets for the requests and tokens per minute and per day of one API key and model, kept
+    in SQLite so every thread and process using the key shares them. 'limits' maps the names in
+    BUCKETS to their capacity; missing ones are not limited. Requests wait until the buckets can pay
+    for them, and requests the provider rejects with 429 are retried after its Retry-After or an
+    exponential backoff with jitter, pausing every other user of the key as well.
+    """
+    def __init__(self, name, limits=None, path=pathlib.Path('keys', 'rate_limits.db'), max_retries=MAX_RETRIES,
+                 base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+        self.name = name
+        self.limits = {bucket: float(capacity) for bucket, capacity in (limits or {}).items()
+                       if bucket in BUCKETS and capacity}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.cursor = self.connection.cursor()
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS "rate_buckets" (
+                                   "name" TEXT NOT NULL,
+                                   "bucket" TEXT NOT NULL,
+                                   "level" REAL NOT NULL,
+                                   "updated" REAL NOT NULL,
+                                   PRIMARY KEY ("name", "bucket")
+                               )''')
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS "rate_pauses" (
+                                   "name" TEXT PRIMARY KEY,
+                                   "until" REAL NOT NULL
+                               )''')
+
+    def _levels(self, now):
+        """
+        Returns the current level of every limited bucket, refilled for the time since it was last updated.
+        Must be called inside a transaction.
+        """
+        self.cursor.execute('''SELECT "bucket", "level", "updated" FROM "rate_buckets" WHERE "name" = ?''', (self.name,))
+        stored = {bucket: (level, updated) for bucket, level, updated in self.cursor.fetchall()}
+        levels = {}
+        for bucket, capacity in self.limits.items():
+            level, updated = stored.get(bucket, (capacity, now))
+            levels[bucket] = min(capacity, level + (now - updated) * capacity / BUCKETS[bucket])
+        return levels
+
+    def _save(self, levels, now):
+        self.cursor.executemany('''INSERT OR REPLACE INTO "rate_buckets" ("name", "bucket", "level", "updated")
+                                   VALUES (?, ?, ?, ?)''', [(self.name, bucket, level, now) for bucket, level in levels.items()])
+
+    def _try_acquire(self, tokens):
+        """
+        Takes one request and 'tokens' tokens from the buckets if they all have enough.
+        Returns 0 on success, otherwise the seconds to wait before trying again.
+        """
+        with self.lock:
+            now = time.time()
+            self.cursor.execute('BEGIN IMMEDIATE')
+            try:
+                self.cursor.execute('''SELECT "until" FROM "rate_pauses" WHERE "name" = ?''', (self.name,))
+                row = self.cursor.fetchone()
+                if row is not None and row[0] > now:
+                    self.cursor.execute('COMMIT')
+                    return row[0] - now
+                levels = self._levels(now)
+                wait = 0
+                for bucket, level in levels.items():
+                    # A request larger than a whole bucket only waits for the bucket to be full
+                    cost = min(1 if bucket.startswith('requests') else tokens, self.limits[bucket])
+                    if level < cost:
+                        wait = max(wait, (cost - level) * BUCKETS[bucket] / self.limits[bucket])
+                if wait == 0:
+                    for bucket in levels:
+                        levels[bucket] -= 1 if bucket.startswith('requests') else tokens
+                    self._save(levels, now)
+                self.cursor.execute('COMMIT')
+            except BaseException:
+                self.cursor.execute('ROLLBACK')
+                raise
+        return wait
+
+    def acquire(self, tokens=0, timeout=None):
+        """
+        Blocks until one request of about 'tokens' tokens may be sent.
+        Raises RateLimitExceeded if that would take longer than 'timeout' seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait == 0:
+                return
+            if deadline is not None and time.monotonic() + wait > deadline:
+                raise RateLimitExceeded(f"{self.name}: no capacity for {tokens} tokens within {timeout} seconds")
+            logging.info(f"Rate limit of {self.name} reached, waiting {wait:.1f} seconds.")
+            # Wakes up slightly apart from other waiters, so they do not all retry at once
+            time.sleep(wait + random.uniform(0, 0.1))
+
+    def settle(self, estimated, used):
+        """
+        Corrects the token buckets once the tokens a request really used are known.
+        """
+        token_buckets = [bucket for bucket in self.limits if bucket.startswith('tokens')]
+        if not token_buckets or used is None or used == estimated:
+            return
+        with self.lock:
+            now = time.time()
+            self.cursor.execute('BEGIN IMMEDIATE')
+            try:
+                levels = self._levels(now)
+                for bucket in token_buckets:
+                    # May go below zero, so requests that used more than estimated delay the next ones
+                    levels[bucket] = min(self.limits[bucket], levels[bucket] + estimated - used)
+                self._save(levels, now)
+                self.cursor.execute('COMMIT')
+            except BaseException:
+                self.cursor.execute('ROLLBACK')
+                raise
+
+    def pause(self, seconds):
+        """
+        Stops every user of this key from sending requests for 'seconds'.
+        """
+        with self.lock:
+            until = time.time() + seconds
+            self.cursor.execute('''INSERT INTO "rate_pauses" ("name", "until") VALUES (?, ?)
+                                   ON CONFLICT ("name") DO UPDATE SET "until" = MAX("until", excluded."until")''',
+                                (self.name, until))
+
+    def backoff(self, attempt, error=None):
+        """
+        Seconds to wait before retry number 'attempt' (from 0): the server's Retry-After if it sent one,
+        otherwise an exponential backoff with full jitter.
+        """
+        seconds = retry_after(error) if error is not None else None
+        if seconds is not None:
+            return min(seconds, self.max_delay) + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, request, tokens=0, usage=None, timeout=None):
+        """
+        Sends request() within the limits, retrying it while the provider rate limits it or is unavailable.
+        'tokens' is the estimated size of the request and usage(response) returns the tokens it really
+        used, or None if unknown. Raises RateLimitExceeded if capacity is not free within 'timeout' seconds.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire(tokens, timeout)
+            try:
+                response = request()
+            except Exception as e:
+                if _status_code(e) not in RETRY_STATUS or attempt == self.max_retries:
+                    raise
+                delay = self.backoff(attempt, e)
+                logging.warning(f"Request to {self.name} failed with status {_status_code(e)}, "
+                                f"retrying in {delay:.1f} seconds.")
+                if _status_code(e) == 429:
+                    self.pause(delay)
+                else:
+                    time.sleep(delay)
+                continue
+            if usage is not None:
+                self.settle(tokens, usage(response))
+            return response
+
+    def close_connection(self):
+        self.connection.close()
+
+
+def usage_tokens(response):
+    """
+    Total tokens of a chat completion response, from its usage report.
+    """
+    return getattr(getattr(response, 'usage', None), 'total_tokens', None)
@@ -0,0 +1,7 @@
+import random
+
+EXPECTED = "O(n)"
+
+
+def generate_input(size):
+    return ([random.randint(0, size // 2) for _ in range(size)],)
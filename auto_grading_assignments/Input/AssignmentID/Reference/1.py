@@ -0,0 +1,2 @@
+def solution(arr):
+    return list(dict.fromkeys(arr))
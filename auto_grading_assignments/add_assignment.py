@@ -1,8 +1,11 @@
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from backend.api.get_test_case import ASK_GPT4
+from backend.api.api_pool import ApiPool
 from backend.directory.make_test_files import Make_Files
+from backend.directory.result_cache import ResponseCache
 from backend.directory.getinput import GetInputs
 from database.DataBase import Connect_DB
+from database.token_ledger import TokenLedger
 import pathlib
 import sys
 import json, os, logging
@@ -18,8 +21,8 @@ add_assignment_logger.addHandler(add_assignment_handler)
 add_assignment_logger.setLevel(logging.INFO)
 add_assignment_logger.propagate = False
 
-def generate_description(test_case_maker, question, subject):
-    return test_case_maker.get_test_cases(question, subject)
+def generate_description(test_case_maker, question, subject, assignment=None):
+    return test_case_maker.get_test_cases(question, subject, assignment)
 
 def write_description(description, dir, file_name, write_json=True):
     Make_Files.make_question(description=description, directory=dir, file_name=file_name)
@@ -39,13 +42,17 @@ def write_description(description, dir, file_name, write_json=True):
     with open(test_cases_path, 'w') as f:
         json.dump(test_cases, f, indent=4)
 
-def make_assignment(dir, secret_key, endpoint, model_name):
-    test_case_maker = ASK_GPT4(secret_key, endpoint=endpoint, model_name=model_name)
+def make_assignment(dir, config):
+    cache = ResponseCache()
+    # Keys of "api_pool" in tester_config.json, or its one key
+    pool = ApiPool.from_config(config, ASK_GPT4.make_client)
+    ledger = TokenLedger()
+    test_case_maker = ASK_GPT4(None, endpoint=None, model_name=None, cache=cache, pool=pool, ledger=ledger)
     get_questions = GetInputs(dir=dir, solution=False)
     subject = 'Python'
     
     with ThreadPoolExecutor() as executor:
-        future_to_filename = {executor.submit(generate_description, test_case_maker, question, subject): file_name
+        future_to_filename = {executor.submit(generate_description, test_case_maker, question, subject, pathlib.Path(dir).name): file_name
                               for file_name, question in get_questions.questions.items()}
         
         for future in as_completed(future_to_filename):
@@ -55,6 +62,9 @@ def make_assignment(dir, secret_key, endpoint, model_name):
                 write_description(description, dir, file_name)
             except Exception as e:
                 print(f"Error processing file {file_name}: {e}")
+    cache.close_connection()
+    pool.close_connection()
+    ledger.close_connection()
 
 if __name__ == '__main__':
     if len(sys.argv) < 2:
@@ -68,13 +78,8 @@ if __name__ == '__main__':
 
     with open("Keys/tester_config.json") as file:
         config = json.load(file)
-        endpoint = config["endpoint"]
-        model_name = config["model_name"]
-
-    with open('Keys/key.txt') as file:
-        key = file.readline().strip()
         
-    make_assignment(dir, key, endpoint, model_name)
+    make_assignment(dir, config)
 
     db_path = os.path.join('database', 'data.db')
     db = Connect_DB(db_path)
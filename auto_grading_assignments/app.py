@@ -8,7 +8,11 @@ from wtforms import StringField, EmailField, SubmitField
 from wtforms.validators import DataRequired, Email
 from werkzeug.utils import secure_filename
 from database.DataBase import Connect_DB
+from backend.directory.result_cache import TestResultCache
+from backend.directory.clustering import SolutionClusters
 import add_assignment
+import grading_service
+import resend_feedback
 import re
 
 # Configure logging
@@ -177,6 +181,24 @@ def edit_test_cases(assignment_name):
                 add_assignment.write_description(description=test_case, dir=assignment_folder, file_name=file_name, write_json=False)
                 app_logger.info("Saved test case description for file '%s' in assignment '%s'.", file_name, assignment_name)
 
+            # Results cached against the old test cases are no longer valid, nor the grades reused from them
+            cache = TestResultCache()
+            cache.invalidate(assignment_name, list(new_test_cases))
+            cache.close_connection()
+            clusters = SolutionClusters()
+            clusters.invalidate(assignment_name, list(new_test_cases))
+            clusters.close_connection()
+            # Stored grades of these questions were for the old test cases, even for unchanged solutions
+            with open(os.path.join(assignment_folder, 'config.json')) as f:
+                assignment_config = json.load(f)
+            db = Connect_DB(os.path.join('database', 'data.db'))
+            try:
+                assignment_id = db.get_assignment_id(assignment_config['assignment_topic'], assignment_config['subject_name'],
+                                                     assignment_config['batch_number'])
+                db.invalidate_question_grades(assignment_id, list(new_test_cases))
+            finally:
+                db.close_connection()
+
             flash("Test cases updated successfully.", "success")
             app_logger.info("Test cases for assignment '%s' updated.", assignment_name)
             return redirect(url_for('teacher_dashboard'))
@@ -265,11 +287,55 @@ def upload_solutions(assignment_name):
             app_logger.info("Uploaded solution for question #%s by student '%s'.", question_num, student_name)
 
     flash("All solutions uploaded successfully!", "success")
-    os.system(f'python grade_scheduler.py {assignment_name} {student_email}')
+    grading_service.get_service().enqueue(assignment_name, student_email)
     app_logger.info("Grading scheduled for assignment '%s' for student '%s'.", assignment_name, student_email)
 
     return redirect(url_for('view_assignment', assignment_name=assignment_name))
 
+@app.route('/regrade', methods=['POST'])
+def regrade():
+    assignment_name = request.form.get('assignment_name', '').strip()
+    student_email = request.form.get('student_email', '').strip()
+
+    # Only an assignment folder directly in Input, so the name can not point anywhere else
+    if assignment_name not in os.listdir('Input') or not os.path.isdir(os.path.join('Input', assignment_name)) \
+            or not student_email:
+        flash("Enter an existing assignment and a student email to regrade.", "danger")
+        app_logger.warning("Regrade of '%s' for '%s' rejected.", assignment_name, student_email)
+        return redirect(url_for('teacher_dashboard'))
+
+    # Teacher regrades skip ahead of the student submissions waiting in the queue
+    grading_service.get_service().enqueue(assignment_name, student_email, regrade=True)
+    flash(f"Regrade of {assignment_name} for {student_email} scheduled.", "success")
+    app_logger.info("Regrade scheduled for assignment '%s' for student '%s'.", assignment_name, student_email)
+    return redirect(url_for('teacher_dashboard'))
+
+@app.route('/resend_feedback', methods=['POST'])
+def resend_feedback_email():
+    assignment_name = request.form.get('assignment_name', '').strip()
+    student_email = request.form.get('student_email', '').strip()
+
+    # Only an assignment folder directly in Input, so the name can not point anywhere else
+    if assignment_name not in os.listdir('Input') or not os.path.isdir(os.path.join('Input', assignment_name)) \
+            or not student_email:
+        flash("Enter an existing assignment and a student email to resend feedback.", "danger")
+        app_logger.warning("Resending feedback of '%s' to '%s' rejected.", assignment_name, student_email)
+        return redirect(url_for('teacher_dashboard'))
+
+    # The stored feedback is sent again, without testing or grading the submission
+    try:
+        sent = resend_feedback.resend_feedback(assignment_name, student_email)
+    except Exception as e:
+        flash(f"Failed to resend the feedback of {assignment_name} to {student_email}.", "danger")
+        app_logger.error("Resending feedback of '%s' to '%s' failed: %s", assignment_name, student_email, e)
+        return redirect(url_for('teacher_dashboard'))
+    if not sent:
+        flash(f"No graded submission of {assignment_name} for {student_email} to resend.", "warning")
+        return redirect(url_for('teacher_dashboard'))
+    flash(f"Feedback of {assignment_name} resent to {student_email}.", "success")
+    app_logger.info("Feedback of assignment '%s' resent to student '%s'.", assignment_name, student_email)
+    return redirect(url_for('teacher_dashboard'))
+
 if __name__ == '__main__':
     app_logger.info("Starting Flask app...")
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,300 @@
+import datetime
+import json
+import logging
+import pathlib
+import sqlite3
+import threading
+import time
+
+from backend.api.rate_limiter import RateLimiter, RateLimitExceeded
+
+# Consecutive failures after which a key is taken out of rotation, and for how long at first.
+# Every further failure doubles the time, up to MAX_COOLDOWN.
+FAILURE_THRESHOLD = 3
+COOLDOWN = 10 * 60
+MAX_COOLDOWN = 24 * 3600
+# Rejected credentials will not start working by themselves
+AUTH_COOLDOWN = 6 * 3600
+# Errors of the openai, httpx and azure clients raised when an endpoint can not be reached or does not answer in time
+CONNECTION_ERRORS = {'APIConnectionError', 'APITimeoutError', 'ConnectError', 'ConnectTimeout', 'ReadTimeout',
+                     'TimeoutException', 'ServiceRequestError', 'ServiceResponseError'}
+
+
+class NoApiKeyAvailable(Exception):
+    pass
+
+
+def _status_code(error):
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status
+
+
+def is_key_failure(error):
+    """
+    Tells whether an error is the key's or endpoint's fault (unreachable, overloaded, rate limited or
+    unauthorized) rather than the request's, so that another key may succeed. Local errors, like a
+    RateLimitExceeded of our own limiter, say nothing about the key.
+    """
+    status = _status_code(error)
+    if status is not None:
+        return status in (401, 403, 408, 429) or status >= 500
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return any(cls.__name__ in CONNECTION_ERRORS for cls in type(error).__mro__)
+
+
+class ApiKey:
+    """
+    One credential of the pool: an endpoint, a model, its token and its daily request limit, None for no limit.
+    """
+    def __init__(self, name, endpoint, model_name, token, requests_limit, rate_limits=None):
+        self.name = name
+        self.endpoint = endpoint
+        self.model_name = model_name
+        self.token = token
+        self.requests_limit = int(requests_limit) if requests_limit else None
+        self.rate_limits = rate_limits
+        self.client = None
+        self.rate_limiter = None
+
+
+class ApiPool:
+    """
+    Credentials and endpoints used in turn, each with its own daily quota, rate limits and health.
+    Every request goes to the key in rotation with the most requests left today. Keys failing
+    FAILURE_THRESHOLD times in a row, or rejecting their credentials, are taken out of rotation for
+    a cooldown. Quotas and health are kept in SQLite, so every grader and test case generator
+    process shares them.
+    """
+    def __init__(self, keys, make_client=None, path=pathlib.Path('database', 'cache.db')):
+        if not keys:
+            raise ValueError("The API pool needs at least one key")
+        self.keys = {key.name: key for key in keys}
+        self.make_client = make_client
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.cursor = self.connection.cursor()
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS "api_keys" (
+                                   "name" TEXT PRIMARY KEY,
+                                   "day" TEXT NOT NULL,
+                                   "used" INTEGER NOT NULL DEFAULT 0,
+                                   "failures" INTEGER NOT NULL DEFAULT 0,
+                                   "disabled_until" REAL NOT NULL DEFAULT 0,
+                                   "last_error" TEXT
+                               )''')
+
+    @classmethod
+    def from_config(cls, config, make_client=None, key_file=pathlib.Path('Keys', 'key.txt'), **kwargs):
+        """
+        Builds the pool of a config file. Its "api_pool" lists the keys as objects with "name",
+        "endpoint", "model_name", "key_file", "requests_limit" and optionally "rate_limits"; missing
+        fields default to the top level settings. Without "api_pool" the pool has the one key of the config.
+        """
+        entries = config.get('api_pool') or [{"name": "default"}]
+        keys = []
+        for i, entry in enumerate(entries):
+            with open(entry.get('key_file', key_file)) as file:
+                token = file.readline().strip()
+            keys.append(ApiKey(entry.get('name', f"key{i + 1}"),
+                               entry.get('endpoint', config.get('endpoint')),
+                               entry.get('model_name', config.get('model_name')),
+                               token,
+                               entry.get('requests_limit', config.get('requests_limit')),
+                               entry.get('rate_limits', config.get('rate_limits'))))
+        return cls(keys, make_client, **kwargs)
+
+    @property
+    def model_name(self):
+        return next(iter(self.keys.values())).model_name
+
+    def _states(self):
+        """
+        Returns the requests used today and the health of every key. Must be called inside a transaction.
+        """
+        today = str(datetime.date.today())
+        self.cursor.execute(f'''SELECT "name", "day", "used", "failures", "disabled_until" FROM "api_keys"
+                                WHERE "name" IN ({', '.join('?' * len(self.keys))})''', list(self.keys))
+        stored = {row[0]: row[1:] for row in self.cursor.fetchall()}
+        states = {}
+        for name in self.keys:
+            day, used, failures, disabled_until = stored.get(name, (today, 0, 0, 0))
+            states[name] = {"used": used if day == today else 0, "failures": failures, "disabled_until": disabled_until}
+        return states
+
+    def _in_rotation(self, state, now):
+        return state["disabled_until"] <= now
+
+    def _left(self, key, state):
+        return float('inf') if key.requests_limit is None else key.requests_limit - state["used"]
+
+    def requests_limit(self):
+        """
+        Daily requests of the keys in rotation, the budget the grading scheduler may plan with.
+        Keys without a limit do not add to it.
+        """
+        with self.lock:
+            now = time.time()
+            self.cursor.execute('BEGIN')
+            try:
+                states = self._states()
+            finally:
+                self.cursor.execute('COMMIT')
+        return sum(key.requests_limit or 0 for name, key in self.keys.items() if self._in_rotation(states[name], now))
+
+    def requests_left(self):
+        """
+        Requests the keys in rotation have left today, after grading, test case generation and every other use.
+        Keys without a limit do not add to it.
+        """
+        with self.lock:
+            now = time.time()
+            self.cursor.execute('BEGIN')
+            try:
+                states = self._states()
+            finally:
+                self.cursor.execute('COMMIT')
+        return sum(max(0, self._left(key, states[name])) for name, key in self.keys.items()
+                   if key.requests_limit is not None and self._in_rotation(states[name], now))
+
+    def choose(self, exclude=()):
+        """
+        Takes one request from the quota of the key in rotation with the most requests left today and returns the key.
+        Keys named in 'exclude' are skipped. Raises NoApiKeyAvailable when every key is out of rotation or out of requests.
+        """
+        with self.lock:
+            now = time.time()
+            self.cursor.execute('BEGIN IMMEDIATE')
+            try:
+                states = self._states()
+                left = {name: self._left(key, states[name]) for name, key in self.keys.items()
+                        if name not in exclude and self._in_rotation(states[name], now) and self._left(key, states[name]) > 0}
+                if not left:
+                    self.cursor.execute('COMMIT')
+                    raise NoApiKeyAvailable("Every API key is out of rotation or out of requests for today")
+                name = max(left, key=left.get)
+                self.cursor.execute('''INSERT INTO "api_keys" ("name", "day", "used") VALUES (?, ?, 1)
+                                       ON CONFLICT ("name") DO UPDATE SET "used" = ?, "day" = excluded."day"''',
+                                    (name, str(datetime.date.today()), states[name]["used"] + 1))
+                self.cursor.execute('COMMIT')
+            except NoApiKeyAvailable:
+                raise
+            except BaseException:
+                self.cursor.execute('ROLLBACK')
+                raise
+            key = self.keys[name]
+            if key.client is None and self.make_client is not None:
+                key.client = self.make_client(key.endpoint, key.token)
+            if key.rate_limiter is None:
+                # With other keys to fail over to, a rate limited key is only retried once
+                key.rate_limiter = RateLimiter(f"{key.endpoint} {key.model_name} {key.name}", key.rate_limits,
+                                               path=self.path, **({"max_retries": 1} if len(self.keys) > 1 else {}))
+        return key
+
+    def give_back(self, key):
+        """
+        Returns a request taken by choose() that was never sent to the key's quota.
+        """
+        with self.lock:
+            self.cursor.execute('''UPDATE "api_keys" SET "used" = MAX(0, "used" - 1) WHERE "name" = ? AND "day" = ?''',
+                                (key.name, str(datetime.date.today())))
+
+    def record(self, key, error=None):
+        """
+        Resets a key's failures after a success, or counts a failure and takes the key out of rotation
+        once it failed too often. A failed request is given back to the key's quota.
+        """
+        with self.lock:
+            now = time.time()
+            if error is None:
+                self.cursor.execute('''UPDATE "api_keys" SET "failures" = 0, "disabled_until" = 0 WHERE "name" = ?''',
+                                    (key.name,))
+                return
+            self.cursor.execute('BEGIN IMMEDIATE')
+            try:
+                failures = self._states()[key.name]["failures"] + 1
+                disabled_until = 0
+                if _status_code(error) in (401, 403):
+                    disabled_until = now + AUTH_COOLDOWN
+                elif failures >= FAILURE_THRESHOLD:
+                    disabled_until = now + min(MAX_COOLDOWN, COOLDOWN * 2 ** (failures - FAILURE_THRESHOLD))
+                self.cursor.execute('''INSERT INTO "api_keys" ("name", "day", "failures", "disabled_until", "last_error")
+                                       VALUES (?, ?, ?, ?, ?)
+                                       ON CONFLICT ("name") DO UPDATE SET "used" = MAX(0, "used" - 1),
+                                           "failures" = excluded."failures",
+                                           "disabled_until" = excluded."disabled_until", "last_error" = excluded."last_error"''',
+                                    (key.name, str(datetime.date.today()), failures, disabled_until,
+                                     f"{type(error).__name__}: {error}"[:500]))
+                self.cursor.execute('COMMIT')
+            except BaseException:
+                self.cursor.execute('ROLLBACK')
+                raise
+        if disabled_until:
+            logging.warning(f"API key {key.name} taken out of rotation for {(disabled_until - now) / 60:.0f} minutes "
+                            f"after {failures} failures: {error}")
+
+    def call(self, send, tokens=0, usage=None, timeout=None):
+        """
+        Sends send(client, model_name) with a key of the pool, within that key's rate limits. Fails over to
+        the next key when one fails for reasons of its own or has no capacity within 'timeout' seconds;
+        errors caused by the request are raised right away.
+        """
+        error = None
+        tried = set()
+        for _ in range(len(self.keys)):
+            try:
+                key = self.choose(tried)
+            except NoApiKeyAvailable:
+                if error is not None:
+                    raise error
+                raise
+            try:
+                response = key.rate_limiter.call(lambda: send(key.client, key.model_name), tokens, usage, timeout)
+            except RateLimitExceeded as e:
+                # Busy, not failing: the request was never sent
+                self.give_back(key)
+                tried.add(key.name)
+                error = e
+                continue
+            except Exception as e:
+                if not is_key_failure(e):
+                    raise
+                self.record(key, e)
+                tried.add(key.name)
+                logging.warning(f"Request with API key {key.name} failed, trying another key: {e}")
+                error = e
+                continue
+            self.record(key)
+            return response
+        raise error
+
+    def stats(self):
+        with self.lock:
+            now = time.time()
+            self.cursor.execute('BEGIN')
+            try:
+                states = self._states()
+                self.cursor.execute('''SELECT "name", "last_error" FROM "api_keys"''')
+                errors = dict(self.cursor.fetchall())
+            finally:
+                self.cursor.execute('COMMIT')
+        return {name: {"endpoint": key.endpoint, "model_name": key.model_name, "requests_limit": key.requests_limit,
+                       "requests_left": max(0, self._left(key, states[name])),
+                       "in_rotation": self._in_rotation(states[name], now), "failures": states[name]["failures"],
+                       "last_error": errors.get(name)}
+                for name, key in self.keys.items()}
+
+    def close_connection(self):
+        for key in self.keys.values():
+            if key.rate_limiter is not None:
+                key.rate_limiter.close_connection()
+        self.connection.close()
+
+
+if __name__ == '__main__':
+    with open(pathlib.Path('Keys', 'autograder_config.json')) as file:
+        pool = ApiPool.from_config(json.load(file))
+    print(json.dumps(pool.stats(), indent=4))
+    pool.close_connection()
@@ -1,65 +1,146 @@
 from openai import OpenAI
+import json
 import logging
+import re
+import threading
+from backend.api.rate_limiter import usage_tokens, ACQUIRE_TIMEOUT
+from backend.api.prompt_builder import count_tokens, grading_messages, batch_messages
 
 class HomeworkGrader:
-    def __init__(self, token, endpoint, model_name, output_limit):
-        self.client = OpenAI(
+    def __init__(self, token, endpoint, model_name, output_limit, cache=None, rate_limiter=None, pool=None, ledger=None,
+                 tiers=None):
+        # With an ApiPool every request goes to one of its keys instead of this token and endpoint
+        self.pool = pool
+        self.client = self.make_client(endpoint, token) if pool is None else None
+        self.model_name = model_name if pool is None else pool.model_name
+        self.output_words = output_limit  
+        # Optional ResponseCache, so identical requests are not paid for twice
+        self.cache = cache
+        # Optional RateLimiter shared by every client of the API key, retrying rate limited requests
+        self.rate_limiter = rate_limiter
+        # Optional TokenLedger recording the tokens of every request sent
+        self.ledger = ledger
+        # Optional GradingTiers trying a cheaper tier before this model
+        self.tiers = tiers
+        # Model and tokens of the requests of each grading thread, see usage()
+        self.local = threading.local()
+
+    @staticmethod
+    def make_client(endpoint, token):
+        return OpenAI(
             base_url=endpoint,
             api_key=token,
         )
-        self.model_name = model_name
-        self.output_words = output_limit  
 
-    def grade_answer(self, question, answer, full_score):
-        response = self.client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert in Python algorithms and data structures. Your task is to evaluate student answers and provide a score along with detailed feedback. Always start with 'Score: X/{full_score}'. If the answer is irrelevant, give a score of 0/{full_score}.",
-                },
-                {
-                    "role": "user",
-                    "content": f"""Evaluate the following assignment for total score{full_score}:
+    def usage(self):
+        """
+        Returns the model of the last request of the calling thread and the tokens of all its requests
+        since the last call, and starts counting again.
+        """
+        usage = getattr(self.local, 'usage', None) or {"model": None, "tokens": 0}
+        self.local.usage = None
+        return usage
 
-    Question: {question}
-    Answer: {answer}
-```json
-Scoring Criteria:
+    def _count_usage(self, model, tokens):
+        usage = getattr(self.local, 'usage', None) or {"model": None, "tokens": 0}
+        self.local.usage = {"model": model, "tokens": usage["tokens"] + tokens}
 
-    Correctness (40%): Is the solution logically correct and does it solve the problem?
-    Efficiency (30%): Is the solution optimized in terms of time and space complexity?
-    Code Quality (20%): Is the code well-organized, readable, and properly commented?
-    Creativity (10%): Does the solution demonstrate innovative thinking or unique approaches?
+    def complete(self, messages, max_tokens, tags=None, model_name=None):
+        """
+        Sends a chat completion request, or answers it from the cache when the same request was made before.
+        'tags' are the assignment, student_email, job_id and claim time ("claimed") its tokens are recorded
+        for in the ledger. 'model_name' is another model of the same endpoint to send the request to.
+        """
+        model = model_name or self.model_name
+        # Models the request was sent to, the last one answering it; a pool may fail over to a key with another model
+        served = []
 
-Feedback Guidelines:
+        def send(client, key_model_name):
+            served.append(model_name or key_model_name)
+            return client.chat.completions.create(
+                messages=messages,
+                model=served[-1],
+                temperature=1.,
+                max_tokens=max_tokens,
+                top_p=1.
+            )
 
-    Provide a breakdown of the score based on the criteria.
-    Highlight strengths and suggest specific improvements.
-    Use bullet points for clarity.
+        def request():
+            tokens = sum(count_tokens(m["content"]) for m in messages) + max_tokens
+            if self.pool is not None:
+                response = self.pool.call(send, tokens, usage_tokens, ACQUIRE_TIMEOUT)
+            elif self.rate_limiter is not None:
+                response = self.rate_limiter.call(lambda: send(self.client, model), tokens, usage_tokens, ACQUIRE_TIMEOUT)
+            else:
+                response = send(self.client, model)
+            if self.ledger is not None:
+                self.ledger.record('grading', served[-1], response, tokens, **(tags or {}))
+            self._count_usage(served[-1], usage_tokens(response) or tokens)
+            logging.info(f"API request made.")
+            return response.choices[0].message.content
 
-Example Output:
+        # Cached answers count for the model without tokens
+        self._count_usage(model, 0)
+        if self.cache is None:
+            return request()
+        return self.cache.cached(model, [(m["role"], m["content"]) for m in messages], request,
+                                 temperature=1., max_tokens=max_tokens, top_p=1.)
 
-Score: 8.5/{full_score}({full_score} total score)
+    def grade_answer(self, question, answer, full_score, tags=None, test_score=None, escalate=False):
+        """
+        Grades one answer. With tiers, 'test_score' (in percent) decides whether a cheaper tier's grade
+        is kept, and 'escalate' sends the answer straight to this grader's model.
+        """
+        if self.tiers is not None:
+            return self.tiers.grade(self, question, answer, full_score, tags, test_score, escalate)
+        return self.complete(grading_messages(question, answer, full_score), self.output_words, tags)
 
-Feedback:
+    def grade_answers(self, items, full_score, tags=None, test_scores=None):
+        """
+        Grades several answers of one student in a single request. 'items' is a list of
+        (question_id, question, answer). Returns a dictionary of question_id to (score, feedback)
+        for the answers graded in a valid format; the others are left out to be graded one by one.
+        With tiers, grades a cheaper tier is not sure of are left out too.
+        """
+        if self.tiers is not None:
+            return self.tiers.grade_batch(self, items, full_score, tags, test_scores)
+        content = self.complete(batch_messages(items, full_score), self.output_words * len(items), tags)
+        logging.info(f"Batched grading request made for {len(items)} questions.")
 
-    Well done on solving the problem correctly.
-    Consider optimizing the loop to reduce time complexity.
-    Add comments to improve code readability.
+        return self.parse_grades(content, [item[0] for item in items], full_score)
 
-Best regards, Sabudh Foundation
-```
-""",
-                }
-            ],
-            model=self.model_name,
-            temperature=1.,
-            max_tokens=self.output_words,
-            top_p=1.
-        )
-        logging.info(f"API request made.")
+    @staticmethod
+    def parse_grades(content, question_ids, full_score):
+        """
+        Validates a batched grading response. Returns a dictionary of question_id to (score, feedback).
+        """
+        match = re.search(r'\{.*\}', content or '', re.DOTALL)
+        try:
+            grades = json.loads(match.group(0))["grades"] if match else []
+        except (ValueError, KeyError, TypeError):
+            grades = []
+        if not isinstance(grades, list):
+            grades = []
 
-        return response.choices[0].message.content
+        results = {}
+        expected = set(map(str, question_ids))
+        for grade in grades:
+            if not isinstance(grade, dict):
+                continue
+            question_id = str(grade.get("question_id"))
+            score = grade.get("score")
+            feedback = grade.get("feedback")
+            if question_id not in expected or question_id in results:
+                continue
+            if isinstance(score, bool) or not isinstance(score, (int, float)) or not 0 <= score <= full_score:
+                continue
+            if not isinstance(feedback, str) or not feedback.strip():
+                continue
+            results[question_id] = (score, feedback.strip())
+        missing = expected - set(results)
+        if missing:
+            logging.warning(f"Batched grading response has no valid grade for questions {sorted(missing)}.")
+        return results
 
 # Example usage:
 # grader = HomeworkGrader(token, endpoint, model_name, assignment)
@@ -1,40 +1,54 @@
 from azure.ai.inference import ChatCompletionsClient
 from azure.ai.inference.models import SystemMessage, UserMessage
 from azure.core.credentials import AzureKeyCredential
+from backend.api.rate_limiter import estimate_tokens, usage_tokens, ACQUIRE_TIMEOUT
 
 class ASK_GPT4:
-    def __init__(self, secret_key, endpoint, model_name):
-        self.model = model_name
-        self.client = ChatCompletionsClient(
+    def __init__(self, secret_key, endpoint, model_name, cache=None, rate_limiter=None, pool=None, ledger=None):
+        # With an ApiPool every request goes to one of its keys instead of this key and endpoint
+        self.pool = pool
+        self.model = model_name if pool is None else pool.model_name
+        self.client = self.make_client(endpoint, secret_key) if pool is None else None
+        # Optional ResponseCache, so the same question is not sent twice
+        self.cache = cache
+        # Optional RateLimiter shared by every client of the API key, retrying rate limited requests
+        self.rate_limiter = rate_limiter
+        # Optional TokenLedger recording the tokens of every request sent
+        self.ledger = ledger
+
+    @staticmethod
+    def make_client(endpoint, secret_key):
+        return ChatCompletionsClient(
                 endpoint=endpoint,
                 credential=AzureKeyCredential(secret_key),
                 )
-
     
-    def get_test_cases(self, question, subject):
-        response = self.client.complete(
-            model=self.model,
-            messages=[
-                SystemMessage(content=f"You are an experienced {subject} tester."),
-                UserMessage(content=f"""Question:{question}
-                            Give Me few but enough Test Cases for testing the logic and rebustness of a solution to the given question in a way that I can just copy paste into a {subject} file and run my tests. The format of your response should be:
+    def get_test_cases(self, question, subject, assignment=None):
+        system_prompt = f"You are an experienced {subject} tester."
+        user_prompt = f"""Question:{question}
+                            Give Me few but enough Test Cases for testing the logic and rebustness of a solution to the given question as JSON data that a test runner calls the solution with. The format of your response should be:
                             Question: `{question}`
                             
                             --Test Cases Start--
-                            ```python
-                            def test_solution(solution):
-                                passed = []
-                                not_passed = []
-                                if solution(parameter1, parameter2) == expected_answer:
-                                    passed.append("Soltuion has passed test case with parameters parameter1, parameter2 and expected result")
-                                else:
-                                    not_passed.append("Soltuion has not passed test case with inputs" + parameter1, parameter2 + " result", expected_result)
-                            
-                                if solution(test_case_input) == expected_answer:
-                                    passed.append("Soltuion has not passed test case with inputs" + test_case_inputs + " result", expected_result)
-                                else:
-                                    not_passed.append("Soltuion has not passed test case with inputs" + test_case_inputs + " result", expected_result)
-                                return passed, not_passed
+                            ```json
+                            {{
+                                "list_node": {{"value": "value", "next": "next"}},
+                                "tree_node": {{"value": "val", "left": "left", "right": "right"}},
+                                "cases": [
+                                    {{
+                                        "name": "short description of what the case checks",
+                                        "inputs": [parameter1, parameter2],
+                                        "expected": expected_answer
+                                    }},
+                                    {{
+                                        "name": "short description of what the case checks",
+                                        "inputs": [{{"linked_list": [1, 3, 5]}}, {{"tree": [4, 2, 7, null, 3]}}],
+                                        "expected": [1, 2, 3],
+                                        "output": "linked_list",
+                                        "compare": "exact"
+                                    }}
+                                ]
+                            }}
                             ```
                             --Test Cases End--
                             
@@ -45,17 +59,44 @@ class ASK_GPT4:
                             - The Function should ouput in such a way \n#Output Layout here#
                             --Constrains End--
                             IMPORTANT: The test cases should test the functionality of all the concepts that are related to topic of the question
-                            Make sure you also implement the Data Structure Classes WITHIN THE test_solution neccessary for running these test cases like when we use Data Structure in a solution, you should have Class of that Data Structure ready WITHIN the test_solution FUNCTION
-                            Make sure you mention that information that should be known to to the student for successing running of test case in constraints, like attribute names of Data ructure Class.                      
-                            At Last the test_solution function should output a tuple of 2 lists `return passed, not_passed` in that order.
-                            DO NOT GIVE ME THE SOLUTION TO THIS PROBLEM"""),
-            ],
-            temperature=0.1,
-            max_tokens=2000,
-            top_p=1.0
-            )
-        
-        return response.choices[0].message.content
+                            "inputs" is the list of arguments 'solution' is called with, as plain JSON values. An argument can also be an object with one key naming a builder: {{"linked_list": [values]}} builds a linked list, {{"tree": [level order values with null for missing children]}} a binary tree, {{"tuple": [values]}} a tuple and {{"set": [values]}} a set. "list_node" and "tree_node" give the attribute names of the nodes built; leave them out if the question uses linked lists or trees with the default names, or none at all.
+                            "output" converts what 'solution' returns before comparing it with "expected": "linked_list" and "tree" turn nodes back into the value lists above, "sorted" and "set" ignore the order of the items. "compare" is "exact" (the default), "unordered" for lists in any order or "float" for floating point results. Leave out keys you do not need.
+                            Make sure you mention that information that should be known to to the student for successing running of test case in constraints, like attribute names of Data ructure Class.
+                            Only if the inputs or outputs of the question can not be written in this JSON format, give the test cases as Python instead: a ```python block with a `def test_solution(solution):` that implements the Data Structure Classes it needs WITHIN the function and `yield`s one dictionary per test case with the keys "name", "inputs", "expected" and "run", where "run" is a lambda that calls the solution and returns a value that can be compared with "expected" using ==.
+                            DO NOT GIVE ME THE SOLUTION TO THIS PROBLEM"""
+
+        # Models the request was sent to, the last one answering it; a pool may fail over to a key with another model
+        served = []
+
+        def send(client, model_name):
+            served.append(model_name)
+            return client.complete(
+                model=model_name,
+                messages=[
+                    SystemMessage(content=system_prompt),
+                    UserMessage(content=user_prompt),
+                ],
+                temperature=0.1,
+                max_tokens=2000,
+                top_p=1.0
+                )
+
+        def request():
+            tokens = estimate_tokens([system_prompt, user_prompt], 2000)
+            if self.pool is not None:
+                response = self.pool.call(send, tokens, usage_tokens, ACQUIRE_TIMEOUT)
+            elif self.rate_limiter is not None:
+                response = self.rate_limiter.call(lambda: send(self.client, self.model), tokens, usage_tokens, ACQUIRE_TIMEOUT)
+            else:
+                response = send(self.client, self.model)
+            if self.ledger is not None:
+                self.ledger.record('test_cases', served[-1], response, tokens, assignment=assignment)
+            return response.choices[0].message.content
+
+        if self.cache is None:
+            return request()
+        return self.cache.cached(self.model, [("system", system_prompt), ("user", user_prompt)], request,
+                                 temperature=0.1, max_tokens=2000, top_p=1.0)
     
 if __name__ == '__main__':
     import json 
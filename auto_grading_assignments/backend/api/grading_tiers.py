@@ -0,0 +1,179 @@
+import datetime
+import json
+import logging
+import pathlib
+import sqlite3
+import sys
+import threading
+import time
+
+from backend.api.mail import extract_marks_and_feedback
+from backend.api.prompt_builder import grading_messages, batch_messages
+
+TIER_RULES = 'rules'
+TIER_FAST = 'fast'
+TIER_FULL = 'full'
+
+# Scores of the fast model (in percent) too close to call, escalated to the full model
+BORDERLINE = (40, 70)
+# Points (in percent) the fast model's score may differ from the test score before it is escalated
+MAX_DISAGREEMENT = 30
+
+RULES_FEEDBACK = """Score: 0/{full_score}
+
+Feedback:
+
+    None of the test cases passed, so the solution does not solve the problem yet.
+    Run your solution on the examples of the question and compare its output with the expected one.
+    Check the function name and parameters the question asks for."""
+
+
+class GradingTiers:
+    """
+    Grades an answer with the cheapest tier that can be trusted with it. Answers failing every
+    test case can be scored by rule, without a request. The others go to a fast model first,
+    and only when its score is borderline or disagrees with the test score to the full model of
+    the grader. How often each tier's grade is kept and how long it takes are counted per day in
+    SQLite, shared by every grader process.
+    """
+    def __init__(self, model_name=None, rules=False, borderline=BORDERLINE, max_disagreement=MAX_DISAGREEMENT,
+                 max_tokens=None, path=pathlib.Path('database', 'cache.db')):
+        self.model_name = model_name
+        self.rules = rules
+        self.borderline = tuple(borderline)
+        self.max_disagreement = max_disagreement
+        self.max_tokens = max_tokens
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.cursor = self.connection.cursor()
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS "grading_tiers" (
+                                   "day" TEXT NOT NULL,
+                                   "tier" TEXT NOT NULL,
+                                   "model" TEXT NOT NULL,
+                                   "graded" INTEGER NOT NULL DEFAULT 0,
+                                   "kept" INTEGER NOT NULL DEFAULT 0,
+                                   "seconds" REAL NOT NULL DEFAULT 0,
+                                   PRIMARY KEY ("day", "tier", "model")
+                               )''')
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        """
+        Builds the tiers of a "grading_tiers" config object with "model_name" (the fast model), "rules",
+        "borderline", "max_disagreement" and "max_tokens". Returns None when grading is not tiered.
+        """
+        if not config:
+            return None
+        return cls(config.get('model_name'), bool(config.get('rules', False)), config.get('borderline', BORDERLINE),
+                   float(config.get('max_disagreement', MAX_DISAGREEMENT)), config.get('max_tokens'), **kwargs)
+
+    def record(self, tier, model, kept, seconds):
+        with self.lock:
+            self.cursor.execute('''INSERT INTO "grading_tiers" ("day", "tier", "model", "graded", "kept", "seconds")
+                                   VALUES (?, ?, ?, 1, ?, ?)
+                                   ON CONFLICT ("day", "tier", "model") DO UPDATE SET "graded" = "graded" + 1,
+                                       "kept" = "kept" + excluded."kept", "seconds" = "seconds" + excluded."seconds"''',
+                                (str(datetime.date.today()), tier, model or '', int(kept), seconds))
+
+    def confident(self, score, full_score, test_score=None):
+        """
+        Tells whether a fast model's score can be kept: it is neither borderline nor far from the test score.
+        """
+        if score is None or not full_score:
+            return False
+        percent = score / full_score * 100
+        if self.borderline[0] <= percent <= self.borderline[1]:
+            return False
+        return test_score is None or abs(percent - test_score) <= self.max_disagreement
+
+    @staticmethod
+    def score_of(response):
+        marks = extract_marks_and_feedback(response or '')[0]
+        return int(marks) if marks.isdigit() else None
+
+    def grade(self, grader, question, answer, full_score, tags=None, test_score=None, escalate=False):
+        """
+        Grades one answer and returns the response of the tier that graded it. 'test_score' is the
+        percentage of test cases passed, None if the tests could not run. With 'escalate' the answer
+        goes straight to the full model.
+        """
+        messages = grading_messages(question, answer, full_score)
+        if not escalate and self.rules and test_score == 0:
+            self.record(TIER_RULES, None, True, 0)
+            return RULES_FEEDBACK.format(full_score=full_score)
+
+        if not escalate and self.model_name:
+            start = time.perf_counter()
+            try:
+                response = grader.complete(messages, self.max_tokens or grader.output_words, tags, self.model_name)
+            except Exception as e:
+                logging.warning(f"Fast model {self.model_name} failed, escalating: {e}")
+                response = None
+            kept = self.confident(self.score_of(response), full_score, test_score)
+            self.record(TIER_FAST, self.model_name, kept, time.perf_counter() - start)
+            if kept:
+                return response
+            logging.info(f"Escalating an answer scored {self.score_of(response)}/{full_score} by {self.model_name} "
+                         f"with test score {test_score} to {grader.model_name}.")
+
+        start = time.perf_counter()
+        response = grader.complete(messages, grader.output_words, tags)
+        self.record(TIER_FULL, grader.model_name, True, time.perf_counter() - start)
+        return response
+
+    def grade_batch(self, grader, items, full_score, tags=None, test_scores=None):
+        """
+        Grades several answers like grade(), all in one request to the fast model, or to the full one
+        when there is no fast model. Returns a dictionary of question_id to (score, feedback) of the grades
+        kept; the others are to be graded one by one with 'escalate'.
+        """
+        test_scores = test_scores or {}
+        results = {}
+        rest = []
+        for item in items:
+            if self.rules and test_scores.get(item[0]) == 0:
+                self.record(TIER_RULES, None, True, 0)
+                results[item[0]] = (0, extract_marks_and_feedback(RULES_FEEDBACK.format(full_score=full_score))[1])
+            else:
+                rest.append(item)
+        if not rest:
+            return results
+
+        tier, model_name = (TIER_FAST, self.model_name) if self.model_name else (TIER_FULL, grader.model_name)
+        max_tokens = self.max_tokens if tier == TIER_FAST and self.max_tokens else grader.output_words
+        start = time.perf_counter()
+        content = grader.complete(batch_messages(rest, full_score), max_tokens * len(rest), tags, model_name)
+        seconds = (time.perf_counter() - start) / len(rest)
+        graded = grader.parse_grades(content, [item[0] for item in rest], full_score)
+        for question_id, _, _ in rest:
+            if question_id not in graded:
+                self.record(tier, model_name, False, seconds)
+                continue
+            score, feedback = graded[question_id]
+            kept = tier == TIER_FULL or self.confident(score, full_score, test_scores.get(question_id))
+            self.record(tier, model_name, kept, seconds)
+            if kept:
+                results[question_id] = (score, feedback)
+        return results
+
+    def stats(self, day=None):
+        """
+        Returns the answers graded on a day (today by default) by every tier and model, the share of
+        them whose grade was kept and the mean seconds per answer.
+        """
+        with self.lock:
+            self.cursor.execute('''SELECT "tier", "model", "graded", "kept", "seconds" FROM "grading_tiers"
+                                   WHERE "day" = ? ORDER BY "tier", "model"''', (day or str(datetime.date.today()),))
+            rows = self.cursor.fetchall()
+        return [{"tier": tier, "model": model, "graded": graded, "kept_rate": round(kept / graded, 3),
+                 "mean_seconds": round(seconds / graded, 3)}
+                for tier, model, graded, kept, seconds in rows]
+
+    def close_connection(self):
+        self.connection.close()
+
+
+if __name__ == '__main__':
+    tiers = GradingTiers()
+    print(json.dumps(tiers.stats(sys.argv[1] if len(sys.argv) > 1 else None), indent=4))
+    tiers.close_connection()
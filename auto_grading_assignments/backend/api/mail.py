@@ -2,6 +2,8 @@ import smtplib, re
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import sys, json, os
+import socket
+import threading
 
 def send_feedback(smtp_address, to_email, subject, feedback_message, from_email, from_password):
     try:
@@ -30,6 +32,63 @@ def send_feedback(smtp_address, to_email, subject, feedback_message, from_email,
         print(f"Error sending email to {to_email}: {str(e)}")
         print(e)
 
+FEEDBACK_SEPARATOR = '\n- - - - - - - - - - - - - - - - - - - - - - - - - - - - - -\n'
+
+
+def feedback_subject(assignment_topic):
+    return f'Assessment Feedback For Assignment {assignment_topic}.'
+
+
+def compose_feedback(feedbacks):
+    """
+    Joins the feedback of every question of an assignment into one email.
+    """
+    return ''.join(feedback + FEEDBACK_SEPARATOR for feedback in feedbacks)
+
+
+class Mailer:
+    """
+    Keeps one logged in SMTP session open for sending many feedback emails, reconnecting when the server drops it.
+    """
+    def __init__(self, smtp_address, from_email, from_password):
+        self.smtp_address = smtp_address
+        self.from_email = from_email
+        self.from_password = from_password
+        self.server = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        self.server = smtplib.SMTP(self.smtp_address, 587)
+        self.server.starttls()
+        self.server.login(self.from_email, self.from_password)
+
+    def send_feedback(self, to_email, subject, feedback_message):
+        msg = MIMEMultipart()
+        msg['From'] = self.from_email
+        msg['To'] = to_email
+        msg['Subject'] = subject
+        msg.attach(MIMEText(feedback_message, 'plain'))
+
+        with self.lock:
+            if self.server is None:
+                self.connect()
+            try:
+                self.server.send_message(msg)
+            except (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout):
+                # The session timed out or was closed by the server; other SMTP errors are the message's, not the session's
+                self.connect()
+                self.server.send_message(msg)
+        print(f"Feedback sent successfully to {to_email}.")
+
+    def close(self):
+        with self.lock:
+            if self.server is not None:
+                try:
+                    self.server.quit()
+                except (smtplib.SMTPException, OSError):
+                    pass
+                self.server = None
+
 def extract_marks_and_feedback(grading_response):
         # Regular expression to extract marks
         marks_pattern = r'(\d+)\s*/\s*\d+'
@@ -0,0 +1,186 @@
+import io
+import re
+import tokenize
+
+try:
+    import tiktoken
+except ImportError:  # Token counts fall back to an estimate of 4 characters per token
+    tiktoken = None
+
+# Tokens a student's answer and its test results may take up in a grading prompt,
+# unless autograder_config.json sets "prompt_token_budget"
+PROMPT_TOKEN_BUDGET = 3000
+# Failed test cases listed one by one; longer lists are grouped into summaries
+MAX_FAILURES_LISTED = 5
+
+# The instructions are the same for every request and come first, so providers caching the
+# common prefix of prompts only process the question and answer of each request.
+RUBRIC = """Scoring Criteria:
+
+    Correctness (40%): Is the solution logically correct and does it solve the problem?
+    Efficiency (30%): Is the solution optimized in terms of time and space complexity?
+    Code Quality (20%): Is the code well-organized, readable, and properly commented?
+    Creativity (10%): Does the solution demonstrate innovative thinking or unique approaches?
+
+Feedback Guidelines:
+
+    Provide a breakdown of the score based on the criteria.
+    Highlight strengths and suggest specific improvements.
+    Use bullet points for clarity.
+    If an answer is irrelevant, give it a score of 0.
+    If comments were removed from an answer to shorten it, do not judge how well it is commented."""
+
+GRADING_SYSTEM_PROMPT = f"""You are an expert in Python algorithms and data structures. Your task is to evaluate student answers and provide a score along with detailed feedback. Always start with 'Score: X/N', N being the total score of the answer.
+
+{RUBRIC}
+
+Example Output:
+
+Score: 85/100
+
+Feedback:
+
+    Well done on solving the problem correctly.
+    Consider optimizing the loop to reduce time complexity.
+    Add comments to improve code readability.
+
+Best regards, Sabudh Foundation"""
+
+BATCH_SYSTEM_PROMPT = f"""You are an expert in Python algorithms and data structures. Your task is to evaluate the answers of a student to several questions and provide a score along with detailed feedback for each of them. Reply with JSON only.
+
+{RUBRIC}
+
+Reply with a JSON object with one entry per question, in this format:
+
+{{"grades": [{{"question_id": "1", "score": 85, "feedback": "- Well done on solving the problem correctly.\\n- Consider optimizing the loop to reduce time complexity."}}]}}"""
+
+_encoding = None
+# Values in test case descriptions, masked to group failures of the same kind
+_VALUE = re.compile(r"'[^']*'|\"[^\"]*\"|\[[^\]]*\]|\([^)]*\)|\{[^}]*\}|-?\d+(?:\.\d+)?")
+
+
+def count_tokens(text):
+    """
+    Counts the tokens of a text with tiktoken, or estimates them when it is not installed.
+    """
+    global _encoding
+    if tiktoken is None:
+        return len(text) // 4
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding('o200k_base')
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def grading_messages(question, answer, full_score):
+    return [
+        {"role": "system", "content": GRADING_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Evaluate the following assignment for a total score of {full_score}:\n\n"
+                                    f"Question: {question}\nAnswer: {answer}"},
+    ]
+
+
+def batch_messages(items, full_score):
+    """
+    'items' is a list of (question_id, question, answer).
+    """
+    blocks = [f"--- QUESTION {question_id} ---\nQuestion: {question}\nAnswer: {answer}"
+              for question_id, question, answer in items]
+    return [
+        {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Evaluate each of the following answers of one student for a total score of "
+                                    f"{full_score} per question.\n\n" + '\n\n'.join(blocks)},
+    ]
+
+
+def summarize_failures(failures, limit=MAX_FAILURES_LISTED):
+    """
+    Groups failed test case descriptions that only differ in their values, with one example and
+    a count per group. At most 'limit' lines are returned.
+    """
+    if len(failures) <= limit:
+        return list(failures)
+    groups = {}
+    for failure in failures:
+        groups.setdefault(_VALUE.sub('_', failure), []).append(failure)
+    lines = [group[0] if len(group) == 1 else f"{len(group)} test cases failed like this one: {group[0]}"
+             for group in groups.values()]
+    if len(lines) > limit:
+        rest = sum(len(group) for group in list(groups.values())[limit - 1:])
+        lines = lines[:limit - 1] + [f"... and {rest} more failed test cases"]
+    return lines
+
+
+def strip_comments(source):
+    """
+    Removes comments and blank lines from Python source. Source that does not tokenize only loses
+    its comment lines and blank lines.
+    """
+    lines = source.splitlines()
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(source).readline):
+            if token.type == tokenize.COMMENT:
+                row, column = token.start
+                lines[row - 1] = lines[row - 1][:column].rstrip()
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        lines = [line for line in source.splitlines() if not line.lstrip().startswith('#')]
+    return '\n'.join(line for line in lines if line.strip())
+
+
+def truncate_lines(text, budget):
+    """
+    Keeps the first and last lines of a text that fit in 'budget' tokens, marking the lines left out.
+    """
+    lines = text.splitlines()
+    head, tail = [], []
+    used = 0
+    while len(head) + len(tail) < len(lines):
+        # Alternate between the start and the end, two lines from the start for each from the end
+        from_head = len(head) <= 2 * len(tail)
+        line = lines[len(head)] if from_head else lines[len(lines) - 1 - len(tail)]
+        cost = count_tokens(line) + 1
+        if used + cost > budget:
+            break
+        used += cost
+        (head if from_head else tail).append(line)
+    omitted = len(lines) - len(head) - len(tail)
+    if not omitted:
+        return text
+    return '\n'.join(head + [f"# ... {omitted} lines left out ..."] + tail[::-1])
+
+
+class PromptBuilder:
+    """
+    Fits a student's answer, the summary of its tests and its failed test cases into a token budget.
+    While the answer is over budget, long lists of failures are grouped into summaries, comments and
+    blank lines are removed from the solution, and finally the middle of the solution is left out.
+    """
+    def __init__(self, budget=PROMPT_TOKEN_BUDGET, max_failures=MAX_FAILURES_LISTED):
+        self.budget = budget
+        self.max_failures = max_failures
+
+    @staticmethod
+    def render(solution, report, failures):
+        return '\n\n'.join(part for part in (solution, report, '\n'.join(failures)) if part)
+
+    def answer(self, solution, report='', failures=()):
+        """
+        Returns the answer to grade: the solution, followed by the 'report' of its tests and the failed test cases.
+        """
+        failures = list(failures)
+        answer = self.render(solution, report, failures)
+        if count_tokens(answer) <= self.budget:
+            return answer
+
+        failures = summarize_failures(failures, self.max_failures)
+        answer = self.render(solution, report, failures)
+        if count_tokens(answer) <= self.budget:
+            return answer
+
+        solution = strip_comments(solution)
+        answer = self.render(solution, report, failures)
+        if count_tokens(answer) <= self.budget:
+            return answer
+
+        # The test results are kept whole; the solution gets what is left of the budget
+        rest = self.budget - count_tokens(self.render('', report, failures))
+        return self.render(truncate_lines(solution, max(rest, 0)), report, failures)
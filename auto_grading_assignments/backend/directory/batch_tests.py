@@ -0,0 +1,209 @@
+import contextlib
+import io
+import os
+import sys
+import time
+import types
+from backend.directory.result_cache import TestResultCache
+from backend.directory.run_test_cases import (TIMEOUT, CPU_LIMIT, MEMORY_LIMIT, TestTimeout, get_context,
+                                              load_test_source, load_tests, test_case_file, time_limit,
+                                              _evaluate, _set_limits, _test_result)
+from backend.logger_config import setup_logger
+
+# Extra seconds the parent waits for a batch worker before treating it as hung
+GRACE = 2
+
+
+def list_students(assignment):
+    """
+    Returns the intern ids that have a solution folder in an assignment.
+    """
+    assignment_path = os.path.join('Input', assignment)
+    return sorted((d for d in os.listdir(assignment_path)
+                   if d.isdigit() and os.path.isdir(os.path.join(assignment_path, d))), key=int)
+
+
+def _student_namespace(solution_file_path, test_namespace):
+    """
+    Executes a student's solution in a fresh namespace and binds the already loaded test
+    functions to it, as if the solution and the test cases were one file.
+    """
+    with open(solution_file_path, 'r') as sol_file:
+        solution_code = sol_file.read()
+    namespace = {'__name__': 'combined_module', '__file__': solution_file_path}
+    exec(compile(solution_code, solution_file_path, 'exec'), namespace)
+    for name, value in test_namespace.items():
+        if name.startswith('__'):
+            continue
+        if isinstance(value, types.FunctionType) and value.__globals__ is test_namespace:
+            value = types.FunctionType(value.__code__, namespace, value.__name__, value.__defaults__, value.__closure__)
+        namespace[name] = value
+    return namespace
+
+
+def _batch_worker(conn, assignment, question_id, intern_ids, test_case_folder, timeout, memory_limit, cpu_limit):
+    """
+    Entry point of a batch process. Loads the test cases of one question once and sends back
+    (intern_id, result) for every student in order.
+    """
+    _set_limits(memory_limit, cpu_limit * len(intern_ids))
+
+    test_namespace = None
+    load_error = None
+    try:
+        test_namespace = {'__name__': 'combined_module'}
+        load_tests(test_case_file(assignment, test_case_folder, question_id), test_namespace)
+    except Exception as e:
+        load_error = f"Could not load test cases: {type(e).__name__}: {e}"
+
+    for intern_id in intern_ids:
+        start = time.perf_counter()
+        if load_error:
+            result = _test_result(question_id, status='no_tests', error=load_error)
+        else:
+            solution_file_path = os.path.join('Input', assignment, intern_id, f'{question_id}.py')
+            try:
+                # Keep the students' prints out of the score table
+                with contextlib.redirect_stdout(io.StringIO()):
+                    with time_limit(timeout):
+                        namespace = _student_namespace(solution_file_path, test_namespace)
+                    result = _evaluate(question_id, namespace, timeout=timeout)
+            except TestTimeout:
+                error = f"Solution did not finish within {timeout} seconds"
+                result = _test_result(question_id, status='timeout', error=error, not_passed=[error])
+            except BaseException as e:
+                result = _test_result(question_id, status='error', error=f"{type(e).__name__}: {e}")
+        result['elapsed'] = time.perf_counter() - start
+        conn.send((intern_id, result))
+    conn.close()
+
+
+def run_cohort_tests(assignment, question_id, intern_ids=None, test_case_folder='Test Cases', timeout=TIMEOUT,
+                     memory_limit=MEMORY_LIMIT, cpu_limit=CPU_LIMIT, cache=None):
+    """
+    Runs the test cases of one question against every student of an assignment in a single worker
+    process. A worker that hangs or dies is replaced and continues with the remaining students.
+    Returns a dictionary of intern_id to result dictionary.
+    """
+    testcase_logger = setup_logger("testcase")
+    question_id = str(question_id)
+    intern_ids = [str(intern_id) for intern_id in (intern_ids or list_students(assignment))]
+    own_cache = cache is None
+    cache = cache or TestResultCache()
+    results = {}
+    keys = {}
+
+    try:
+        test_code = None
+        try:
+            test_code = load_test_source(test_case_file(assignment, test_case_folder, question_id))
+        except (OSError, SyntaxError, ValueError):
+            pass
+
+        for intern_id in intern_ids:
+            try:
+                with open(os.path.join('Input', assignment, intern_id, f'{question_id}.py'), 'r') as sol_file:
+                    solution_code = sol_file.read()
+            except OSError:
+                solution_code = None
+            if test_code is not None and solution_code is not None:
+                keys[intern_id] = TestResultCache.make_key(solution_code, test_code)
+                cached = cache.get(keys[intern_id])
+                if cached is not None:
+                    results[intern_id] = _test_result(question_id, score=cached[0], not_passed=cached[1])
+                    results[intern_id]['cached'] = True
+
+        pending = [intern_id for intern_id in intern_ids if intern_id not in results]
+        context = get_context()
+        while pending:
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=_batch_worker,
+                                      args=(sender, assignment, question_id, pending, test_case_folder,
+                                            timeout, memory_limit, cpu_limit),
+                                      daemon=True)
+            process.start()
+            sender.close()
+
+            done = 0
+            hung = False
+            while done < len(pending):
+                try:
+                    if not receiver.poll(timeout + GRACE):
+                        hung = True
+                        break
+                    intern_id, result = receiver.recv()
+                except EOFError:
+                    break
+                results[intern_id] = result
+                if result['status'] == 'ok' and intern_id in keys:
+                    cache.put(keys[intern_id], assignment, question_id, result['score'], result['not_passed'])
+                done += 1
+            receiver.close()
+
+            if process.is_alive():
+                process.kill()
+            process.join()
+
+            if done < len(pending):
+                # The student being tested took the worker down with it
+                culprit = pending[done]
+                if hung:
+                    error = f"Solution did not finish within {timeout} seconds"
+                    results[culprit] = _test_result(question_id, status='timeout', error=error, not_passed=[error])
+                else:
+                    error = f"Solution crashed the test process (exit code {process.exitcode})"
+                    results[culprit] = _test_result(question_id, status='crashed', error=error, not_passed=[error])
+                testcase_logger.error(f"{assignment}/{culprit}/{question_id}: {error}")
+                pending = pending[done + 1:]
+            else:
+                pending = []
+    finally:
+        if own_cache:
+            cache.close_connection()
+
+    testcase_logger.info(f"Batch tested question {question_id} of {assignment} for {len(intern_ids)} students.")
+    return {intern_id: results[intern_id] for intern_id in intern_ids}
+
+
+def run_cohort(assignment, question_ids=None, intern_ids=None, test_case_folder='Test Cases'):
+    """
+    Runs every question (or the given ones) of an assignment for the whole cohort.
+    Returns a dictionary of question_id to {intern_id: result}.
+    """
+    if question_ids is None:
+        test_case_path = os.path.join('Input', assignment, test_case_folder)
+        question_ids = sorted({os.path.splitext(f)[0] for f in os.listdir(test_case_path) if f.endswith(('.py', '.json'))},
+                              key=lambda q: (len(q), q))
+    intern_ids = intern_ids or list_students(assignment)
+    return {str(question_id): run_cohort_tests(assignment, question_id, intern_ids, test_case_folder)
+            for question_id in question_ids}
+
+
+def format_score_table(results):
+    """
+    Formats the output of run_cohort as a table with one row per student and one column per question.
+    """
+    question_ids = list(results)
+    intern_ids = sorted({intern_id for by_student in results.values() for intern_id in by_student}, key=int)
+    header = ['Intern'] + [f'Q{question_id}' for question_id in question_ids] + ['Average']
+    rows = [header]
+    for intern_id in intern_ids:
+        scores = []
+        row = [intern_id]
+        for question_id in question_ids:
+            result = results[question_id].get(intern_id)
+            if result is None:
+                row.append('-')
+                continue
+            scores.append(result['score'])
+            row.append(f"{result['score']:.1f}" if result['status'] == 'ok' else result['status'])
+        row.append(f"{sum(scores) / len(scores):.1f}" if scores else '-')
+        rows.append(row)
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python -m backend.directory.batch_tests <assignment_folder> [question_id ...]")
+    print(format_score_table(run_cohort(sys.argv[1], sys.argv[2:] or None)))
@@ -0,0 +1,215 @@
+import contextlib
+import io
+import math
+import os
+import signal
+import time
+import tracemalloc
+from backend.directory.run_test_cases import (CPU_LIMIT, MEMORY_LIMIT, TestTimeout, get_context, time_limit,
+                                              _set_limits)
+from backend.logger_config import setup_logger
+
+# Input sizes a solution is measured at, and the limits of one benchmark run
+SIZES = [64, 128, 256, 512, 1024, 2048, 4096]
+SIZE_TIMEOUT = 2      # wall-clock seconds per input size
+TIMEOUT = 30          # wall-clock seconds for the whole benchmark
+REPEATS = 3
+
+# Share of the Efficiency criterion in the grading rubric, scored from the benchmark when it has a performance score
+EFFICIENCY_WEIGHT = 0.3
+
+# Growth classes in increasing order, used to fit measurements and to compare with the expected class
+GROWTH_CLASSES = [
+    ("O(1)", lambda n: 1.0),
+    ("O(log n)", lambda n: math.log2(n)),
+    ("O(n)", lambda n: float(n)),
+    ("O(n log n)", lambda n: n * math.log2(n)),
+    ("O(n^2)", lambda n: float(n) ** 2),
+    ("O(n^3)", lambda n: float(n) ** 3),
+]
+
+
+def fit_growth(sizes, values):
+    """
+    Returns the growth class that best fits 'values' measured at 'sizes', comparing in log space.
+    """
+    points = [(n, v) for n, v in zip(sizes, values) if v > 0]
+    if len(points) < 3:
+        return None
+    best_name, best_error = None, None
+    for name, growth in GROWTH_CLASSES:
+        logs = [math.log(v) - math.log(growth(n)) for n, v in points]
+        mean = sum(logs) / len(logs)
+        error = sum((x - mean) ** 2 for x in logs)
+        if best_error is None or error < best_error:
+            best_name, best_error = name, error
+    return best_name
+
+
+def performance_score(measured, expected):
+    """
+    Scores a measured growth class against the expected one: 100 when it is as good or better,
+    minus 25 for every class it is worse.
+    """
+    names = [name for name, _ in GROWTH_CLASSES]
+    if measured not in names or expected not in names:
+        return None
+    return max(0, 100 - 25 * max(0, names.index(measured) - names.index(expected)))
+
+
+def with_efficiency(marks, score, full_score=100):
+    """
+    Combines an LLM's marks for the criteria other than Efficiency with the benchmark's performance score.
+    """
+    return round(marks * (1 - EFFICIENCY_WEIGHT) + score / 100 * full_score * EFFICIENCY_WEIGHT)
+
+
+def benchmark_details(result):
+    """
+    Returns what is stored of a benchmark with a question's grade: the growth classes, the running
+    time and peak memory at the largest input size measured, and the performance score.
+    """
+    largest = result["measurements"][-1] if result["measurements"] else {}
+    return {"time_growth": result["time_growth"], "memory_growth": result["memory_growth"],
+            "benchmark_seconds": largest.get("time"), "benchmark_memory": largest.get("peak_memory"),
+            "performance_score": result["score"]}
+
+
+def _exec_file(path, namespace):
+    with open(path, 'r') as file:
+        exec(compile(file.read(), path, 'exec'), namespace)
+    return namespace
+
+
+def _benchmark_worker(conn, assignment, intern_id, question_id, sizes, size_timeout, repeats, memory_limit, cpu_limit):
+    """
+    Entry point of a benchmark process. Sends ('size', measurement) for every finished size and
+    finally ('done', error) back through 'conn'.
+    """
+    _set_limits(memory_limit, cpu_limit)
+    error = None
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            solution = _exec_file(os.path.join('Input', assignment, str(intern_id), f'{question_id}.py'),
+                                  {'__name__': 'combined_module'})['solution']
+            generate_input = _exec_file(os.path.join('Input', assignment, 'Benchmarks', f'{question_id}.py'),
+                                        {'__name__': 'benchmark_module'})['generate_input']
+            for size in sizes:
+                try:
+                    with time_limit(size_timeout):
+                        # Fresh inputs for every run as solutions may change them in place
+                        times = []
+                        for _ in range(repeats):
+                            args = generate_input(size)
+                            start = time.perf_counter()
+                            solution(*args)
+                            times.append(time.perf_counter() - start)
+
+                        args = generate_input(size)
+                        tracemalloc.start()
+                        solution(*args)
+                        peak = tracemalloc.get_traced_memory()[1]
+                        tracemalloc.stop()
+                except TestTimeout:
+                    tracemalloc.stop()
+                    error = f"stopped at input size {size}: did not finish within {size_timeout} seconds"
+                    break
+                conn.send(('size', {"size": size, "time": min(times), "peak_memory": peak}))
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+    conn.send(('done', error))
+    conn.close()
+
+
+def has_benchmark(assignment, question_id):
+    return os.path.exists(os.path.join('Input', assignment, 'Benchmarks', f'{question_id}.py'))
+
+
+def expected_growth(assignment, question_id):
+    """
+    Reads the optional EXPECTED growth class (like "O(n log n)") from a question's benchmark file.
+    """
+    namespace = {'__name__': 'benchmark_module'}
+    try:
+        _exec_file(os.path.join('Input', assignment, 'Benchmarks', f'{question_id}.py'), namespace)
+    except Exception:
+        return None
+    return namespace.get('EXPECTED')
+
+
+def run_benchmark(intern_id, assignment, question_id, sizes=SIZES, size_timeout=SIZE_TIMEOUT, timeout=TIMEOUT,
+                  repeats=REPEATS, memory_limit=MEMORY_LIMIT, cpu_limit=CPU_LIMIT):
+    """
+    Runs a student's solution at increasing input sizes made by the question's generate_input(size)
+    in Input/<assignment>/Benchmarks/<question_id>.py, in a separate limited process.
+    Returns a dictionary with the measurements, the fitted time and memory growth classes and a
+    performance score when the benchmark file sets EXPECTED.
+    """
+    benchmark_logger = setup_logger("testcase")
+    question_id = str(question_id)
+    context = get_context()
+    receiver, sender = context.Pipe(duplex=False)
+    # The CPU limit must not stop a benchmark that is still within its wall-clock 'timeout'
+    process = context.Process(target=_benchmark_worker,
+                              args=(sender, assignment, intern_id, question_id, sizes, size_timeout, repeats,
+                                    memory_limit, max(cpu_limit, timeout)),
+                              daemon=True)
+    start = time.perf_counter()
+    process.start()
+    sender.close()
+
+    measurements = []
+    error = f"did not finish within {timeout} seconds"
+    crashed = False
+    try:
+        while receiver.poll(max(start + timeout - time.perf_counter(), 0)):
+            kind, message = receiver.recv()
+            if kind == 'size':
+                measurements.append(message)
+            else:
+                error = message
+                break
+    except EOFError:
+        crashed = True
+    finally:
+        receiver.close()
+
+    if process.is_alive():
+        process.kill()
+    process.join()
+    # A process killed for running out of CPU time ran too long rather than crashed
+    if crashed and process.exitcode not in (-signal.SIGXCPU, -signal.SIGKILL):
+        error = f"crashed (exit code {process.exitcode})"
+
+    measured_sizes = [m["size"] for m in measurements]
+    time_growth = fit_growth(measured_sizes, [m["time"] for m in measurements])
+    memory_growth = fit_growth(measured_sizes, [m["peak_memory"] for m in measurements])
+    expected = expected_growth(assignment, question_id)
+    result = {
+        "question_id": question_id,
+        "measurements": measurements,
+        "time_growth": time_growth,
+        "memory_growth": memory_growth,
+        "expected_growth": expected,
+        "score": performance_score(time_growth, expected) if expected else None,
+        "error": error,
+    }
+    benchmark_logger.info(f"Benchmark {assignment}/{intern_id}/{question_id}: time {time_growth}, "
+                          f"memory {memory_growth}, error {error}")
+    return result
+
+
+def summarize_benchmark(result):
+    """
+    Formats a benchmark result as text for the grading prompt and the feedback.
+    """
+    lines = ["EMPIRICAL PERFORMANCE (measured by running the solution at increasing input sizes):"]
+    for m in result["measurements"]:
+        lines.append(f"  n={m['size']}: {m['time'] * 1000:.3f} ms, peak memory {m['peak_memory'] / 1024:.1f} KB")
+    if result["time_growth"]:
+        lines.append(f"  Running time grows like {result['time_growth']}, memory grows like {result['memory_growth']}.")
+    if result["expected_growth"]:
+        lines.append(f"  Expected growth is {result['expected_growth']}, performance score {result['score']}/100.")
+    if result["error"]:
+        lines.append(f"  Benchmark {result['error']}.")
+    return '\n'.join(lines)
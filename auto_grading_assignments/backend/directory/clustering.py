@@ -0,0 +1,301 @@
+import ast
+import builtins
+import hashlib
+import io
+import json
+import pathlib
+import random
+import sqlite3
+import sys
+import threading
+import time
+import tokenize
+
+# Estimated Jaccard similarity of normalized solutions above which they share a grade,
+# unless autograder_config.json sets "cluster_similarity"
+SIMILARITY = 0.9
+# Tokens per shingle, MinHash permutations, and LSH bands of NUM_PERM // BANDS rows each
+SHINGLE = 5
+NUM_PERM = 64
+BANDS = 16
+
+_PRIME = (1 << 61) - 1
+_random = random.Random(20240601)
+_PERMUTATIONS = [(_random.randrange(1, _PRIME), _random.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+_BUILTINS = set(dir(builtins))
+
+
+class _Renamer(ast.NodeTransformer):
+    """
+    Renames the names a solution defines to v0, v1, ... in order of appearance and drops docstrings.
+    Builtins and imported names are kept, as they change what the code does.
+    """
+    def __init__(self, keep):
+        self.keep = keep
+        self.names = {}
+
+    def rename(self, name):
+        if name in self.keep:
+            return name
+        return self.names.setdefault(name, f"v{len(self.names)}")
+
+    def drop_docstring(self, node):
+        body = node.body
+        if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) \
+                and isinstance(body[0].value.value, str):
+            node.body = body[1:] or [ast.Pass()]
+
+    def visit_Module(self, node):
+        self.drop_docstring(node)
+        return self.generic_visit(node)
+
+    def visit_FunctionDef(self, node):
+        node.name = self.rename(node.name)
+        self.drop_docstring(node)
+        return self.generic_visit(node)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+    visit_ClassDef = visit_FunctionDef
+
+    def visit_Name(self, node):
+        node.id = self.rename(node.id)
+        return node
+
+    def visit_arg(self, node):
+        node.arg = self.rename(node.arg)
+        return self.generic_visit(node)
+
+    def visit_Global(self, node):
+        node.names = [self.rename(name) for name in node.names]
+        return node
+
+    visit_Nonlocal = visit_Global
+
+
+def normalize_source(source):
+    """
+    Returns a solution with its names renamed, comments and docstrings dropped and its formatting
+    canonical, so solutions differing only in those are equal. Source that does not parse only
+    loses its comment lines and extra whitespace.
+    """
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        lines = (' '.join(line.split()) for line in source.splitlines())
+        return '\n'.join(line for line in lines if line and not line.startswith('#'))
+    keep = set(_BUILTINS)
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            keep.update((alias.asname or alias.name).split('.')[0] for alias in node.names)
+    return ast.unparse(_Renamer(keep).visit(tree))
+
+
+def fingerprint(normalized):
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def _tokens(normalized):
+    try:
+        return [token.string for token in tokenize.generate_tokens(io.StringIO(normalized).readline)
+                if token.string.strip()]
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        return normalized.split()
+
+
+def signature(normalized):
+    """
+    MinHash signature of the token shingles of a normalized solution.
+    """
+    tokens = _tokens(normalized)
+    shingles = {' '.join(tokens[i:i + SHINGLE]) for i in range(max(len(tokens) - SHINGLE + 1, 1))}
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), 'big') for shingle in shingles]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def similarity(first, second):
+    """
+    Estimated Jaccard similarity of two MinHash signatures.
+    """
+    return sum(x == y for x, y in zip(first, second)) / len(first)
+
+
+def bands(signature):
+    """
+    LSH bucket of every band of a signature. Similar solutions share a bucket in at least one band.
+    """
+    rows = len(signature) // BANDS
+    return [hashlib.sha1(json.dumps(signature[band * rows:(band + 1) * rows]).encode()).hexdigest()[:16]
+            for band in range(BANDS)]
+
+
+def cluster_solutions(sources, threshold=SIMILARITY):
+    """
+    Groups solutions that are equal once normalized, or similar above 'threshold'. 'sources' maps an id
+    to a solution. Returns lists of ids, the first of each being the representative to grade.
+    """
+    representatives = []
+    members = {}
+    exact = {}
+    buckets = {}
+    for key, source in sources.items():
+        normalized = normalize_source(source)
+        digest = fingerprint(normalized)
+        if digest in exact:
+            members[exact[digest]].append(key)
+            continue
+        sig = signature(normalized)
+        candidates = {rep for band, bucket in enumerate(bands(sig)) for rep in buckets.get((band, bucket), ())}
+        best = max(candidates, key=lambda rep: similarity(sig, representatives[rep][1]), default=None)
+        if best is not None and similarity(sig, representatives[best][1]) >= threshold:
+            members[best].append(key)
+            exact[digest] = best
+            continue
+        index = len(representatives)
+        representatives.append((key, sig))
+        members[index] = [key]
+        exact[digest] = index
+        for band, bucket in enumerate(bands(sig)):
+            buckets.setdefault((band, bucket), []).append(index)
+    return [members[index] for index in range(len(representatives))]
+
+
+class SolutionClusters:
+    """
+    Grades of representative solutions, reused for the solutions of the same question that are equal
+    or near-identical to them once normalized and have the same test results. Kept in SQLite with
+    the LSH buckets of every representative, so the whole cohort shares them as submissions come in.
+    """
+    def __init__(self, path=pathlib.Path('database', 'cache.db'), threshold=SIMILARITY):
+        self.threshold = threshold
+        # Shared by the grading threads of the service
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.cursor = self.connection.cursor()
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS "solution_clusters" (
+                                   "id" INTEGER PRIMARY KEY,
+                                   "assignment" TEXT NOT NULL,
+                                   "question_id" TEXT NOT NULL,
+                                   "context" TEXT NOT NULL,
+                                   "fingerprint" TEXT NOT NULL,
+                                   "signature" TEXT NOT NULL,
+                                   "marks" INTEGER NOT NULL,
+                                   "feedback" TEXT NOT NULL,
+                                   "members" INTEGER NOT NULL DEFAULT 1,
+                                   "created" REAL NOT NULL
+                               )''')
+        self.cursor.execute('''CREATE INDEX IF NOT EXISTS "idx_solution_clusters_fingerprint"
+                               ON "solution_clusters" ("context", "fingerprint")''')
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS "solution_cluster_bands" (
+                                   "context" TEXT NOT NULL,
+                                   "band" INTEGER NOT NULL,
+                                   "bucket" TEXT NOT NULL,
+                                   "cluster_id" INTEGER NOT NULL
+                               )''')
+        self.cursor.execute('''CREATE INDEX IF NOT EXISTS "idx_solution_cluster_bands"
+                               ON "solution_cluster_bands" ("context", "band", "bucket")''')
+
+    @staticmethod
+    def context(question, full_score, test_score, not_passed, measured_efficiency=False):
+        """
+        Key of what a grade depends on besides the solution: the question, its score, the test results
+        and whether Efficiency is scored from a benchmark instead of by the LLM.
+        """
+        key = [question, full_score, test_score, sorted(not_passed)] + (['measured efficiency'] if measured_efficiency else [])
+        digest = hashlib.sha256(json.dumps(key).encode())
+        return digest.hexdigest()
+
+    def find(self, context, source):
+        """
+        Returns the (marks, feedback) of a representative of a solution with the same context, or None.
+        """
+        normalized = normalize_source(source)
+        digest = fingerprint(normalized)
+        with self.lock:
+            self.cursor.execute('''SELECT "id", "marks", "feedback" FROM "solution_clusters"
+                                   WHERE "context" = ? AND "fingerprint" = ? LIMIT 1''', (context, digest))
+            row = self.cursor.fetchone()
+            if row is None:
+                sig = signature(normalized)
+                self.cursor.execute(f'''SELECT DISTINCT "c"."id", "c"."marks", "c"."feedback", "c"."signature"
+                                        FROM "solution_cluster_bands" AS "b"
+                                        JOIN "solution_clusters" AS "c" ON "c"."id" = "b"."cluster_id"
+                                        WHERE "b"."context" = ? AND ("b"."band", "b"."bucket") IN
+                                            (VALUES {', '.join('(?, ?)' for _ in range(BANDS))})''',
+                                    [context] + [value for band in enumerate(bands(sig)) for value in band])
+                scored = [(similarity(sig, json.loads(candidate[3])), candidate[:3]) for candidate in self.cursor.fetchall()]
+                best = max(scored, default=None)
+                row = best[1] if best is not None and best[0] >= self.threshold else None
+            if row is None:
+                return None
+            self.cursor.execute('''UPDATE "solution_clusters" SET "members" = "members" + 1 WHERE "id" = ?''', (row[0],))
+        return row[1], row[2]
+
+    def add(self, assignment, question_id, context, source, marks, feedback):
+        """
+        Makes a graded solution the representative of its cluster.
+        """
+        normalized = normalize_source(source)
+        sig = signature(normalized)
+        with self.lock:
+            self.cursor.execute('BEGIN IMMEDIATE')
+            try:
+                self.cursor.execute('''INSERT INTO "solution_clusters" ("assignment", "question_id", "context", "fingerprint",
+                                                                        "signature", "marks", "feedback", "created")
+                                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                                    (assignment, str(question_id), context, fingerprint(normalized), json.dumps(sig),
+                                     marks, feedback, time.time()))
+                cluster_id = self.cursor.lastrowid
+                self.cursor.executemany('''INSERT INTO "solution_cluster_bands" ("context", "band", "bucket", "cluster_id")
+                                           VALUES (?, ?, ?, ?)''',
+                                        [(context, band, bucket, cluster_id) for band, bucket in enumerate(bands(sig))])
+                self.cursor.execute('COMMIT')
+            except BaseException:
+                self.cursor.execute('ROLLBACK')
+                raise
+
+    def invalidate(self, assignment, question_ids=None):
+        """
+        Drops the representatives of an assignment, or only of the given questions, so they are graded again.
+        """
+        with self.lock:
+            query = '''SELECT "id" FROM "solution_clusters" WHERE "assignment" = ?'''
+            parameters = [assignment]
+            if question_ids is not None:
+                query += f''' AND "question_id" IN ({', '.join('?' * len(question_ids))})'''
+                parameters += [str(question_id) for question_id in question_ids]
+            self.cursor.execute(f'''DELETE FROM "solution_cluster_bands" WHERE "cluster_id" IN ({query})''', parameters)
+            self.cursor.execute(f'''DELETE FROM "solution_clusters" WHERE "id" IN ({query})''', parameters)
+
+    def stats(self, assignment):
+        """
+        Returns the representatives graded and the solutions they were reused for, by question.
+        """
+        with self.lock:
+            self.cursor.execute('''SELECT "question_id", COUNT(*), SUM("members") - COUNT(*) FROM "solution_clusters"
+                                   WHERE "assignment" = ? GROUP BY "question_id"''', (assignment,))
+            return {row[0]: {"graded": row[1], "reused": row[2]} for row in self.cursor.fetchall()}
+
+    def close_connection(self):
+        self.connection.close()
+
+
+if __name__ == '__main__':
+    from backend.directory.batch_tests import list_students
+    from backend.directory.getinput import GetInputs
+
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python -m backend.directory.clustering <assignment_folder> [question_id ...]")
+    assignment = sys.argv[1]
+    directory = pathlib.Path('Input', assignment)
+    solutions = {int(intern_id): GetInputs.for_student(directory, int(intern_id)) for intern_id in list_students(assignment)}
+    question_ids = sys.argv[2:] or sorted({question_id for answers in solutions.values() for question_id in answers})
+    for question_id in question_ids:
+        sources = {intern_id: answers[question_id] for intern_id, answers in solutions.items() if question_id in answers}
+        clusters = cluster_solutions(sources)
+        print(f"Question {question_id}: {len(sources)} solutions in {len(clusters)} clusters")
+        for members in sorted(clusters, key=len, reverse=True):
+            if len(members) > 1:
+                print(f"    {members[0]} represents {members[1:]}")
+    clusters = SolutionClusters()
+    print(f"Grades reused so far: {json.dumps(clusters.stats(assignment))}")
+    clusters.close_connection()
@@ -0,0 +1,163 @@
+import contextlib
+import copy
+import io
+import json
+import os
+import time
+from backend.directory.input_spec import generate_inputs
+from backend.directory.result_cache import ReferenceOutputCache
+from backend.directory.test_spec import outputs_match
+from backend.directory.run_test_cases import (CPU_LIMIT, MEMORY_LIMIT, TestTimeout, get_context, time_limit,
+                                              _short_repr, _set_limits)
+from backend.logger_config import setup_logger
+
+CALL_TIMEOUT = 1      # wall-clock seconds per call of the solution
+TIMEOUT = 60          # wall-clock seconds for all calls of one solution
+MAX_MISMATCHES = 5    # mismatches reported back for the feedback
+
+
+def reference_paths(assignment, question_id):
+    reference_dir = os.path.join('Input', assignment, 'Reference')
+    return os.path.join(reference_dir, f'{question_id}.py'), os.path.join(reference_dir, f'{question_id}.json')
+
+
+def has_reference(assignment, question_id):
+    return all(os.path.exists(path) for path in reference_paths(assignment, question_id))
+
+
+def _call_worker(conn, solution_file_path, inputs, expected, compare, call_timeout, memory_limit, cpu_limit):
+    """
+    Entry point of a differential process. Calls 'solution' on every input. Without 'expected' it
+    sends back the outputs, otherwise it compares them and sends back a summary.
+    """
+    _set_limits(memory_limit, cpu_limit)
+    outputs = []
+    matched = 0
+    mismatches = []
+    error = None
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            namespace = {'__name__': 'combined_module', '__file__': solution_file_path}
+            with open(solution_file_path, 'r') as sol_file:
+                exec(compile(sol_file.read(), solution_file_path, 'exec'), namespace)
+            solution = namespace['solution']
+            for i, args in enumerate(inputs):
+                timed_out = False
+                try:
+                    with time_limit(call_timeout):
+                        # Copies so that a solution changing its inputs in place can not affect the report
+                        actual = solution(*copy.deepcopy(args))
+                except TestTimeout:
+                    actual, failure = None, f"did not finish within {call_timeout} seconds"
+                    timed_out = True
+                except Exception as e:
+                    actual, failure = None, f"{type(e).__name__}: {e}"
+                else:
+                    failure = None
+                if expected is None:
+                    if failure:
+                        raise RuntimeError(f"reference solution failed on input {_short_repr(args)}: {failure}")
+                    outputs.append(actual)
+                elif failure is None and outputs_match(expected[i], actual, compare):
+                    matched += 1
+                elif len(mismatches) < MAX_MISMATCHES:
+                    mismatches.append({"inputs": _short_repr(args), "expected": _short_repr(expected[i]),
+                                       "actual": failure or _short_repr(actual)})
+                if timed_out:
+                    # The remaining inputs count as mismatches instead of waiting for every one to time out
+                    error = f"stopped after input {i + 1} of {len(inputs)} timed out"
+                    break
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+    if expected is None:
+        conn.send((outputs, error))
+    else:
+        conn.send(({"total": len(inputs), "matched": matched, "mismatches": mismatches}, error))
+    conn.close()
+
+
+def _run_in_worker(solution_file_path, inputs, expected, compare, call_timeout=CALL_TIMEOUT, timeout=TIMEOUT,
+                   memory_limit=MEMORY_LIMIT, cpu_limit=CPU_LIMIT):
+    context = get_context()
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_call_worker,
+                              args=(sender, solution_file_path, inputs, expected, compare, call_timeout,
+                                    memory_limit, cpu_limit),
+                              daemon=True)
+    process.start()
+    sender.close()
+    message = None
+    try:
+        if receiver.poll(timeout):
+            message = receiver.recv()
+    except EOFError:
+        pass
+    finally:
+        receiver.close()
+    if process.is_alive():
+        process.kill()
+    process.join()
+    if message is None:
+        return None, f"did not finish within {timeout} seconds or crashed (exit code {process.exitcode})"
+    return message
+
+
+def load_reference(assignment, question_id, cache=None):
+    """
+    Returns (inputs, expected_outputs, spec) of a question, computing the reference outputs only
+    when the reference solution or the spec changed since they were cached.
+    """
+    reference_path, spec_path = reference_paths(assignment, question_id)
+    with open(reference_path, 'r') as file:
+        reference_code = file.read()
+    with open(spec_path, 'r') as file:
+        spec = json.load(file)
+
+    own_cache = cache is None
+    cache = cache or ReferenceOutputCache()
+    try:
+        key = ReferenceOutputCache.make_key(reference_code, spec)
+        cached = cache.get(assignment, question_id, key)
+        if cached is not None:
+            return cached[0], cached[1], spec
+        inputs = generate_inputs(spec)
+        outputs, error = _run_in_worker(reference_path, inputs, None, spec.get('compare', 'exact'))
+        if error:
+            raise RuntimeError(f"Reference solution for {assignment}/{question_id} failed: {error}")
+        cache.put(assignment, question_id, key, inputs, outputs)
+        setup_logger("testcase").info(f"Computed {len(outputs)} reference outputs for {assignment}/{question_id}.")
+        return inputs, outputs, spec
+    finally:
+        if own_cache:
+            cache.close_connection()
+
+
+def run_differential(intern_id, assignment, question_id, cache=None):
+    """
+    Runs a student's solution on the random inputs of a question and compares the outputs with
+    the reference solution's. Returns a dictionary with the match rate as 'score' and the first mismatches.
+    """
+    question_id = str(question_id)
+    start = time.perf_counter()
+    inputs, expected, spec = load_reference(assignment, question_id, cache)
+    solution_file_path = os.path.join('Input', assignment, str(intern_id), f'{question_id}.py')
+    summary, error = _run_in_worker(solution_file_path, inputs, expected, spec.get('compare', 'exact'))
+    if summary is None:
+        summary = {"total": len(inputs), "matched": 0, "mismatches": []}
+    score = summary["matched"] / summary["total"] * 100 if summary["total"] else 0
+    result = dict(summary, question_id=question_id, score=score, error=error, elapsed=time.perf_counter() - start)
+    setup_logger("testcase").info(f"Differential {assignment}/{intern_id}/{question_id}: "
+                                  f"{summary['matched']}/{summary['total']} outputs match, error {error}")
+    return result
+
+
+def summarize_differential(result):
+    """
+    Formats a differential result as text for the grading prompt and the feedback.
+    """
+    lines = [f"RANDOMIZED TESTS AGAINST THE REFERENCE SOLUTION: {result['matched']}/{result['total']} outputs match."]
+    for mismatch in result["mismatches"]:
+        lines.append(f"  inputs {mismatch['inputs']}: expected {mismatch['expected']}, got {mismatch['actual']}")
+    if result["error"]:
+        lines.append(f"  Stopped early: {result['error']}")
+    return '\n'.join(lines)
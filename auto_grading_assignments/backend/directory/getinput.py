@@ -1,3 +1,4 @@
+import hashlib
 import os
 import pathlib
 import logging
@@ -61,6 +62,19 @@ class GetInputs:
                         logging.error(f"Error reading file {filename} in {student_folder}: {e}")
         return solutions
 
+    @staticmethod
+    def solution_hash(solution):
+        """
+        Hash of a solution as grading reads it, ignoring trailing whitespace, to tell whether it changed since it was graded.
+        """
+        normalized = '\n'.join(line.rstrip() for line in solution.strip().splitlines())
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
+    @staticmethod
+    def solution_hashes(dir, student_folder):
+        return {solution_id: GetInputs.solution_hash(solution)
+                for solution_id, solution in GetInputs.for_student(dir, student_folder).items()}
+
 
 if __name__ == '__main__':
     inputs = GetInputs('Input/AssignmentID', solution=True)
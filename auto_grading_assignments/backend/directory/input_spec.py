@@ -0,0 +1,63 @@
+import random
+import string
+
+# Type spec of random inputs for a question, read from Input/<assignment>/Reference/<n>.json:
+# {
+#     "count": 200,
+#     "seed": 0,
+#     "compare": "exact",
+#     "args": [
+#         {"type": "list", "of": {"type": "int", "min": -100, "max": 100}, "min_len": 0, "max_len": 20},
+#         {"type": "int", "min": 0, "max": 10}
+#     ]
+# }
+# Supported types: int, float, bool, str, choice, list, tuple, matrix.
+
+
+def generate_value(spec, rng, size=None):
+    """
+    Generates one random value for a type spec. 'size' overrides the length of lists, strings and matrices.
+    """
+    kind = spec.get('type', 'int')
+    if kind == 'int':
+        return rng.randint(spec.get('min', -100), spec.get('max', 100))
+    if kind == 'float':
+        return round(rng.uniform(spec.get('min', -100.0), spec.get('max', 100.0)), spec.get('digits', 3))
+    if kind == 'bool':
+        return rng.random() < 0.5
+    if kind == 'choice':
+        return rng.choice(spec['values'])
+    if kind == 'str':
+        alphabet = spec.get('alphabet', string.ascii_lowercase)
+        length = size if size is not None else rng.randint(spec.get('min_len', 0), spec.get('max_len', 10))
+        return ''.join(rng.choice(alphabet) for _ in range(length))
+    if kind == 'list':
+        length = size if size is not None else rng.randint(spec.get('min_len', 0), spec.get('max_len', 10))
+        values = [generate_value(spec.get('of', {'type': 'int'}), rng) for _ in range(length)]
+        if spec.get('unique'):
+            values = list(dict.fromkeys(values))
+        if spec.get('sorted'):
+            values.sort()
+        return values
+    if kind == 'tuple':
+        return tuple(generate_value(item, rng) for item in spec['items'])
+    if kind == 'matrix':
+        rows = size if size is not None else rng.randint(spec.get('min_rows', 0), spec.get('max_rows', 5))
+        cols = spec.get('cols') or (rows if spec.get('square') else rng.randint(spec.get('min_cols', 1), spec.get('max_cols', 5)))
+        return [[generate_value(spec.get('of', {'type': 'int'}), rng) for _ in range(cols)] for _ in range(rows)]
+    raise ValueError(f"Unknown input type '{kind}'")
+
+
+def generate_args(spec, rng, size=None):
+    """
+    Generates the argument tuple of one call to 'solution'.
+    """
+    return tuple(generate_value(arg, rng, size) for arg in spec['args'])
+
+
+def generate_inputs(spec):
+    """
+    Generates the reproducible list of argument tuples described by a question's spec.
+    """
+    rng = random.Random(spec.get('seed', 0))
+    return [generate_args(spec, rng) for _ in range(spec.get('count', 200))]
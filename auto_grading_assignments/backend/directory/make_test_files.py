@@ -1,3 +1,6 @@
+import ast
+import json
+import logging
 import pathlib
 import re
 
@@ -20,6 +23,16 @@ class Make_Files:
         # Pattern to extract test cases
         test_case_pattern = r'--Test Cases Start--\s*.*\s*(def.*?)\s*`{0,3}\s*--Test Cases End--'
         test_case_pattern_2 = r'```python\n(.*?)```' 
+        test_case_pattern_json = r'```json\n(.*?)```'
+
+        # Declarative test cases are stored as they are
+        test_cases_match = re.search(test_case_pattern_json, description, re.DOTALL)
+        if test_cases_match and cls.is_test_spec(test_cases_match.group(1)):
+            constrains = re.sub(r'--Test Cases Start--.*?--Test Cases End--', '', description, flags=re.DOTALL)
+            constrains = re.sub(test_case_pattern_json, '', constrains, flags=re.DOTALL).strip()
+            return test_cases_match.group(1).strip(), constrains
+        if test_cases_match:
+            logging.warning("Generated test cases: the JSON test cases are not a valid test spec, looking for Python ones")
 
         # Extract test cases
         test_cases_match = re.search(test_case_pattern_2, description, re.DOTALL)
@@ -28,17 +41,46 @@ class Make_Files:
             test_cases_match = re.search(test_case_pattern, description, re.DOTALL)
             test_cases = test_cases_match.group(1).strip() if test_cases_match else "Test Cases not found"
 
+        for problem in cls.check_test_cases(test_cases):
+            logging.warning(f"Generated test cases: {problem}")
+
         # Extract everything else (constraints)
         constrains = re.sub(test_case_pattern, '', description, flags=re.DOTALL).strip()
         return test_cases, constrains
 
+    @staticmethod
+    def is_test_spec(test_cases):
+        try:
+            return isinstance(json.loads(test_cases).get("cases"), list)
+        except (ValueError, AttributeError):
+            return False
+
+    @classmethod
+    def check_test_cases(cls, test_cases):
+        """
+        Returns the problems that keep extracted test cases from running case by case in the test runner
+        """
+        try:
+            tree = ast.parse(test_cases)
+        except SyntaxError as e:
+            return [f"test cases do not compile: {e}"]
+        test_solution = [node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name == 'test_solution']
+        if not test_solution:
+            return ["'test_solution' function not found"]
+        if not any(isinstance(node, ast.Yield) for node in ast.walk(test_solution[0])):
+            return ["'test_solution' does not yield test cases, so it will be timed and scored as a whole"]
+        return []
+
     @classmethod
     def make_test_file(cls, test_cases, directory, file_name):
         # Ensure the "Test Cases" directory exists
         test_cases_dir = pathlib.Path(directory, 'Test Cases')
         test_cases_dir.mkdir(parents=True, exist_ok=True)
 
-        destination = test_cases_dir / f'{file_name}.py'
+        # A question has either JSON or Python test cases, and JSON ones take precedence when running
+        extension, stale = ('json', 'py') if cls.is_test_spec(test_cases) else ('py', 'json')
+        (test_cases_dir / f'{file_name}.{stale}').unlink(missing_ok=True)
+        destination = test_cases_dir / f'{file_name}.{extension}'
         with open(destination, 'w') as file:
             file.writelines(test_cases)        
 
@@ -0,0 +1,200 @@
+import ast
+import builtins
+import json
+import os
+from backend.directory.run_test_cases import test_case_file
+from backend.directory.test_spec import load_test_spec
+from backend.logger_config import setup_logger
+
+# Modules solutions may not import, unless an assignment's config.json sets its own "forbidden_imports".
+# 'sys' is allowed for sys.setrecursionlimit and sys.maxsize, the sandbox's limits contain its misuse.
+FORBIDDEN_IMPORTS = ['os', 'subprocess', 'shutil', 'socket', 'ctypes', 'multiprocessing',
+                     'threading', 'signal', 'resource', 'importlib', 'builtins']
+
+# Names every module has without defining them, and '__class__' that methods have
+MODULE_NAMES = set(dir(builtins)) | {'__name__', '__file__', '__doc__', '__builtins__', '__spec__', '__loader__',
+                                     '__package__', '__cached__', '__annotations__', '__class__'}
+
+PRECHECK_FEEDBACK = """Your solution was not graded because it failed the automatic checks:
+{problems}
+Please fix these problems and submit again. Score: 0/{question_score}
+"""
+
+
+def _is_main_block(node):
+    """
+    Tells whether a statement is an 'if __name__ == "__main__":' block, which never runs when graded.
+    """
+    return (isinstance(node, ast.If) and isinstance(node.test, ast.Compare)
+            and isinstance(node.test.left, ast.Name) and node.test.left.id == '__name__'
+            and any(isinstance(c, ast.Constant) and c.value == '__main__' for c in node.test.comparators))
+
+
+def _bound_names(tree):
+    """
+    Returns every name a module binds anywhere: definitions, parameters, assignments and imports.
+    """
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(node.id)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                names.add(alias.asname or alias.name.split('.')[0])
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+        elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+            names.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            names.add(node.rest)
+    return names
+
+
+def _imported_modules(tree):
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                yield node.lineno, alias.name
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            yield node.lineno, node.module
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == '__import__':
+            yield node.lineno, '__import__'
+
+
+def _accepts(function, count):
+    """
+    Tells whether a function definition can be called with 'count' positional arguments.
+    """
+    arguments = function.args
+    positional = len(arguments.posonlyargs) + len(arguments.args)
+    required = positional - len(arguments.defaults)
+    required_keywords = [arg for arg, default in zip(arguments.kwonlyargs, arguments.kw_defaults) if default is None]
+    if required_keywords or count < required:
+        return False
+    return count <= positional or arguments.vararg is not None
+
+
+def check_solution(source, forbidden_imports=FORBIDDEN_IMPORTS, arities=None, known_names=()):
+    """
+    Statically checks a solution without running it. Returns the list of problems, empty if it may be tested.
+    'arities' are the numbers of arguments 'solution' is called with, 'known_names' the names the test cases define.
+    """
+    try:
+        tree = ast.parse(source)
+    except SyntaxError as e:
+        return [f"Syntax error on line {e.lineno}: {e.msg}."]
+    tree.body = [node for node in tree.body if not _is_main_block(node)]
+
+    problems = []
+    forbidden = set(forbidden_imports)
+    for lineno, module in _imported_modules(tree):
+        if module == '__import__' or module.split('.')[0] in forbidden:
+            problems.append(f"Importing '{module}' is not allowed (line {lineno}).")
+
+    solutions = [node for node in tree.body if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+                 and node.name == 'solution']
+    if not solutions:
+        problems.append("No 'solution' function is defined at the top level of the file.")
+    else:
+        for count in sorted(arities or ()):
+            if not _accepts(solutions[-1], count):
+                problems.append(f"'solution' must accept {count} argument{'s' if count != 1 else ''}, "
+                                f"but is defined as solution({ast.unparse(solutions[-1].args)}).")
+
+    # A star import binds names that can not be known without running it
+    star_import = any(isinstance(node, ast.ImportFrom) and any(alias.name == '*' for alias in node.names)
+                      for node in ast.walk(tree))
+    defined = _bound_names(tree) | MODULE_NAMES | set(known_names)
+    missing = {}
+    for node in ast.walk(tree):
+        if not star_import and isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and node.id not in defined:
+            missing.setdefault(node.id, node.lineno)
+    for name, lineno in sorted(missing.items(), key=lambda item: item[1]):
+        problems.append(f"'{name}' is used but never defined (line {lineno}).")
+    return problems
+
+
+def expected_arities(assignment, question_id, test_case_folder='Test Cases'):
+    """
+    Returns the numbers of arguments the JSON test cases or the reference spec of a question call 'solution' with.
+    """
+    arities = set()
+    path = test_case_file(assignment, test_case_folder, question_id)
+    if path.endswith('.json'):
+        try:
+            arities.update(len(case["inputs"]) for case in load_test_spec(path)[1]["cases"])
+        except (OSError, ValueError):
+            pass
+    reference_spec = os.path.join('Input', assignment, 'Reference', f'{question_id}.json')
+    if os.path.exists(reference_spec):
+        try:
+            with open(reference_spec, 'r') as file:
+                arities.add(len(json.load(file)['args']))
+        except (OSError, ValueError, KeyError):
+            pass
+    return arities
+
+
+def test_case_names(assignment, question_id, test_case_folder='Test Cases'):
+    """
+    Returns the top level names of a question's Python test cases, which solutions can use as they run together.
+    """
+    path = test_case_file(assignment, test_case_folder, question_id)
+    if not path.endswith('.py'):
+        return set()
+    try:
+        with open(path, 'r') as file:
+            tree = ast.parse(file.read())
+    except (OSError, SyntaxError):
+        return set()
+    names = set()
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            names.update(alias.asname or alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            names.update(n.id for target in targets for n in ast.walk(target) if isinstance(n, ast.Name))
+    return names
+
+
+def precheck_submission(intern_id, assignment, question_ids, test_case_folder='Test Cases'):
+    """
+    Checks a student's solutions of an assignment before they are tested and graded.
+    Returns a dictionary of question id to its list of problems, empty for solutions that may be graded.
+    """
+    precheck_logger = setup_logger("testcase")
+    forbidden_imports = FORBIDDEN_IMPORTS
+    try:
+        with open(os.path.join('Input', assignment, 'config.json'), 'r') as file:
+            forbidden_imports = json.load(file).get('forbidden_imports', FORBIDDEN_IMPORTS)
+    except (OSError, ValueError):
+        pass
+
+    results = {}
+    for question_id in question_ids:
+        question_id = str(question_id)
+        try:
+            with open(os.path.join('Input', assignment, str(intern_id), f'{question_id}.py'), 'r') as sol_file:
+                source = sol_file.read()
+        except OSError:
+            results[question_id] = ["No solution file was submitted for this question."]
+            continue
+        results[question_id] = check_solution(source, forbidden_imports,
+                                              expected_arities(assignment, question_id, test_case_folder),
+                                              test_case_names(assignment, question_id, test_case_folder))
+        if results[question_id]:
+            precheck_logger.info(f"Precheck {assignment}/{intern_id}/{question_id} failed: {results[question_id]}")
+    return results
+
+
+def precheck_feedback(problems, question_score):
+    return PRECHECK_FEEDBACK.format(problems='\n'.join(f"- {problem}" for problem in problems),
+                                    question_score=question_score)
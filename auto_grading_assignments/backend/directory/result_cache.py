@@ -0,0 +1,287 @@
+import hashlib
+import json
+import pathlib
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from backend.logger_config import setup_logger
+
+
+def connect(path, **kwargs):
+    """
+    Opens the cache database so that grading processes and the dashboard can use it at the same time.
+    """
+    connection = sqlite3.connect(path, timeout=30, **kwargs)
+    connection.execute('PRAGMA journal_mode=WAL')
+    return connection
+
+
+class TestResultCache:
+    """
+    Persistent cache of test case results keyed on the solution source, the test case source and
+    the Python version, with least recently used eviction.
+    """
+    def __init__(self, path=pathlib.Path('database', 'cache.db'), max_entries=10000):
+        self.logger = setup_logger("testcase")
+        self.max_entries = max_entries
+        try:
+            self.connection = self._open(path)
+        except sqlite3.Error as e:
+            # A cache that can not be opened only makes every solution run its tests
+            self.logger.warning(f"Test result cache {path} can not be opened, keeping results in memory: {e}")
+            self.connection = self._open(':memory:')
+        self.cursor = self.connection.cursor()
+
+    @staticmethod
+    def _open(path):
+        connection = connect(path)
+        connection.execute('''CREATE TABLE IF NOT EXISTS "test_results" (
+                                  "key" TEXT PRIMARY KEY,
+                                  "assignment" TEXT NOT NULL,
+                                  "question_id" TEXT NOT NULL,
+                                  "score" REAL NOT NULL,
+                                  "not_passed" TEXT NOT NULL,
+                                  "last_used" REAL NOT NULL
+                              )''')
+        connection.execute('''CREATE INDEX IF NOT EXISTS "idx_test_results_question"
+                              ON "test_results" ("assignment", "question_id")''')
+        connection.commit()
+        return connection
+
+    @staticmethod
+    def normalize(source):
+        lines = [line.rstrip() for line in source.replace('\r\n', '\n').split('\n')]
+        return '\n'.join(lines).strip()
+
+    @classmethod
+    def make_key(cls, solution_code, test_code):
+        digest = hashlib.sha256()
+        for part in (cls.normalize(solution_code), test_code, sys.version):
+            digest.update(part.encode())
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Returns (score, not_passed) for a key or None if it is not cached or the cache can not be read.
+        """
+        try:
+            self.cursor.execute('''SELECT "score", "not_passed" FROM "test_results" WHERE "key" = ?''', (key,))
+            row = self.cursor.fetchone()
+            if row is None:
+                return None
+            self.cursor.execute('''UPDATE "test_results" SET "last_used" = ? WHERE "key" = ?''', (time.time(), key))
+            self.connection.commit()
+        except sqlite3.Error as e:
+            self.logger.warning(f"Test result cache lookup failed, running the tests: {e}")
+            self.connection.rollback()
+            return None
+        return row[0], json.loads(row[1])
+
+    def put(self, key, assignment, question_id, score, not_passed):
+        query = '''INSERT OR REPLACE INTO "test_results" ("key", "assignment", "question_id", "score", "not_passed", "last_used")
+                   VALUES (?, ?, ?, ?, ?, ?)'''
+        try:
+            self.cursor.execute(query, (key, assignment, str(question_id), score, json.dumps(not_passed), time.time()))
+            # Evict the least recently used entries beyond the size limit
+            self.cursor.execute('''DELETE FROM "test_results" WHERE "key" IN (
+                                       SELECT "key" FROM "test_results" ORDER BY "last_used" DESC LIMIT -1 OFFSET ?
+                                   )''', (self.max_entries,))
+            self.connection.commit()
+        except sqlite3.Error as e:
+            self.logger.warning(f"Test result could not be cached: {e}")
+            self.connection.rollback()
+
+    def invalidate(self, assignment, question_ids=None):
+        """
+        Drops cached results of an assignment, or only of the given questions.
+        """
+        if question_ids is None:
+            self.cursor.execute('''DELETE FROM "test_results" WHERE "assignment" = ?''', (assignment,))
+        else:
+            for question_id in question_ids:
+                self.cursor.execute('''DELETE FROM "test_results" WHERE "assignment" = ? AND "question_id" = ?''',
+                                    (assignment, str(question_id)))
+        self.connection.commit()
+        self.logger.info(f"Invalidated cached test results for {assignment} questions {question_ids or 'all'}.")
+
+    def close_connection(self):
+        self.connection.close()
+
+
+class ReferenceOutputCache:
+    """
+    Persistent cache of the inputs and reference outputs of a question used for differential grading,
+    keyed on the reference solution, the input spec and the Python version.
+    """
+    def __init__(self, path=pathlib.Path('database', 'cache.db')):
+        self.logger = setup_logger("testcase")
+        try:
+            self.connection = self._open(path)
+        except sqlite3.Error as e:
+            # A cache that can not be opened only makes the reference outputs be computed again
+            self.logger.warning(f"Reference output cache {path} can not be opened, keeping outputs in memory: {e}")
+            self.connection = self._open(':memory:')
+        self.cursor = self.connection.cursor()
+
+    @staticmethod
+    def _open(path):
+        connection = connect(path)
+        connection.execute('''CREATE TABLE IF NOT EXISTS "reference_outputs" (
+                                  "assignment" TEXT NOT NULL,
+                                  "question_id" TEXT NOT NULL,
+                                  "key" TEXT NOT NULL,
+                                  "payload" BLOB NOT NULL,
+                                  PRIMARY KEY ("assignment", "question_id")
+                              )''')
+        connection.commit()
+        return connection
+
+    @staticmethod
+    def make_key(reference_code, spec):
+        digest = hashlib.sha256()
+        for part in (reference_code, json.dumps(spec, sort_keys=True), sys.version):
+            digest.update(part.encode())
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get(self, assignment, question_id, key):
+        """
+        Returns (inputs, outputs) if they were stored for the same key, else None, also when the cache can not be read.
+        """
+        try:
+            self.cursor.execute('''SELECT "key", "payload" FROM "reference_outputs" WHERE "assignment" = ? AND "question_id" = ?''',
+                                (assignment, str(question_id)))
+            row = self.cursor.fetchone()
+        except sqlite3.Error as e:
+            self.logger.warning(f"Reference output cache lookup failed, running the reference solution: {e}")
+            return None
+        if row is None or row[0] != key:
+            return None
+        return pickle.loads(row[1])
+
+    def put(self, assignment, question_id, key, inputs, outputs):
+        try:
+            self.cursor.execute('''INSERT OR REPLACE INTO "reference_outputs" ("assignment", "question_id", "key", "payload")
+                                   VALUES (?, ?, ?, ?)''',
+                                (assignment, str(question_id), key, pickle.dumps((inputs, outputs))))
+            self.connection.commit()
+        except sqlite3.Error as e:
+            self.logger.warning(f"Reference outputs could not be cached: {e}")
+            self.connection.rollback()
+
+    def close_connection(self):
+        self.connection.close()
+
+
+class ResponseCache:
+    """
+    Persistent cache of LLM responses keyed on the exact prompt and model parameters. Entries expire
+    after 'ttl' seconds and the least recently used ones are evicted beyond 'max_bytes' of responses.
+    Hit and miss counters are kept in the database, so they add up over all grading processes.
+    """
+    def __init__(self, path=pathlib.Path('database', 'cache.db'), ttl=30 * 24 * 3600, max_bytes=64 * 1024 * 1024):
+        self.logger = setup_logger()
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # Shared by the grading threads of a submission
+        self.lock = threading.Lock()
+        self.connection = connect(path, check_same_thread=False)
+        self.cursor = self.connection.cursor()
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS "llm_responses" (
+                                   "key" TEXT PRIMARY KEY,
+                                   "model" TEXT NOT NULL,
+                                   "content" TEXT NOT NULL,
+                                   "size" INTEGER NOT NULL,
+                                   "created" REAL NOT NULL,
+                                   "last_used" REAL NOT NULL
+                               )''')
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS "llm_cache_stats" (
+                                   "name" TEXT PRIMARY KEY,
+                                   "value" INTEGER NOT NULL
+                               )''')
+        self.cursor.execute('''INSERT OR IGNORE INTO "llm_cache_stats" ("name", "value") VALUES ('hits', 0), ('misses', 0)''')
+        self.connection.commit()
+
+    @staticmethod
+    def make_key(model, messages, **parameters):
+        """
+        Hashes a request. 'messages' is a list of (role, content) and 'parameters' the sampling parameters.
+        """
+        request = {"model": model, "messages": [list(message) for message in messages], "parameters": parameters}
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached response of a request or None if it is not cached or expired.
+        """
+        now = time.time()
+        with self.lock:
+            self.cursor.execute('''SELECT "content" FROM "llm_responses" WHERE "key" = ? AND "created" > ?''',
+                                (key, now - self.ttl))
+            row = self.cursor.fetchone()
+            if row is not None:
+                self.cursor.execute('''UPDATE "llm_responses" SET "last_used" = ? WHERE "key" = ?''', (now, key))
+            self.cursor.execute('''UPDATE "llm_cache_stats" SET "value" = "value" + 1 WHERE "name" = ?''',
+                                ('hits' if row is not None else 'misses',))
+            self.connection.commit()
+        return row[0] if row is not None else None
+
+    def put(self, key, model, content):
+        now = time.time()
+        with self.lock:
+            self.cursor.execute('''INSERT OR REPLACE INTO "llm_responses" ("key", "model", "content", "size", "created", "last_used")
+                                   VALUES (?, ?, ?, ?, ?, ?)''',
+                                (key, model, content, len(content.encode()), now, now))
+            self.cursor.execute('''DELETE FROM "llm_responses" WHERE "created" <= ?''', (now - self.ttl,))
+            # Evict the least recently used responses beyond the size limit
+            self.cursor.execute('''DELETE FROM "llm_responses" WHERE "key" IN (
+                                       SELECT "key" FROM (
+                                           SELECT "key", SUM("size") OVER (ORDER BY "last_used" DESC, "key") AS "total"
+                                           FROM "llm_responses"
+                                       ) WHERE "total" > ?
+                                   )''', (self.max_bytes,))
+            self.connection.commit()
+
+    def cached(self, model, messages, request, **parameters):
+        """
+        Returns the response of a request from the cache, or calls 'request()' and caches its response.
+        """
+        key = self.make_key(model, messages, **parameters)
+        content = self.get(key)
+        if content is not None:
+            self.logger.info("LLM response served from cache.")
+            return content
+        content = request()
+        if content:
+            self.put(key, model, content)
+        return content
+
+    def stats(self):
+        with self.lock:
+            self.cursor.execute('''SELECT "name", "value" FROM "llm_cache_stats"''')
+            stats = dict(self.cursor.fetchall())
+            self.cursor.execute('''SELECT COUNT(*), COALESCE(SUM("size"), 0) FROM "llm_responses"''')
+            stats["entries"], stats["bytes"] = self.cursor.fetchone()
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self.lock:
+            self.cursor.execute('''DELETE FROM "llm_responses"''')
+            self.cursor.execute('''UPDATE "llm_cache_stats" SET "value" = 0''')
+            self.connection.commit()
+
+    def close_connection(self):
+        self.connection.close()
+
+
+if __name__ == '__main__':
+    cache = ResponseCache()
+    if len(sys.argv) > 1 and sys.argv[1] == 'clear':
+        cache.clear()
+    print(json.dumps(cache.stats(), indent=4))
+    cache.close_connection()
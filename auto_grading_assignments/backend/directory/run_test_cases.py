@@ -1,11 +1,270 @@
 import os
 import sys, logging
-import importlib.util
+import time
+import types
+import signal
+import inspect
+import threading
+import contextlib
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from backend.logger_config import setup_logger
+from backend.directory.result_cache import TestResultCache
+from backend.directory.test_spec import load_test_spec, make_test_solution
 
+try:
+    import resource
+except ImportError:  # resource is not available on Windows
+    resource = None
 
-def concatenate_and_run_tests(solution_file, intern_id, assignment, test_case_folder):
+# Default limits for a single sandboxed test run
+TIMEOUT = 10          # wall-clock seconds
+CPU_LIMIT = 10        # CPU seconds
+MEMORY_LIMIT = 512    # MB of address space
+CASE_TIMEOUT = 2      # wall-clock seconds per test case
+
+# Test case sources and code objects by file path, kept warm across jobs in long-lived graders
+_test_case_cache = {}
+
+
+def get_context():
+    """
+    Prefers forking so worker processes inherit the already imported modules and loaded test cases.
+    """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+class TestTimeout(BaseException):
+    """
+    Raised when a solution runs past its time limit. Derives from BaseException so that
+    'except Exception' blocks in student code can not swallow it.
+    """
+
+
+def _raise_timeout(signum, frame):
+    raise TestTimeout()
+
+
+@contextlib.contextmanager
+def time_limit(seconds):
+    """
+    Raises TestTimeout in the block after 'seconds'. Only enforced in the main thread on platforms with SIGALRM.
+    """
+    if not seconds or not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _test_result(question_id, score=0, passed=None, not_passed=None, status='ok', error=None, cases=None):
+    # 'status' is 'ok', 'error', 'timeout' or 'crashed' for the solution, or 'no_tests' when the question's
+    # test cases are missing or broken, which says nothing about the solution
+    return {
+        "question_id": question_id,
+        "score": score,
+        "passed": passed or [],
+        "not_passed": not_passed or [],
+        "status": status,
+        "error": error,
+        "elapsed": 0.0,
+        "cached": False,
+        "cases": cases or [],
+    }
+
+
+def _short_repr(value, limit=200):
+    text = repr(value)
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+def _run_case(case, case_timeout):
+    """
+    Runs one test case yielded by a generator test_solution and returns its record.
+    A case is a dictionary with 'name', 'inputs', 'expected' and a 'run' callable returning the
+    actual value, and optionally a 'check' callable deciding if the actual value is correct.
+    """
+    record = {
+        "name": str(case.get('name', '')),
+        "inputs": _short_repr(case.get('inputs')),
+        "expected": _short_repr(case.get('expected')),
+        "actual": None,
+        "passed": False,
+        "elapsed": 0.0,
+        "error": None,
+    }
+    start = time.perf_counter()
+    try:
+        with time_limit(case_timeout):
+            actual = case['run']()
+        record["actual"] = _short_repr(actual)
+        check = case.get('check')
+        record["passed"] = bool(check(actual)) if callable(check) else actual == case.get('expected')
+    except TestTimeout:
+        record["error"] = f"did not finish within {case_timeout} seconds"
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["elapsed"] = time.perf_counter() - start
+    return record
+
+
+def _describe_case(record):
+    if record["name"] is None:
+        return record["error"]
+    if record["passed"]:
+        return f"Solution has passed test case '{record['name']}' with inputs {record['inputs']}"
+    if record["error"]:
+        return (f"Solution has not passed test case '{record['name']}' with inputs {record['inputs']}: "
+                f"{record['error']}")
+    return (f"Solution has not passed test case '{record['name']}' with inputs {record['inputs']}: "
+            f"expected {record['expected']}, got {record['actual']}")
+
+
+def _score_cases(question_id, records, status='ok', error=None):
+    passed = [_describe_case(record) for record in records if record["passed"]]
+    not_passed = [_describe_case(record) for record in records if not record["passed"]]
+    score = len(passed) / len(records) * 100 if records else 0
+    return _test_result(question_id, score=score, passed=passed, not_passed=not_passed, status=status,
+                        error=error, cases=records)
+
+
+def load_test_case(test_case_file_path):
+    """
+    Returns the source and compiled code of a test case file, reading it again only if it changed.
+    """
+    mtime = os.path.getmtime(test_case_file_path)
+    cached = _test_case_cache.get(test_case_file_path)
+    if cached is None or cached[0] != mtime:
+        with open(test_case_file_path, 'r') as test_file:
+            source = test_file.read()
+        cached = (mtime, source, compile(source, test_case_file_path, 'exec'))
+        _test_case_cache[test_case_file_path] = cached
+    return cached[1], cached[2]
+
+
+def test_case_file(assignment, test_case_folder, question_id):
+    """
+    Returns the path of a question's test cases, preferring the declarative JSON format over Python.
+    """
+    spec_path = os.path.join('Input', assignment, test_case_folder, f'{question_id}.json')
+    if os.path.exists(spec_path):
+        return spec_path
+    return os.path.join('Input', assignment, test_case_folder, f'{question_id}.py')
+
+
+def load_test_source(test_case_file_path):
+    if test_case_file_path.endswith('.json'):
+        return load_test_spec(test_case_file_path)[0]
+    return load_test_case(test_case_file_path)[0]
+
+
+def load_tests(test_case_file_path, namespace):
+    """
+    Defines 'test_solution' from a question's test cases in an executed solution namespace.
+    """
+    if test_case_file_path.endswith('.json'):
+        _, spec = load_test_spec(test_case_file_path)
+        namespace['test_solution'] = make_test_solution(spec)
+    else:
+        _, test_code = load_test_case(test_case_file_path)
+        exec(test_code, namespace)
+
+
+def load_test_cases(assignment, test_case_folder='Test Cases'):
+    """
+    Loads and compiles or parses every test case file of an assignment. Returns the number of files loaded.
+    """
+    testcase_logger = setup_logger("testcase")
+    test_case_path = os.path.join('Input', assignment, test_case_folder)
+    loaded = 0
+    for filename in sorted(os.listdir(test_case_path)):
+        if not filename.endswith(('.py', '.json')):
+            continue
+        try:
+            load_test_source(os.path.join(test_case_path, filename))
+            loaded += 1
+        except (SyntaxError, ValueError) as e:
+            testcase_logger.error(f"Test case {assignment}/{filename} can not be loaded: {e}")
+    return loaded
+
+
+def _evaluate(question_id, namespace, timeout=None, case_timeout=CASE_TIMEOUT, on_case=None):
+    """
+    Runs 'test_solution' against 'solution' from an executed module namespace and scores the result.
+    A generator 'test_solution' yields test cases that are timed and limited one by one, so the
+    cases that finish still earn credit. A 'test_solution' returning (passed, not_passed) runs
+    under a single time limit. 'on_case' is called with every finished case record.
+    """
+    testcase_logger = setup_logger("testcase")
+    solution_file = f"{question_id}.py"
+
+    # Get the solution and test_solution functions
+    solution_function = namespace.get('solution')
+    test_solution = namespace.get('test_solution')
+
+    # Validate functions
+    if not callable(solution_function):
+        testcase_logger.error(f"'solution' function not found in {solution_file}")
+        print(f"'solution' function not found in {solution_file}")
+        return _test_result(question_id, status='error', error="'solution' function not found")
+
+    if not callable(test_solution):
+        testcase_logger.error(f"'test_solution' function not found in {solution_file}")
+        print(f"'test_solution' function not found in {solution_file}")
+        return _test_result(question_id, status='no_tests', error="'test_solution' function not found")
+
+    print("both found")
+
+    # Run the tests
+    if inspect.isgeneratorfunction(test_solution):
+        records = []
+        cases = test_solution(solution_function)
+        while True:
+            try:
+                case = next(cases)
+            except StopIteration:
+                break
+            except Exception as e:
+                testcase_logger.error(f"Test cases of {solution_file} stopped early: {type(e).__name__}: {e}")
+                break
+            record = _run_case(case, case_timeout)
+            records.append(record)
+            if on_case is not None:
+                on_case(record)
+        result = _score_cases(question_id, records)
+        passed, not_passed = result['passed'], result['not_passed']
+    else:
+        with time_limit(timeout):
+            passed, not_passed = test_solution(solution_function)
+        result = None
+
+    if len(passed) + len(not_passed) == 0:
+        testcase_logger.error("No Test Cases were Run!")
+        print("No Test Cases were Run!")
+        return _test_result(question_id, status='no_tests', error="No Test Cases were Run")
+
+    # Calculate score
+    testcase_logger.info(f"Test Cases Passed {len(passed)}, Out of {len(not_passed) + len(passed)}")
+    print(f"Test Cases Passed {len(passed)}, Out of {len(not_passed) + len(passed)}")
+    if result is not None:
+        return result
+    score = (len(passed) / (len(passed) + len(not_passed))) * 100
+    return _test_result(question_id, score=score, passed=passed, not_passed=not_passed)
+
+
+def _run_tests(solution_file, intern_id, assignment, test_case_folder, on_case=None):
+    """
+    Runs the test cases of one question in the current process and returns a result dictionary.
+    """
     testcase_logger = setup_logger("testcase")
+    question_id = str(solution_file).removesuffix('.py')
     try:
         if isinstance(intern_id, int):
             intern_id = f"{intern_id}"
@@ -13,83 +272,198 @@ def concatenate_and_run_tests(solution_file, intern_id, assignment, test_case_fo
             solution_file = f"{solution_file}.py"
         # Construct full paths
         base_path = os.path.join('Input', assignment, intern_id)
-        test_case_path = os.path.join('Input', assignment, test_case_folder)
-        
+
         # Full file paths
         solution_file_path = os.path.join(base_path, solution_file)
-        test_case_file_path = os.path.join(test_case_path, solution_file)
-        
+        test_case_file_path = test_case_file(assignment, test_case_folder, question_id)
+
         # Log start of testing
         testcase_logger.info(f"\n-------------------------run_test_cases.py-------------\n"
                              f"Running Test Cases For\n"
                              f"Assignment: {assignment}\n"
                              f"Intern: {intern_id}\n"
                              f"Solution: {solution_file}")
-        
-        # Read solution and test case files
+
+        if not os.path.exists(test_case_file_path):
+            testcase_logger.error(f"Error: Test case file not found - {test_case_file_path}")
+            return _test_result(question_id, status='no_tests', error=f"Test case file not found - {test_case_file_path}")
+
+        # Read the solution
         with open(solution_file_path, 'r') as sol_file:
             solution_code = sol_file.read()
-        
-        with open(test_case_file_path, 'r') as test_file:
-            test_code = test_file.read()
-        
-        # Concatenate the files
-        combined_code = solution_code + '\n' + test_code
-        
-        # Create a temporary file with combined code
-        temp_file_path = os.path.join(base_path, f'temp_{solution_file}')
-        with open(temp_file_path, 'w') as temp_file:
-            temp_file.write(combined_code)
-        
-        # Dynamically execute the combined file
-        spec = importlib.util.spec_from_file_location("combined_module", temp_file_path)
-        module = importlib.util.module_from_spec(spec)
-        sys.path.insert(0, base_path)
-        spec.loader.exec_module(module)
-        
-        # Get the solution and test_solution functions
-        solution_function = getattr(module, 'solution', None)
-        test_solution = getattr(module, 'test_solution', None)
-        
-        # Validate functions
-        if not callable(solution_function):
-            testcase_logger.error(f"'solution' function not found in {solution_file}")
-            print(f"'solution' function not found in {solution_file}")
-            return 0, []
-        
-        if not callable(test_solution):
-            testcase_logger.error(f"'test_solution' function not found in {solution_file}")
-            print(f"'test_solution' function not found in {solution_file}")
-            return 0, []
-        
-        print("both found")
-
-        # Run the tests
-        passed, not_passed = test_solution(solution_function)
-        
-        if len(passed) + len(not_passed) == 0:
-            testcase_logger.error("No Test Cases were Run!")
-            print("No Test Cases were Run!")
-            return 0, []
-        
-        # Calculate score
-        score = (len(passed) / (len(passed) + len(not_passed))) * 100
-        testcase_logger.info(f"Test Cases Passed {len(passed)}, Out of {len(not_passed) + len(passed)}")
-        print(f"Test Cases Passed {len(passed)}, Out of {len(not_passed) + len(passed)}")
-        
-        # Clean up temporary file
-        os.remove(temp_file_path)
-        
-        return score, not_passed
-    
+
+        # Execute it and the cached test cases in one fresh module namespace, as if they were one file
+        module = types.ModuleType("combined_module")
+        module.__file__ = solution_file_path
+        exec(compile(solution_code, solution_file_path, 'exec'), module.__dict__)
+        try:
+            load_tests(test_case_file_path, module.__dict__)
+        except Exception as e:
+            testcase_logger.error(f"Test cases {test_case_file_path} can not be loaded: {e}")
+            return _test_result(question_id, status='no_tests',
+                                error=f"Could not load test cases: {type(e).__name__}: {e}")
+
+        return _evaluate(question_id, module.__dict__, on_case=on_case)
+
     except FileNotFoundError as e:
         testcase_logger.error(f"Error: File not found - {e}")
         print(f"Error: File not found - {e}")
-        return 0, []
+        return _test_result(question_id, status='error', error=f"File not found - {e}")
     except Exception as e:
         testcase_logger.error(f"Unexpected error: {e}")
         print(f"Unexpected error: {e}")
-        return 0, []
+        return _test_result(question_id, status='error', error=f"Unexpected error: {type(e).__name__}: {e}")
+
+
+def _set_limits(memory_limit, cpu_limit):
+    if resource is None:
+        return
+    limits = [(resource.RLIMIT_CPU, cpu_limit), (resource.RLIMIT_AS, memory_limit * 1024 * 1024)]
+    for limit, value in limits:
+        if not value:
+            continue
+        try:
+            resource.setrlimit(limit, (value, value))
+        except (ValueError, OSError):
+            # Some platforms (e.g. macOS for RLIMIT_AS) refuse to lower the limit
+            pass
+
+
+def _sandbox_worker(conn, solution_file, intern_id, assignment, test_case_folder, memory_limit, cpu_limit):
+    """
+    Entry point of a sandbox process. Sends ('case', record) for every finished test case and
+    finally ('result', result) back through 'conn'.
+    """
+    _set_limits(memory_limit, cpu_limit)
+    question_id = str(solution_file).removesuffix('.py')
+    try:
+        result = _run_tests(solution_file, intern_id, assignment, test_case_folder,
+                            on_case=lambda record: conn.send(('case', record)))
+    except BaseException as e:
+        # sys.exit, KeyboardInterrupt or MemoryError raised by the student's code
+        result = _test_result(question_id, status='error', error=f"{type(e).__name__}: {e}")
+    try:
+        conn.send(('result', result))
+    finally:
+        conn.close()
+
+
+class SandboxRunner:
+    """
+    Runs test cases for student solutions in separate worker processes, each limited by a wall-clock
+    timeout and RLIMIT_AS/RLIMIT_CPU, so a misbehaving solution can not stall or kill the grader.
+    """
+    def __init__(self, max_workers=None, timeout=TIMEOUT, memory_limit=MEMORY_LIMIT, cpu_limit=CPU_LIMIT):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.cpu_limit = cpu_limit
+        self.context = get_context()
+        self.logger = setup_logger("testcase")
+
+    def run_one(self, solution_file, intern_id, assignment, test_case_folder='Test Cases'):
+        question_id = str(solution_file).removesuffix('.py')
+        receiver, sender = self.context.Pipe(duplex=False)
+        process = self.context.Process(target=_sandbox_worker,
+                                       args=(sender, solution_file, str(intern_id), assignment, test_case_folder,
+                                             self.memory_limit, self.cpu_limit),
+                                       daemon=True)
+        start = time.perf_counter()
+        process.start()
+        sender.close()
+
+        result = None
+        records = []
+        deadline = start + self.timeout
+        try:
+            while result is None and receiver.poll(max(deadline - time.perf_counter(), 0)):
+                kind, message = receiver.recv()
+                if kind == 'case':
+                    records.append(message)
+                else:
+                    result = message
+        except EOFError:
+            # The process died before sending its result back
+            pass
+        finally:
+            receiver.close()
+
+        if process.is_alive():
+            process.kill()
+        process.join()
+
+        if result is None:
+            if time.perf_counter() >= deadline:
+                status, error = 'timeout', f"Solution did not finish within {self.timeout} seconds"
+            else:
+                status, error = 'crashed', f"Solution crashed the test process (exit code {process.exitcode})"
+            if records:
+                # Credit the cases that finished, counting the interrupted one as failed
+                interrupted = {"name": None, "inputs": None, "expected": None, "actual": None,
+                               "passed": False, "elapsed": 0.0, "error": error}
+                result = _score_cases(question_id, records + [interrupted], status=status, error=error)
+            else:
+                result = _test_result(question_id, status=status, error=error, not_passed=[error])
+            self.logger.error(f"{assignment}/{intern_id}/{question_id}: {error}")
+
+        result['elapsed'] = time.perf_counter() - start
+        return result
+
+    def run_many(self, jobs):
+        """
+        Runs a list of (solution_file, intern_id, assignment, test_case_folder) jobs in parallel.
+        Results are returned in the same order as the jobs.
+        """
+        if not jobs:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(jobs))) as executor:
+            return list(executor.map(lambda job: self.run_one(*job), jobs))
+
+
+def _cache_key(intern_id, assignment, question_id, test_case_folder):
+    try:
+        with open(os.path.join('Input', assignment, str(intern_id), f'{question_id}.py'), 'r') as sol_file:
+            solution_code = sol_file.read()
+        test_code = load_test_source(test_case_file(assignment, test_case_folder, question_id))
+    except (OSError, SyntaxError, ValueError):
+        # Let the sandbox report the problem
+        return None
+    return TestResultCache.make_key(solution_code, test_code)
+
+
+def run_submission_tests(intern_id, assignment, question_ids, test_case_folder='Test Cases', runner=None, cache=None):
+    """
+    Runs the test cases of every question of a submission in parallel, reusing cached results of
+    identical solutions. Returns a dictionary of question_id to result dictionary.
+    """
+    runner = runner or SandboxRunner()
+    own_cache = cache is None
+    cache = cache or TestResultCache()
+    results = {}
+    keys = {}
+    try:
+        for question_id in map(str, question_ids):
+            keys[question_id] = _cache_key(intern_id, assignment, question_id, test_case_folder)
+            cached = cache.get(keys[question_id]) if keys[question_id] else None
+            if cached is not None:
+                results[question_id] = _test_result(question_id, score=cached[0], not_passed=cached[1])
+                results[question_id]['cached'] = True
+
+        missing = [question_id for question_id in map(str, question_ids) if question_id not in results]
+        jobs = [(question_id, intern_id, assignment, test_case_folder) for question_id in missing]
+        for question_id, result in zip(missing, runner.run_many(jobs)):
+            results[question_id] = result
+            if result['status'] == 'ok' and keys[question_id]:
+                cache.put(keys[question_id], assignment, question_id, result['score'], result['not_passed'])
+    finally:
+        if own_cache:
+            cache.close_connection()
+    return {str(question_id): results[str(question_id)] for question_id in question_ids}
+
+
+def concatenate_and_run_tests(solution_file, intern_id, assignment, test_case_folder):
+    result = SandboxRunner(max_workers=1).run_one(solution_file, intern_id, assignment, test_case_folder)
+    return result['score'], result['not_passed']
 
 if __name__ == '__main__':
-    concatenate_and_run_tests('1.py', '3', 'Python_DSA_2', 'Test Cases')
\ No newline at end of file
+    concatenate_and_run_tests('1.py', '3', 'Python_DSA_2', 'Test Cases')
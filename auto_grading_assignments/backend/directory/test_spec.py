@@ -0,0 +1,188 @@
+import json
+import math
+import os
+from collections import Counter
+
+# Declarative test cases, stored as Input/<assignment>/Test Cases/<n>.json:
+# {
+#     "list_node": {"value": "value", "next": "next"},
+#     "cases": [
+#         {
+#             "name": "merging two non-empty lists",
+#             "inputs": [{"linked_list": [1, 3, 5]}, {"linked_list": [2, 4, 6]}],
+#             "expected": [1, 2, 3, 4, 5, 6],
+#             "output": "linked_list"
+#         }
+#     ]
+# }
+# An input is a plain JSON value or a one-key object naming a builder: linked_list, tree, tuple, set.
+# "output" converts the returned value before comparing: linked_list, tree, sorted, set.
+# "compare" can be "exact" (default), "unordered" or "float".
+
+# Parsed specs by file path, kept warm across jobs in long-lived graders
+_test_spec_cache = {}
+
+DEFAULT_LIST_NODE = {"value": "value", "next": "next"}
+DEFAULT_TREE_NODE = {"value": "val", "left": "left", "right": "right"}
+
+
+class Node:
+    """
+    Node of the linked lists and binary trees built for test cases. Attribute names follow the spec.
+    """
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+    def __repr__(self):
+        return f"Node({self.__dict__})"
+
+
+def _build_linked_list(values, names):
+    head = None
+    for value in reversed(values):
+        head = Node(**{names["value"]: value, names["next"]: head})
+    return head
+
+
+def _build_tree(values, names):
+    """
+    Builds a binary tree from its level order values, with null for missing children.
+    """
+    if not values or values[0] is None:
+        return None
+    make = lambda value: Node(**{names["value"]: value, names["left"]: None, names["right"]: None})
+    root = make(values[0])
+    queue = [root]
+    i = 1
+    for node in queue:
+        for side in (names["left"], names["right"]):
+            if i < len(values) and values[i] is not None:
+                child = make(values[i])
+                setattr(node, side, child)
+                queue.append(child)
+            i += 1
+        if i >= len(values):
+            break
+    return root
+
+
+def _linked_list_values(node, names, limit=100000):
+    values = []
+    while node is not None and len(values) < limit:
+        values.append(getattr(node, names["value"]))
+        node = getattr(node, names["next"])
+    return values
+
+
+def _tree_values(root, names):
+    values = []
+    queue = [root]
+    for node in queue:
+        if node is None:
+            values.append(None)
+            continue
+        values.append(getattr(node, names["value"]))
+        queue.append(getattr(node, names["left"], None))
+        queue.append(getattr(node, names["right"], None))
+    while values and values[-1] is None:
+        values.pop()
+    return values
+
+
+def build_input(value, spec):
+    if isinstance(value, dict) and len(value) == 1:
+        builder, data = next(iter(value.items()))
+        if builder == 'linked_list':
+            return _build_linked_list(data, spec.get("list_node", DEFAULT_LIST_NODE))
+        if builder == 'tree':
+            return _build_tree(data, spec.get("tree_node", DEFAULT_TREE_NODE))
+        if builder == 'tuple':
+            return tuple(data)
+        if builder == 'set':
+            return set(data)
+    return value
+
+
+def convert_output(value, output, spec):
+    if output == 'linked_list':
+        return _linked_list_values(value, spec.get("list_node", DEFAULT_LIST_NODE))
+    if output == 'tree':
+        return _tree_values(value, spec.get("tree_node", DEFAULT_TREE_NODE))
+    if output == 'sorted':
+        return sorted(value)
+    if output == 'set':
+        return sorted(set(value))
+    if isinstance(value, tuple):
+        # JSON has no tuples, so compare them as lists
+        return list(value)
+    return value
+
+
+def outputs_match(expected, actual, compare='exact'):
+    """
+    Compares two outputs: 'exact' uses ==, 'unordered' ignores the order of list items and
+    'float' allows small floating point differences.
+    """
+    if compare == 'unordered' and isinstance(expected, (list, tuple)) and isinstance(actual, (list, tuple)):
+        return Counter(map(repr, expected)) == Counter(map(repr, actual))
+    if compare == 'float':
+        if isinstance(expected, (list, tuple)) and isinstance(actual, (list, tuple)):
+            return len(expected) == len(actual) and all(outputs_match(e, a, compare) for e, a in zip(expected, actual))
+        if isinstance(expected, (int, float)) and isinstance(actual, (int, float)):
+            return math.isclose(expected, actual, rel_tol=1e-6, abs_tol=1e-9)
+    return expected == actual
+
+
+def validate_spec(spec):
+    """
+    Checks the structure of a parsed spec and drops duplicate cases. Raises ValueError if it is invalid.
+    """
+    if not isinstance(spec, dict) or not isinstance(spec.get("cases"), list):
+        raise ValueError("test spec must be an object with a list of 'cases'")
+    cases = []
+    seen = set()
+    for i, case in enumerate(spec["cases"], start=1):
+        if not isinstance(case, dict) or "inputs" not in case or "expected" not in case:
+            raise ValueError(f"case {i} needs 'inputs' and 'expected'")
+        if not isinstance(case["inputs"], list):
+            raise ValueError(f"case {i}: 'inputs' must be a list of arguments")
+        fingerprint = json.dumps([case["inputs"], case.get("output"), case["expected"]], sort_keys=True)
+        if fingerprint in seen:
+            continue
+        seen.add(fingerprint)
+        cases.append(dict(case, name=case.get("name") or f"case {i}"))
+    return dict(spec, cases=cases)
+
+
+def load_test_spec(path):
+    """
+    Returns the source and the validated spec of a JSON test case file, parsing it again only if it changed.
+    """
+    mtime = os.path.getmtime(path)
+    cached = _test_spec_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'r') as file:
+            source = file.read()
+        cached = (mtime, source, validate_spec(json.loads(source)))
+        _test_spec_cache[path] = cached
+    return cached[1], cached[2]
+
+
+def make_test_solution(spec):
+    """
+    Turns a spec into a generator 'test_solution' yielding cases for the test runner.
+    """
+    def test_solution(solution):
+        for case in spec["cases"]:
+            output = case.get("output")
+            compare = case.get("compare", "exact")
+            yield {
+                "name": case["name"],
+                "inputs": case["inputs"],
+                "expected": case["expected"],
+                # Inputs are built for every run as solutions may change them in place
+                "run": lambda case=case, output=output: convert_output(
+                    solution(*[build_input(value, spec) for value in case["inputs"]]), output, spec),
+                "check": lambda actual, case=case, compare=compare: outputs_match(case["expected"], actual, compare),
+            }
+    return test_solution
@@ -0,0 +1,78 @@
+import importlib
+import threading
+import time
+from backend.directory.run_test_cases import get_context, load_test_cases
+from backend.logger_config import setup_logger
+
+# Modules every grading job needs, imported once by the long-lived parent
+HARNESS_MODULES = [
+    'sqlite3',
+    'smtplib',
+    'openai',
+    'database.DataBase',
+    'backend.api.chatgpt_api',
+    'backend.api.mail',
+    'backend.directory.getinput',
+    'backend.directory.run_test_cases',
+    'grade_once',
+]
+
+
+class WarmWorkerPool:
+    """
+    Keeps the grading harness imported and the test cases of assignments compiled in a long-lived
+    process, and forks a clean child process from it for every job.
+    """
+    def __init__(self, max_workers=1, preload=HARNESS_MODULES):
+        self.logger = setup_logger()
+        self.context = get_context()
+        self.slots = threading.BoundedSemaphore(max_workers)
+        self.warm_assignments = set()
+        self.modules = {}
+        for module_name in preload:
+            try:
+                self.modules[module_name] = importlib.import_module(module_name)
+            except Exception as e:
+                self.logger.error(f"Could not preload {module_name}: {e}")
+        self.logger.info(f"Worker pool preloaded {len(self.modules)} modules.")
+
+    def warm(self, assignment, test_case_folder='Test Cases'):
+        """
+        Compiles the test cases of an assignment so every forked child starts with them loaded.
+        """
+        try:
+            loaded = load_test_cases(assignment, test_case_folder)
+        except FileNotFoundError as e:
+            self.logger.error(f"Could not load test cases for {assignment}: {e}")
+            return
+        if assignment not in self.warm_assignments:
+            self.warm_assignments.add(assignment)
+            self.logger.info(f"Loaded {loaded} test case files for {assignment}.")
+
+    def submit(self, target, *args):
+        """
+        Forks a child process running target(*args). Blocks while all worker slots are busy.
+        """
+        self.slots.acquire()
+        start = time.perf_counter()
+        process = self.context.Process(target=target, args=args)
+        try:
+            process.start()
+        except Exception:
+            self.slots.release()
+            raise
+        self.logger.debug(f"Forked worker {process.pid} in {(time.perf_counter() - start) * 1000:.1f} ms.")
+        threading.Thread(target=self._release_on_exit, args=(process,), daemon=True).start()
+        return process
+
+    def run(self, target, *args):
+        """
+        Runs target(*args) in a forked child process and waits for it. Returns the exit code.
+        """
+        process = self.submit(target, *args)
+        process.join()
+        return process.exitcode
+
+    def _release_on_exit(self, process):
+        process.join()
+        self.slots.release()
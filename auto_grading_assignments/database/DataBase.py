@@ -1,9 +1,46 @@
 import sqlite3
+import time
+
+QUESTION_GRADES = '''CREATE TABLE IF NOT EXISTS "question_grades" (
+                         "intern_id" INTEGER NOT NULL,
+                         "assignment_id" INTEGER NOT NULL,
+                         "question_id" TEXT NOT NULL,
+                         "solution_hash" TEXT NOT NULL,
+                         "grade" REAL NOT NULL,
+                         "feedback" TEXT NOT NULL,
+                         "graded" REAL NOT NULL,
+                         "test_score" REAL,
+                         "llm_score" REAL,
+                         "model" TEXT,
+                         "tokens" INTEGER,
+                         "test_seconds" REAL,
+                         "grading_seconds" REAL,
+                         "time_growth" TEXT,
+                         "memory_growth" TEXT,
+                         "benchmark_seconds" REAL,
+                         "benchmark_memory" INTEGER,
+                         "performance_score" REAL,
+                         PRIMARY KEY ("intern_id", "assignment_id", "question_id"),
+                         FOREIGN KEY ("intern_id") REFERENCES "interns"("id"),
+                         FOREIGN KEY ("assignment_id") REFERENCES "assignments"("id")
+                     )'''
+# Details of a question's grading, stored next to its grade and feedback
+QUESTION_DETAILS = {"test_score": "REAL", "llm_score": "REAL", "model": "TEXT", "tokens": "INTEGER",
+                    "test_seconds": "REAL", "grading_seconds": "REAL", "time_growth": "TEXT", "memory_growth": "TEXT",
+                    "benchmark_seconds": "REAL", "benchmark_memory": "INTEGER", "performance_score": "REAL"}
 
 class Connect_DB:
     def __init__(self, path: str):
         self.connection = sqlite3.connect(path)
         self.cursor = self.connection.cursor()
+        # Databases set up before grades were kept per question, or before their details were
+        self.cursor.execute(QUESTION_GRADES)
+        self.cursor.execute('''PRAGMA table_info("question_grades")''')
+        columns = {row[1] for row in self.cursor.fetchall()}
+        for column, definition in QUESTION_DETAILS.items():
+            if column not in columns:
+                self.cursor.execute(f'''ALTER TABLE "question_grades" ADD COLUMN "{column}" {definition}''')
+        self.connection.commit()
 
     def get_assignment_id(self, assignment_topic, subject_name, batch_number):
         batch_number = str(batch_number)
@@ -56,11 +93,56 @@ class Connect_DB:
         if intern_id is None:
             intern_id = self.get_intern_id(intern_email, intern_phone)     
 
+        self._upsert_grade(intern_id, assignment_id, score)
+        self.connection.commit()
+
+    def _upsert_grade(self, intern_id, assignment_id, score):
+        # A regrade replaces the earlier grade
         query = '''INSERT INTO grades (intern_id, assignment_id, score) 
-                   VALUES (?, ?, ?)'''
+                   VALUES (?, ?, ?)
+                   ON CONFLICT (intern_id, assignment_id) DO UPDATE SET score = excluded.score'''
         self.cursor.execute(query, (str(intern_id), str(assignment_id), str(score)))
-        self.connection.commit()
     
+    def get_question_grades(self, intern_id, assignment_id):
+        """
+        Returns the last grade, feedback, solution hash and grading details of every question of an intern's assignment.
+        """
+        query = f'''SELECT "question_id", "grade", "feedback", "solution_hash", "graded", {', '.join(QUESTION_DETAILS)}
+                    FROM "question_grades" WHERE "intern_id" = ? AND "assignment_id" = ?'''
+        self.cursor.execute(query, (intern_id, assignment_id))
+        names = [column[0] for column in self.cursor.description]
+        return {row[0]: dict(zip(names[1:], row[1:])) for row in self.cursor.fetchall()}
+
+    def save_grades(self, intern_id, assignment_id, score, question_grades):
+        """
+        Stores an intern's grade of an assignment and the grades of the questions graded for it in one
+        transaction. 'question_grades' are dictionaries with "question_id", "grade", "feedback",
+        "solution_hash" and optionally the QUESTION_DETAILS; they replace the earlier grades of those questions.
+        """
+        query = f'''INSERT OR REPLACE INTO "question_grades" ("intern_id", "assignment_id", "question_id", "solution_hash",
+                                                               "grade", "feedback", "graded", {', '.join(QUESTION_DETAILS)})
+                    VALUES (?, ?, ?, ?, ?, ?, ?{', ?' * len(QUESTION_DETAILS)})'''
+        now = time.time()
+        try:
+            self.cursor.executemany(query, [(intern_id, assignment_id, str(row["question_id"]), row["solution_hash"],
+                                             row["grade"], row["feedback"], now) + tuple(row.get(column) for column in QUESTION_DETAILS)
+                                            for row in question_grades])
+            self._upsert_grade(intern_id, assignment_id, score)
+            self.connection.commit()
+        except BaseException:
+            self.connection.rollback()
+            raise
+
+    def invalidate_question_grades(self, assignment_id, question_ids):
+        """
+        Forgets which solutions the stored grades of some questions of an assignment were for, so every
+        student's next submission grades them again. Their grades and feedback can still be resent.
+        """
+        self.cursor.execute(f'''UPDATE "question_grades" SET "solution_hash" = ''
+                                WHERE "assignment_id" = ? AND "question_id" IN ({', '.join('?' * len(question_ids))})''',
+                            [assignment_id] + [str(question_id) for question_id in question_ids])
+        self.connection.commit()
+
     def insert_into_assignments(self, subject_id, assignment_topic, total_score):
         query = '''INSERT INTO assignments (subject_id, assignment_topic, total_score)
                    VALUES (?, ?, ?)'''
@@ -0,0 +1,338 @@
+import datetime
+import json
+import os
+import pathlib
+import sqlite3
+import time
+
+# Seconds a claimed job stays invisible to other workers before it is considered abandoned
+VISIBILITY_TIMEOUT = 30 * 60
+MAX_ATTEMPTS = 3
+
+# Finished jobs of an assignment whose token usage projects the tokens of its new jobs
+ESTIMATE_SAMPLES = 20
+
+# Lanes, claimed in this order: single regrades requested by a teacher, then student submissions
+LANE_REGRADE = 0
+LANE_SUBMISSION = 1
+
+# Claim orders. 'edf' takes the earliest assignment deadline first and the smallest job within a deadline;
+# 'size' is the old smallest job first order, kept for comparing policies with simulate_schedule.py
+POLICIES = {
+    'edf': '"lane", "deadline" IS NULL, "deadline", "requests", "created", "id"',
+    'size': '"lane", "requests", "assignment", "student_email", "id"',
+}
+
+
+class JobQueue:
+    """
+    Durable grading job queue in a WAL mode SQLite database, shared by every grader process.
+    Jobs go from 'pending' to 'running' when a worker claims them, then to 'done', back to
+    'pending' for a retry, or to 'failed' after MAX_ATTEMPTS. A running job whose worker did not
+    finish it within the visibility timeout can be claimed again. Jobs are claimed in the order
+    of a policy in POLICIES.
+    """
+    def __init__(self, path=pathlib.Path('database', 'jobs.db'), visibility_timeout=VISIBILITY_TIMEOUT,
+                 max_attempts=MAX_ATTEMPTS, policy='edf'):
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.order = POLICIES[policy]
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.cursor = self.connection.cursor()
+        self.cursor.execute('PRAGMA journal_mode=WAL')
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS "grading_jobs" (
+                                   "id" INTEGER PRIMARY KEY,
+                                   "assignment" TEXT NOT NULL,
+                                   "student_email" TEXT NOT NULL,
+                                   "requests" INTEGER NOT NULL,
+                                   "status" TEXT NOT NULL DEFAULT 'pending'
+                                       CHECK("status" IN ('pending', 'running', 'done', 'failed')),
+                                   "attempts" INTEGER NOT NULL DEFAULT 0,
+                                   "worker" TEXT,
+                                   "error" TEXT,
+                                   "created" REAL NOT NULL,
+                                   "updated" REAL NOT NULL,
+                                   "claimed_until" REAL,
+                                   "lane" INTEGER NOT NULL DEFAULT 1,
+                                   "deadline" TEXT,
+                                   "tokens" INTEGER,
+                                   "tokens_used" INTEGER,
+                                   "questions" TEXT
+                               )''')
+        # Queues made before lanes, deadlines, token budgets and incremental regrades existed
+        self.cursor.execute('PRAGMA table_info("grading_jobs")')
+        columns = {row["name"] for row in self.cursor.fetchall()}
+        for column, definition in (("lane", f"INTEGER NOT NULL DEFAULT {LANE_SUBMISSION}"), ("deadline", "TEXT"),
+                                   ("tokens", "INTEGER"), ("tokens_used", "INTEGER"), ("questions", "TEXT")):
+            if column not in columns:
+                self.cursor.execute(f'''ALTER TABLE "grading_jobs" ADD COLUMN "{column}" {definition}''')
+        # One pending job per student and assignment, so repeated uploads collapse into one
+        self.cursor.execute('''CREATE UNIQUE INDEX IF NOT EXISTS "idx_grading_jobs_pending"
+                               ON "grading_jobs" ("assignment", "student_email") WHERE "status" = 'pending' ''')
+        self.cursor.execute('''DROP INDEX IF EXISTS "idx_grading_jobs_order"''')
+        self.cursor.execute('''CREATE INDEX IF NOT EXISTS "idx_grading_jobs_priority"
+                               ON "grading_jobs" ("status", "lane", "deadline", "requests")''')
+        # API requests (or tokens, for token budgets) left for today, shared by every worker of every grader process
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS "request_budget" (
+                                   "name" TEXT PRIMARY KEY,
+                                   "day" TEXT NOT NULL,
+                                   "requests_limit" INTEGER NOT NULL,
+                                   "requests_left" INTEGER NOT NULL
+                               )''')
+
+    def enqueue(self, assignment, student_email, requests, deadline=None, lane=LANE_SUBMISSION, created=None,
+                tokens=None, questions=None, cost=None):
+        """
+        Adds a pending job. 'deadline' is the assignment's deadline as an ISO date, if it has one, 'tokens'
+        the projected tokens of the job and 'questions' the questions to grade, None for all. Returns False
+        if a job of the same student and assignment is already pending: the two are merged into one that
+        grades the questions of both, priced by 'cost', a function of the merged questions returning their
+        requests and tokens. A regrade moves the merged job to the regrade lane.
+        """
+        now = time.time() if created is None else created
+        self.cursor.execute('BEGIN IMMEDIATE')
+        try:
+            self.cursor.execute('''SELECT "id", "questions", "requests", "tokens" FROM "grading_jobs"
+                                   WHERE "assignment" = ? AND "student_email" = ? AND "status" = 'pending' ''',
+                                (assignment, student_email))
+            pending = self.cursor.fetchone()
+            if pending is None:
+                self.cursor.execute('''INSERT INTO "grading_jobs" ("assignment", "student_email", "requests", "deadline", "lane",
+                                                                 "tokens", "questions", "created", "updated")
+                                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                                    (assignment, student_email, int(requests), deadline, lane,
+                                     None if tokens is None else int(tokens),
+                                     None if questions is None else json.dumps(sorted(map(str, questions))), now, now))
+            else:
+                if pending["questions"] is None or questions is None:
+                    merged = None
+                else:
+                    merged = sorted(set(json.loads(pending["questions"])) | set(map(str, questions)))
+                if cost is not None:
+                    requests, tokens = cost(merged)
+                else:
+                    requests = max(pending["requests"], int(requests))
+                    tokens = tokens if pending["tokens"] is None else max(pending["tokens"], tokens or 0)
+                self.cursor.execute('''UPDATE "grading_jobs" SET "questions" = ?, "requests" = ?, "tokens" = ?,
+                                           "lane" = MIN("lane", ?)
+                                       WHERE "id" = ?''',
+                                    (None if merged is None else json.dumps(merged), int(requests),
+                                     None if tokens is None else int(tokens), lane, pending["id"]))
+            self.cursor.execute('COMMIT')
+        except BaseException:
+            self.cursor.execute('ROLLBACK')
+            raise
+        return pending is None
+
+    def tokens_per_request(self, assignment, samples=ESTIMATE_SAMPLES):
+        """
+        Average tokens a request of the assignment's last finished jobs used, or None before any finished.
+        """
+        self.cursor.execute('''SELECT SUM("tokens_used"), SUM("requests") FROM (
+                                   SELECT "tokens_used", "requests" FROM "grading_jobs"
+                                   WHERE "assignment" = ? AND "status" = 'done' AND "tokens_used" > 0
+                                   ORDER BY "updated" DESC LIMIT ?
+                               )''', (assignment, samples))
+        tokens, requests = self.cursor.fetchone()
+        return tokens / requests if tokens and requests else None
+
+    def set_budget(self, requests_limit, requests_left=None, name='grading', available=None):
+        """
+        Sets the daily limit of a budget, in requests or for token budgets in tokens, and returns what is left
+        of it today. On a new day it is reset to the limit, and a limit changed during the day changes it by as
+        much. 'requests_left' only seeds a budget that does not exist yet. What is left never exceeds 'available',
+        e.g. the requests the API keys really have left after requests sent outside the queue.
+        """
+        today = str(datetime.date.today())
+        self.cursor.execute('BEGIN IMMEDIATE')
+        try:
+            self.cursor.execute('''SELECT "day", "requests_limit", "requests_left" FROM "request_budget"
+                                   WHERE "name" = ?''', (name,))
+            row = self.cursor.fetchone()
+            if row is None:
+                left = requests_limit if requests_left is None else requests_left
+            elif row["day"] != today:
+                left = requests_limit
+            else:
+                left = max(0, row["requests_left"] + requests_limit - row["requests_limit"])
+            if available is not None:
+                left = min(left, available)
+            self.cursor.execute('''INSERT OR REPLACE INTO "request_budget" ("name", "day", "requests_limit", "requests_left")
+                                   VALUES (?, ?, ?, ?)''', (name, today, int(requests_limit), int(left)))
+            self.cursor.execute('COMMIT')
+        except BaseException:
+            self.cursor.execute('ROLLBACK')
+            raise
+        return left
+
+    def requests_left(self, name='grading'):
+        self.cursor.execute('''SELECT "day", "requests_limit", "requests_left" FROM "request_budget" WHERE "name" = ?''',
+                            (name,))
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        return row["requests_left"] if row["day"] == str(datetime.date.today()) else row["requests_limit"]
+
+    def _budget_left(self, name, today):
+        self.cursor.execute('''SELECT "day", "requests_limit", "requests_left" FROM "request_budget" WHERE "name" = ?''',
+                            (name,))
+        row = self.cursor.fetchone()
+        if row is None:
+            return 0
+        return row["requests_left"] if row["day"] == today else row["requests_limit"]
+
+    def claim(self, worker, max_requests=None, budget=None, token_budget=None):
+        """
+        Atomically claims the first pending (or abandoned) job in the policy's order among those needing no more
+        than 'max_requests', so that smaller jobs use up the requests a larger one could not.
+        With a 'budget' name the job must also fit in the requests left of that budget, and with a 'token_budget'
+        name its projected tokens in the tokens left of that one. Both are reduced by the job in the same
+        transaction. Returns the job as a dictionary or None.
+        """
+        if budget is None and token_budget is None:
+            return self._claim(worker, max_requests)
+        today = str(datetime.date.today())
+        self.cursor.execute('BEGIN IMMEDIATE')
+        try:
+            if budget is not None:
+                left = self._budget_left(budget, today)
+                max_requests = left if max_requests is None else min(left, max_requests)
+            tokens_left = self._budget_left(token_budget, today) if token_budget is not None else None
+            job = self._claim(worker, max_requests, tokens_left)
+            if job is not None:
+                spent = [(budget, job["requests"])] if budget is not None else []
+                if token_budget is not None:
+                    spent.append((token_budget, job["tokens"] or 0))
+                for name, amount in spent:
+                    self.cursor.execute('''UPDATE "request_budget" SET "day" = ?,
+                                               "requests_left" = CASE WHEN "day" = ? THEN "requests_left" ELSE "requests_limit" END - ?
+                                           WHERE "name" = ?''', (today, today, amount, name))
+            self.cursor.execute('COMMIT')
+        except BaseException:
+            self.cursor.execute('ROLLBACK')
+            raise
+        return job
+
+    def _claim(self, worker, max_requests=None, max_tokens=None):
+        now = time.time()
+        self.cursor.execute('''UPDATE "grading_jobs"
+                               SET "status" = 'failed', "error" = 'abandoned by its worker', "updated" = ?
+                               WHERE "status" = 'running' AND "claimed_until" < ? AND "attempts" >= ?''',
+                            (now, now, self.max_attempts))
+        self.cursor.execute(f'''UPDATE "grading_jobs"
+                                SET "status" = 'running', "attempts" = "attempts" + 1, "worker" = ?,
+                                    "claimed_until" = ?, "updated" = ?
+                                WHERE "id" = (
+                                    SELECT "id" FROM "grading_jobs"
+                                    WHERE ("status" = 'pending' OR ("status" = 'running' AND "claimed_until" < ?))
+                                        AND "requests" <= ? AND COALESCE("tokens", 0) <= ?
+                                    ORDER BY {self.order}
+                                    LIMIT 1
+                                )
+                                RETURNING *''',
+                            (worker, now + self.visibility_timeout, now, now,
+                             max_requests if max_requests is not None else float('inf'),
+                             max_tokens if max_tokens is not None else float('inf')))
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["questions"] = None if job["questions"] is None else json.loads(job["questions"])
+        return job
+
+    def _settle(self, job_id, tokens_used, token_budget, requests_used=None, budget=None):
+        """
+        Records the tokens a job used and gives the difference with its projection back to today's token budget,
+        and with 'requests_used' the difference with its claimed requests back to today's 'budget'.
+        Must be called inside a transaction.
+        """
+        if tokens_used is not None:
+            self.cursor.execute('''UPDATE "grading_jobs" SET "tokens_used" = ? WHERE "id" = ? RETURNING "tokens"''',
+                                (int(tokens_used), job_id))
+            row = self.cursor.fetchone()
+            if token_budget is not None and row is not None and row["tokens"] is not None:
+                # May go below zero, so that jobs using more than projected hold back the next ones
+                self._refund(token_budget, row["tokens"] - int(tokens_used))
+        if requests_used is not None and budget is not None:
+            self.cursor.execute('''SELECT "requests" FROM "grading_jobs" WHERE "id" = ?''', (job_id,))
+            row = self.cursor.fetchone()
+            if row is not None:
+                self._refund(budget, row["requests"] - int(requests_used))
+
+    def _refund(self, name, amount):
+        self.cursor.execute('''UPDATE "request_budget" SET "requests_left" = "requests_left" + ?
+                               WHERE "name" = ? AND "day" = ?''', (amount, name, str(datetime.date.today())))
+
+    def complete(self, job_id, tokens_used=None, token_budget=None, requests_used=None, budget=None):
+        """
+        Marks a job done. 'tokens_used' are the tokens the ledger recorded for it, settled with 'token_budget',
+        and 'requests_used' the requests it sent, settled with 'budget'.
+        """
+        self.cursor.execute('BEGIN IMMEDIATE')
+        try:
+            self.cursor.execute('''UPDATE "grading_jobs" SET "status" = 'done', "error" = NULL, "updated" = ?
+                                   WHERE "id" = ?''', (time.time(), job_id))
+            self._settle(job_id, tokens_used, token_budget, requests_used, budget)
+            self.cursor.execute('COMMIT')
+        except BaseException:
+            self.cursor.execute('ROLLBACK')
+            raise
+
+    def fail(self, job_id, error, tokens_used=None, token_budget=None, count_attempt=True, requests_used=None, budget=None):
+        """
+        Puts a failed job back for a retry, or marks it failed after its last attempt.
+        A newer pending job of the same student replaces the retry. Tokens and requests are settled as in complete(),
+        so the requests it claimed but did not send go back to the budget. Without 'count_attempt' the job is put
+        back as if it was never claimed, e.g. when it found no request capacity.
+        """
+        now = time.time()
+        self.cursor.execute('BEGIN IMMEDIATE')
+        try:
+            self.cursor.execute('''SELECT "assignment", "student_email", "attempts" FROM "grading_jobs" WHERE "id" = ?''',
+                                (job_id,))
+            job = self.cursor.fetchone()
+            retry = job is not None and (job["attempts"] < self.max_attempts or not count_attempt)
+            if retry:
+                self.cursor.execute('''SELECT 1 FROM "grading_jobs" WHERE "assignment" = ? AND "student_email" = ?
+                                       AND "status" = 'pending' ''', (job["assignment"], job["student_email"]))
+                retry = self.cursor.fetchone() is None
+            self.cursor.execute('''UPDATE "grading_jobs" SET "status" = ?, "error" = ?, "claimed_until" = NULL, "updated" = ?,
+                                   "attempts" = "attempts" - ? WHERE "id" = ?''',
+                                ('pending' if retry else 'failed', error, now, 0 if count_attempt else 1, job_id))
+            self._settle(job_id, tokens_used, token_budget, requests_used, budget)
+            self.cursor.execute('COMMIT')
+        except BaseException:
+            self.cursor.execute('ROLLBACK')
+            raise
+
+    def counts(self):
+        self.cursor.execute('''SELECT "status", COUNT(*) FROM "grading_jobs" GROUP BY "status"''')
+        counts = {status: 0 for status in ('pending', 'running', 'done', 'failed')}
+        counts.update({row[0]: row[1] for row in self.cursor.fetchall()})
+        return counts
+
+    def import_json(self, file_path):
+        """
+        Moves the jobs of the old JSON queue file ({assignment: {email: requests}}) into the table.
+        Returns the number of jobs imported.
+        """
+        if not os.path.exists(file_path):
+            return 0
+        with open(file_path) as file:
+            data = json.load(file)
+        imported = 0
+        for assignment, students in data.items():
+            for student_email, requests in students.items():
+                imported += self.enqueue(assignment, student_email, requests)
+        os.replace(file_path, f'{file_path}.migrated')
+        return imported
+
+    def close_connection(self):
+        self.connection.close()
+
+
+if __name__ == '__main__':
+    queue = JobQueue()
+    print(json.dumps(queue.counts(), indent=4))
+    queue.close_connection()
@@ -49,4 +49,28 @@ CREATE TABLE "grades" (
     PRIMARY KEY ("intern_id", "assignment_id"),
     FOREIGN KEY ("intern_id") REFERENCES "interns"("id"),
     FOREIGN KEY ("assignment_id") REFERENCES "assignments"("id")
+);
+
+CREATE TABLE "question_grades" (
+    "intern_id" INTEGER NOT NULL,
+    "assignment_id" INTEGER NOT NULL,
+    "question_id" TEXT NOT NULL,
+    "solution_hash" TEXT NOT NULL,
+    "grade" REAL NOT NULL,
+    "feedback" TEXT NOT NULL,
+    "graded" REAL NOT NULL,
+    "test_score" REAL,
+    "llm_score" REAL,
+    "model" TEXT,
+    "tokens" INTEGER,
+    "test_seconds" REAL,
+    "grading_seconds" REAL,
+    "time_growth" TEXT,
+    "memory_growth" TEXT,
+    "benchmark_seconds" REAL,
+    "benchmark_memory" INTEGER,
+    "performance_score" REAL,
+    PRIMARY KEY ("intern_id", "assignment_id", "question_id"),
+    FOREIGN KEY ("intern_id") REFERENCES "interns"("id"),
+    FOREIGN KEY ("assignment_id") REFERENCES "assignments"("id")
 );
\ No newline at end of file
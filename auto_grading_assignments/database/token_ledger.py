@@ -0,0 +1,107 @@
+import datetime
+import json
+import pathlib
+import sqlite3
+import sys
+import threading
+import time
+
+
+class TokenLedger:
+    """
+    Daily ledger of the tokens every LLM request of grading and test case generation used, from the
+    usage the API reports with each response. Kept in the job queue database, where the scheduler
+    estimates the tokens of new jobs from it and settles the token budget of finished ones.
+    """
+    def __init__(self, path=pathlib.Path('database', 'jobs.db')):
+        # Shared by the grading threads of the service
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.cursor = self.connection.cursor()
+        self.cursor.execute('PRAGMA journal_mode=WAL')
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS "token_ledger" (
+                                   "id" INTEGER PRIMARY KEY,
+                                   "day" TEXT NOT NULL,
+                                   "time" REAL NOT NULL,
+                                   "source" TEXT NOT NULL,
+                                   "model" TEXT,
+                                   "assignment" TEXT,
+                                   "student_email" TEXT,
+                                   "job_id" INTEGER,
+                                   "claimed" REAL,
+                                   "prompt_tokens" INTEGER NOT NULL,
+                                   "completion_tokens" INTEGER NOT NULL,
+                                   "total_tokens" INTEGER NOT NULL,
+                                   "estimated" INTEGER NOT NULL DEFAULT 0
+                               )''')
+        # Ledgers made before requests were tagged with their grading job and when it was claimed
+        self.cursor.execute('''PRAGMA table_info("token_ledger")''')
+        columns = {row[1] for row in self.cursor.fetchall()}
+        for column, definition in (("job_id", "INTEGER"), ("claimed", "REAL")):
+            if column not in columns:
+                self.cursor.execute(f'''ALTER TABLE "token_ledger" ADD COLUMN "{column}" {definition}''')
+        self.cursor.execute('''DROP INDEX IF EXISTS "idx_token_ledger_job"''')
+        self.cursor.execute('''CREATE INDEX IF NOT EXISTS "idx_token_ledger_job_id" ON "token_ledger" ("job_id")''')
+        self.cursor.execute('''CREATE INDEX IF NOT EXISTS "idx_token_ledger_day" ON "token_ledger" ("day", "source")''')
+
+    def record(self, source, model, response, estimate=0, assignment=None, student_email=None, job_id=None,
+               claimed=None):
+        """
+        Adds the usage of one response, made for the grading job 'job_id' claimed at 'claimed' if given.
+        Responses without a usage report are entered with the estimate.
+        """
+        usage = getattr(response, 'usage', None)
+        total = getattr(usage, 'total_tokens', None)
+        if total is None:
+            prompt, completion, total, estimated = estimate, 0, estimate, 1
+        else:
+            prompt = getattr(usage, 'prompt_tokens', 0) or 0
+            completion = getattr(usage, 'completion_tokens', 0) or 0
+            estimated = 0
+        with self.lock:
+            self.cursor.execute('''INSERT INTO "token_ledger" ("day", "time", "source", "model", "assignment", "student_email", "job_id", "claimed",
+                                                              "prompt_tokens", "completion_tokens", "total_tokens", "estimated")
+                                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                                (str(datetime.date.today()), time.time(), source, model, assignment, student_email, job_id,
+                                 claimed, int(prompt), int(completion), int(total), estimated))
+
+    def job_tokens(self, job_id, claimed):
+        """
+        Tokens the requests of a grading job used since it was claimed at 'claimed', which is what that claim projected.
+        """
+        with self.lock:
+            self.cursor.execute('''SELECT COALESCE(SUM("total_tokens"), 0) FROM "token_ledger"
+                                   WHERE "job_id" = ? AND "claimed" = ?''', (job_id, claimed))
+            return self.cursor.fetchone()[0]
+
+    def job_requests(self, job_id, claimed):
+        """
+        Requests a grading job sent since it was claimed at 'claimed'. Answers from the response cache are not sent.
+        """
+        with self.lock:
+            self.cursor.execute('''SELECT COUNT(*) FROM "token_ledger" WHERE "job_id" = ? AND "claimed" = ?''',
+                                (job_id, claimed))
+            return self.cursor.fetchone()[0]
+
+    def day_totals(self, day=None):
+        """
+        Returns the tokens used on a day (today by default) by source.
+        """
+        with self.lock:
+            self.cursor.execute('''SELECT "source", SUM("prompt_tokens"), SUM("completion_tokens"), SUM("total_tokens"),
+                                          COUNT(*), SUM("estimated")
+                                   FROM "token_ledger" WHERE "day" = ? GROUP BY "source"''',
+                                (day or str(datetime.date.today()),))
+            return {row[0]: {"prompt_tokens": row[1], "completion_tokens": row[2], "total_tokens": row[3],
+                             "requests": row[4], "estimated": row[5]}
+                    for row in self.cursor.fetchall()}
+
+    def close_connection(self):
+        self.connection.close()
+
+
+if __name__ == '__main__':
+    ledger = TokenLedger()
+    print(json.dumps(ledger.day_totals(sys.argv[1] if len(sys.argv) > 1 else None), indent=4))
+    ledger.close_connection()
@@ -1,35 +1,134 @@
 import sys
 import json
 import os
-import pathlib
+import threading
+import time
 from backend.api.chatgpt_api import HomeworkGrader
+from backend.api.api_pool import ApiPool, NoApiKeyAvailable
+from backend.api.prompt_builder import PromptBuilder, PROMPT_TOKEN_BUDGET
+from backend.api.grading_tiers import GradingTiers
+from backend.api.rate_limiter import RateLimitExceeded
 from database.DataBase import Connect_DB
-from backend.api.mail import send_feedback, extract_marks_and_feedback
+from database.token_ledger import TokenLedger
+from backend.api.mail import Mailer, extract_marks_and_feedback, compose_feedback, feedback_subject
 from backend.directory.getinput import GetInputs
-from backend.directory.run_test_cases import concatenate_and_run_tests
+from backend.directory.run_test_cases import SandboxRunner, run_submission_tests
+from backend.directory.benchmark import (has_benchmark, run_benchmark, summarize_benchmark, benchmark_details,
+                                        with_efficiency)
+from backend.directory.differential import has_reference, run_differential, summarize_differential
+from backend.directory.precheck import precheck_submission, precheck_feedback
+from backend.directory.result_cache import ResponseCache
+from backend.directory.clustering import SolutionClusters, SIMILARITY
+from concurrent.futures import ThreadPoolExecutor
 
 from backend.logger_config import setup_logger
 
 # Create a logger for grading
 grading_logger = setup_logger()
-def grade_once(student_email, assignment_folder):
+
+# Grading requests sent at the same time, unless autograder_config.json sets "max_concurrent_requests"
+MAX_CONCURRENT_REQUESTS = 4
+
+# Days a cached grading response is reused for an identical request, unless "response_cache_ttl_days" is set
+RESPONSE_CACHE_TTL_DAYS = 30
+
+# Exit code of a job that found no request capacity in time or no API key with requests left, put back in the queue
+# without counting an attempt
+RATE_LIMITED = 75
+
+class GradingResources:
+    """
+    Configuration, API client, response cache, database connections and SMTP session used for grading,
+    loaded once so that a resident grading service can reuse them for every job. Jobs graded at the
+    same time share the limits on grading requests and sandboxes.
+    """
+    def __init__(self):
+        # Config files
+        with open(os.path.join('Keys', 'autograder_config.json')) as file:
+            config = json.load(file)
+        if config is None:
+            raise ValueError("AutoGrader Not Configured")
+
+        self.max_concurrent_requests = int(config.get('max_concurrent_requests', MAX_CONCURRENT_REQUESTS))
+        self.batch_grading = bool(config.get('batch_grading', False))
+        cache_ttl = float(config.get('response_cache_ttl_days', RESPONSE_CACHE_TTL_DAYS)) * 24 * 3600
+
+        output_tokens = 1200
+        self.response_cache = ResponseCache(ttl=cache_ttl)
+        # Keys of "api_pool", or the one key of the config, with quotas and health shared by every grader
+        self.api_pool = ApiPool.from_config(config, HomeworkGrader.make_client)
+        self.ledger = TokenLedger()
+        # With "grading_tiers", answers are graded by rule or a fast model first and escalated when in doubt
+        self.tiers = GradingTiers.from_config(config.get('grading_tiers'))
+        self.autograder = HomeworkGrader(None, None, None, output_tokens, cache=self.response_cache, pool=self.api_pool,
+                                         ledger=self.ledger, tiers=self.tiers)
+        # Grades of representative solutions, reused for equal or near-identical ones with the same test results
+        self.clusters = None
+        if config.get('cluster_grading', True):
+            self.clusters = SolutionClusters(threshold=float(config.get('cluster_similarity', SIMILARITY)))
+        # Fits every answer with its test results into the prompt token budget
+        self.prompt_builder = PromptBuilder(int(config.get('prompt_token_budget', PROMPT_TOKEN_BUDGET)))
+        self.mailer = Mailer(config['smtp'], config['email'], config['password'])
+        self.request_slots = threading.BoundedSemaphore(self.max_concurrent_requests)
+        self.runner = SandboxRunner()
+        self.sandbox_slots = threading.BoundedSemaphore(self.runner.max_workers)
+        self.local = threading.local()
+
+    @property
+    def db(self):
+        # SQLite connections can only be used by the thread that made them
+        if getattr(self.local, 'db', None) is None:
+            self.local.db = Connect_DB(os.path.join('database', 'data.db'))
+            # Lookups leave their statements open, which in the default journal mode would hold a read
+            # lock and block the grade inserts of other threads. In WAL mode readers never block writers.
+            self.local.db.cursor.execute('PRAGMA journal_mode=WAL')
+        return self.local.db
+
+    def close_thread(self):
+        """
+        Closes the database connection of the calling thread.
+        """
+        if getattr(self.local, 'db', None) is not None:
+            self.local.db.close_connection()
+            self.local.db = None
+
+    def close(self):
+        self.mailer.close()
+        self.response_cache.close_connection()
+        self.api_pool.close_connection()
+        self.ledger.close_connection()
+        if self.tiers is not None:
+            self.tiers.close_connection()
+        if self.clusters is not None:
+            self.clusters.close_connection()
+        self.close_thread()
+
+
+def grade_once(student_email, assignment_folder, resources=None, question_ids=None, job_id=None, claimed=None):
+    """
+    Tests and grades a student's solutions of an assignment, stores the grade and emails the feedback.
+    A resident grader passes its long-lived 'resources', otherwise they are loaded for this one job.
+    With 'question_ids' only those questions are graded again, the others keep their stored grades.
+    'job_id' and 'claimed' are the queued job being graded and when it was claimed, which the tokens of its
+    requests are recorded for.
+    """
     grading_logger.info("Starting grading process")
-    
-    # Config files
+
+    own_resources = resources is None
+    if own_resources:
+        try:
+            resources = GradingResources()
+        except Exception as e:
+            grading_logger.error(f"Failed to load grading configuration: {e}")
+            sys.exit(1)
     try:
-        config_path = os.path.join('Keys', 'autograder_config.json')
-        with open(config_path) as file:
-            config = json.load(file)
-            if config is None:
-                grading_logger.error("AutoGrader not configured")
-                sys.exit("AutoGrader Not Configured")
-            from_email_address = config['email']
-            password = config['password']
-            smtp_address = config['smtp']
-    except Exception as e:
-        grading_logger.error(f"Failed to load email configuration: {e}")
-        sys.exit(1)
+        _grade(student_email, assignment_folder, resources, question_ids, job_id, claimed)
+    finally:
+        if own_resources:
+            resources.close()
+
 
+def _grade(student_email, assignment_folder, resources, question_ids=None, job_id=None, claimed=None):
     # Assignment Directory
     try:
         assignment_directory = os.path.join('Input', assignment_folder)
@@ -47,11 +146,9 @@ def grade_once(student_email, assignment_folder):
         grading_logger.error(f"Failed to load assignment configuration: {e}")
         sys.exit(1)
 
-    # Connect with database
+    # Query the database
+    db = resources.db
     try:
-        db_path = os.path.join('database', 'data.db')
-        db = Connect_DB(db_path)
-
         assignment_id = db.get_assignment_id(assignment_topic=assignment_topic, subject_name=subject_name, batch_number=batch_number)
         student_id = db.get_intern_id(email=student_email)
     except Exception as e:
@@ -71,75 +168,291 @@ def grade_once(student_email, assignment_folder):
         grading_logger.error(f"Error getting solutions: {e}")
         sys.exit(1)
 
-    # Grading
+    # Questions whose solutions did not change since they were graded keep their stored grade and feedback
+    kept = {}
+    if question_ids is not None:
+        try:
+            stored = db.get_question_grades(student_id, assignment_id)
+        except Exception as e:
+            grading_logger.error(f"Failed to load the stored grades of questions: {e}")
+            stored = {}
+        kept = {question_id: stored[question_id] for question_id in questions
+                if question_id in stored and question_id not in question_ids}
+    to_grade = [question_id for question_id in questions if question_id not in kept]
+    if kept:
+        grading_logger.info(f"Grading questions {to_grade}, keeping the grades of unchanged questions {list(kept)}")
+
+    autograder = resources.autograder
+    batch_grading = resources.batch_grading
+
+    # Solutions that do not compile or can not run are answered right away, without tests or LLM requests
     try:
-        with open(pathlib.Path('Keys', 'key.txt')) as file:
-            token = file.readline().strip()
-        with open(pathlib.Path('Keys', 'autograder_config.json')) as file:
-            config = json.load(file)
-        endpoint = config['endpoint']
-        model_name = config['model_name']
+        prechecks = precheck_submission(intern_id=student_id, assignment=assignment_folder, question_ids=to_grade)
     except Exception as e:
-        grading_logger.error(f"Failed to load grading API configuration: {e}")
-        sys.exit(1)
+        grading_logger.error(f"Error prechecking solutions: {e}")
+        prechecks = {}
+    failed_prechecks = [question_id for question_id in to_grade if prechecks.get(question_id)]
+    if failed_prechecks:
+        grading_logger.info(f"Skipping tests and grading requests for questions {failed_prechecks} that failed the precheck")
+
+    # Every question is tested and graded in its own thread, so the test runs of one question overlap
+    # the grading requests of others. Sandboxes are limited to the CPUs and requests to the configured
+    # limit, over all the jobs sharing these resources.
+    runner = resources.runner
+    sandbox_slots = resources.sandbox_slots
+    request_slots = resources.request_slots
+    prompt_builder = resources.prompt_builder
+    # The tokens of this job's requests, for the scheduler to settle its token budget
+    tags = {"assignment": assignment_folder, "student_email": student_email, "job_id": job_id, "claimed": claimed}
+    # Questions whose tests could not run, so their test score tells nothing about the answer
+    untested = set()
+    # What the grade of each tested question depends on besides the solution, for reusing grades of its cluster
+    contexts = {}
+    clusters = resources.clusters
+    # Requests that found no capacity in time, which stop the job
+    rate_limited = []
+    # Test score, LLM score, model, tokens and timings of every graded question, stored with its grade
+    details = {question_id: {} for question_id in to_grade}
+    # Performance scores of the benchmarked questions, which replace the LLM's Efficiency score
+    performance = {}
+
+    def test_question(question_id):
+        """
+        Tests one question. Returns its feedback so far, the answer with the test results for grading and the test score.
+        """
+        question = questions[question_id]
+        solution = solutions.get(question_id, '')
+
+        feedback = f'\nFEEDBACK FOR QUESTION:\n{question}\n'
+
+        # Run the test cases in a sandboxed process
+        with sandbox_slots:
+            start = time.perf_counter()
+            try:
+                test_result = run_submission_tests(intern_id=student_id, assignment=assignment_folder,
+                                                   question_ids=[question_id], runner=runner)[question_id]
+            except Exception as e:
+                grading_logger.error(f"Error running test cases of question {question_id}: {e}")
+                test_result = {"score": 0, "not_passed": [], "status": "no_tests", "cases": []}
+            # Missing or broken test cases say nothing about the answer, unlike errors of the solution itself
+            if test_result.get('status') == 'no_tests':
+                grading_logger.warning(f"No test cases of question {question_id} ran: {test_result.get('error')}")
+                untested.add(question_id)
+
+            # Measure the running time and memory of solutions that pass their tests, for the Efficiency criterion,
+            # and compare solutions with the teacher's reference solution on random inputs
+            benchmark = None
+            if has_benchmark(assignment_folder, question_id) and test_result.get('status') == 'ok':
+                try:
+                    benchmark = run_benchmark(student_id, assignment_folder, question_id)
+                except Exception as e:
+                    grading_logger.error(f"Error benchmarking question {question_id}: {e}")
+            differential = None
+            if has_reference(assignment_folder, question_id) and question_id in solutions:
+                try:
+                    differential = run_differential(student_id, assignment_folder, question_id)
+                except Exception as e:
+                    grading_logger.error(f"Error comparing question {question_id} with the reference solution: {e}")
+            test_seconds = time.perf_counter() - start
+
+        test_score, not_passed = test_result['score'], test_result['not_passed']
+        if differential is not None:
+            # Randomized tests against the reference solution count as much as the written test cases
+            test_score = (test_score + differential['score']) / 2
+        details[question_id].update(test_score=test_score, test_seconds=round(test_seconds, 3))
+        if benchmark is not None:
+            details[question_id].update(benchmark_details(benchmark))
+            if benchmark['score'] is not None and test_score > 0:
+                performance[question_id] = benchmark['score']
+        if question_id not in untested:
+            contexts[question_id] = SolutionClusters.context(question, question_score, test_score, not_passed,
+                                                             question_id in performance)
+        print(test_score, not_passed)
+        if not_passed:
+            report = f'Test Score:{test_score}'
+        else:
+            report = f"ALL TEST CASES PASSED FOR THE GIVEN QUESTION\n\n TEST SCORE: {test_score}"
+        if differential is not None:
+            report += f"\n\n{summarize_differential(differential)}"
+        if benchmark is not None:
+            report += f"\n\n{summarize_benchmark(benchmark)}"
+            if question_id in performance:
+                report += ("\nEfficiency is scored from these measurements. Leave it out of the score: score the answer on "
+                           "the other criteria only, scaled to the full score.")
+            else:
+                report += "\nUse these measurements for the Efficiency criterion instead of estimating it from the code."
+            grading_logger.info(f"Benchmark for question {question_id}: {benchmark}")
+
+        # The student gets every test result, the grading request an answer fitted to the token budget
+        feedback += f"ANSWER:\n\n{PromptBuilder.render(solution, report, not_passed)}\n\n"
+        answer = prompt_builder.answer(solution, report, not_passed)
+        return feedback, answer, test_score
+
+    def prechecked_question(question_id, question_score):
+        feedback = f'\nFEEDBACK FOR QUESTION:\n{questions[question_id]}\n'
+        feedback += (f"ANSWER:\n\n{solutions.get(question_id, '')}\n\n"
+                     f"{precheck_feedback(prechecks[question_id], question_score)}")
+        grading_logger.info(f"Graded question {question_id}: score 0, failed the precheck")
+        return 0, feedback
+
+    def reused_grade(question_id):
+        """
+        Returns the (marks, feedback) of a graded solution in the cluster of a student's solution, or None.
+        """
+        if clusters is None or question_id not in contexts:
+            return None
+        reused = clusters.find(contexts[question_id], solutions.get(question_id, ''))
+        if reused is not None:
+            grading_logger.info(f"Reusing the grade of a similar solution for question {question_id}")
+        return reused
 
-    output_tokens = 1200
-    autograder = HomeworkGrader(token, endpoint, model_name, output_tokens)
+    def remember_grade(question_id, marks, feedback):
+        if clusters is not None and question_id in contexts:
+            clusters.add(assignment_folder, question_id, contexts[question_id], solutions.get(question_id, ''),
+                         marks, feedback)
+
+    def request_grade(question_id, solution, question_score, test_score=None, escalate=False):
+        reused = reused_grade(question_id)
+        if reused is not None:
+            details[question_id].update(llm_score=reused[0], model=None, tokens=0, grading_seconds=0)
+            return reused
+        with request_slots:
+            autograder.usage()
+            start = time.perf_counter()
+            response = autograder.grade_answer(questions[question_id], solution, question_score, tags,
+                                               None if question_id in untested else test_score, escalate)
+            usage = autograder.usage()
+            details[question_id].update(model=usage["model"], tokens=usage["tokens"],
+                                        grading_seconds=round(time.perf_counter() - start, 3))
+        result = extract_marks_and_feedback(response)
+        details[question_id]["llm_score"] = int(result[0])
+        remember_grade(question_id, int(result[0]), result[1])
+        return int(result[0]), result[1]
+
+    def combine(question_id, feedback, test_score, marks, llm_feedback):
+        if question_id in performance:
+            marks = with_efficiency(marks, performance[question_id], question_score)
+        grade = (marks + int(test_score)) / 2
+        grading_logger.info(f"Graded question {question_id}: score {grade}")
+        return grade, feedback + llm_feedback
+
+    def grade_tested(question_id, feedback, solution, test_score, question_score, escalate=False):
+        return combine(question_id, feedback, test_score,
+                       *request_grade(question_id, solution, question_score, test_score, escalate))
+
+    def grade_question(question_id, question_score):
+        """
+        Tests and grades one question. Returns its grade and feedback.
+        """
+        if question_id in failed_prechecks:
+            return prechecked_question(question_id, question_score)
+        feedback, solution, test_score = test_question(question_id)
+        return grade_tested(question_id, feedback, solution, test_score, question_score)
 
     grades = 0
-    feedback_final = ''
     per_score = 0
+    question_score = 100
+    results = {question_id: (row["grade"], row["feedback"]) for question_id, row in kept.items()}
+
+    with ThreadPoolExecutor(max_workers=max(len(questions), 1)) as executor:
+        if not batch_grading:
+            futures = {question_id: executor.submit(grade_question, question_id, question_score)
+                       for question_id in to_grade}
+        else:
+            # Test every question, then grade all of them in one request and only the ones
+            # missing from its response one by one
+            futures = {question_id: executor.submit(prechecked_question, question_id, question_score)
+                       for question_id in failed_prechecks}
+            tested = {question_id: executor.submit(test_question, question_id)
+                      for question_id in to_grade if question_id not in failed_prechecks}
+            prepared = {}
+            for question_id, future in tested.items():
+                try:
+                    prepared[question_id] = future.result()
+                except Exception as e:
+                    grading_logger.error(f"Error testing question {question_id}: {e}")
+
+            batch = {}
+            for question_id in prepared:
+                reused = reused_grade(question_id)
+                if reused is not None:
+                    batch[question_id] = reused
+                    details[question_id].update(llm_score=reused[0], model=None, tokens=0, grading_seconds=0)
+            unreused = [question_id for question_id in prepared if question_id not in batch]
+            if unreused:
+                autograder.usage()
+                start = time.perf_counter()
+                try:
+                    graded = autograder.grade_answers([(question_id, questions[question_id], prepared[question_id][1])
+                                                       for question_id in unreused], question_score, tags,
+                                                      {question_id: prepared[question_id][2] for question_id in unreused
+                                                       if question_id not in untested})
+                except (RateLimitExceeded, NoApiKeyAvailable) as e:
+                    rate_limited.append(e)
+                    graded = {}
+                except Exception as e:
+                    grading_logger.error(f"Batched grading request failed: {e}")
+                    graded = {}
+                # The tokens and time of the batch request are shared evenly by the questions it graded
+                usage = autograder.usage()
+                seconds = round((time.perf_counter() - start) / max(len(graded), 1), 3)
+                for question_id, (marks, llm_feedback) in graded.items():
+                    remember_grade(question_id, marks, llm_feedback)
+                    details[question_id].update(llm_score=marks, model=usage["model"],
+                                                tokens=usage["tokens"] // len(graded), grading_seconds=seconds)
+                batch.update(graded)
+            for question_id, (feedback, solution, test_score) in prepared.items():
+                if question_id in batch:
+                    results[question_id] = combine(question_id, feedback, test_score, *batch[question_id])
+                elif not rate_limited:
+                    grading_logger.info(f"Grading question {question_id} in its own request")
+                    # A batch already graded by the fast tier leaves the rest to the full model
+                    futures[question_id] = executor.submit(grade_tested, question_id, feedback, solution,
+                                                           test_score, question_score, True)
+
+        for question_id, future in futures.items():
+            try:
+                results[question_id] = future.result()
+            except (RateLimitExceeded, NoApiKeyAvailable) as e:
+                rate_limited.append(e)
+            except Exception as e:
+                grading_logger.error(f"Error grading question {question_id}: {e}")
 
+    if rate_limited:
+        # Nothing is stored or sent, the job is graded again once there is capacity
+        grading_logger.error(f"Grading stopped, no request capacity: {rate_limited[0]}")
+        sys.exit(RATE_LIMITED)
+
+    # Assemble the results in question order
     for question_id in questions:
-        question_score = 100
         per_score += question_score
-        question = questions[question_id]
-        solution = solutions[question_id]
-        
-        feedback = f'\nFEEDBACK FOR QUESTION:\n{question}\n'
-        
-        try:
-            test_score, not_passed = concatenate_and_run_tests(solution_file=question_id, intern_id=student_id, assignment=assignment_folder, test_case_folder='Test Cases')
-            print(test_score, not_passed)
-            if not_passed:
-                solution += f'\n\n Test Score:{test_score}\n\n'
-                for tc in not_passed:
-                    solution += tc
-            else:
-                solution += f"\n\nALL TEST CASES PASSED FOR THE GIVEN QUESTION\n\n TEST SCORE: {test_score}\n\n"
-
-            feedback += f"ANSWER:\n\n{solution}"
-            response = autograder.grade_answer(question, solution, question_score)
-            result = extract_marks_and_feedback(response)
-            grade = (int(result[0]) + int(test_score)) / 2
-            
-            feedback += result[1]
-            grades += grade
-
-            feedback_final += feedback + '\n- - - - - - - - - - - - - - - - - - - - - - - - - - - - - -\n'
-            grading_logger.info(f"Graded question {question_id}: score {grade}")
-        except Exception as e:
-            grading_logger.error(f"Error grading question {question_id}: {e}")
+        if question_id in results:
+            grades += results[question_id][0]
+    feedback_final = compose_feedback(results[question_id][1] for question_id in questions if question_id in results)
+    grading_logger.info(f"Grading response cache: {resources.response_cache.stats()}")
 
     # Storing Grades in Database
     try:
         factor = total_score / per_score
         grades *= factor
-        db.insert_into_grades(grades, intern_id=student_id, assignment_id=assignment_id)
+        # The assignment grade and every graded question in one transaction. With the solution each grade
+        # is for, so an unchanged resubmission is not graded again, and the feedback can be resent from them
+        db.save_grades(student_id, assignment_id, grades,
+                       [{"question_id": question_id, "grade": results[question_id][0], "feedback": results[question_id][1],
+                         "solution_hash": GetInputs.solution_hash(solutions.get(question_id, '')), **details[question_id]}
+                        for question_id in to_grade if question_id in results])
         grading_logger.info(f"Stored grade: {grades} for student ID {student_id}")
     except Exception as e:
         grading_logger.error(f"Failed to store grades in the database: {e}")
-    finally:
-        db.close_connection()
 
     # Send Feedback
     try:
-        subject = f'Assessment Feedback For Assignment {assignment_topic}.'
-        send_feedback(smtp_address=smtp_address, to_email=student_email, subject=subject, feedback_message=feedback_final,
-                      from_email=from_email_address, from_password=password)
+        resources.mailer.send_feedback(to_email=student_email, subject=feedback_subject(assignment_topic),
+                                       feedback_message=feedback_final)
         grading_logger.info(f"Feedback sent to {student_email}")
     except Exception as e:
-        grading_logger.error(f"Failed to send feedback: {e}")
+        grading_logger.error(f"Failed to send feedback: {e}. "
+                             f"Resend it with: python resend_feedback.py {assignment_folder} {student_email}")
 
 if __name__ == "__main__":
     if len(sys.argv) < 3:
@@ -1,38 +1,65 @@
 import sys
 import json
 import datetime
-import heapq
 import pathlib
 import os
+import socket
+import threading
 
 from backend.logger_config import setup_logger
+from backend.api.api_pool import ApiPool
+from backend.directory.worker_pool import WarmWorkerPool
+from database.job_queue import JobQueue, LANE_REGRADE, LANE_SUBMISSION
+from database.token_ledger import TokenLedger
+from database.DataBase import Connect_DB
+from backend.directory.getinput import GetInputs
+from grade_once import grade_once, RATE_LIMITED
 
 # Create a logger for grading
 grading_logger = setup_logger()
 
+# Jobs graded at the same time, unless autograder_config.json sets "grading_workers"
+GRADING_WORKERS = 1
+
+# Tokens projected for a request of an assignment until the ledger has finished jobs of it
+DEFAULT_TOKENS_PER_REQUEST = 3000
+
 class GradeScheduler:
     """
     Schedules Requests for Grading Assignments as per request limits and requests left for API
     """
-    def __init__(self, file_path=pathlib.Path('Keys', 'grading_schedules.json')):
+    def __init__(self, file_path=pathlib.Path('Keys', 'grading_schedules.json'), autostart=True, grade=None, queue=None,
+                 workers=None):
         grading_logger.info('Initializing GradeScheduler.')
-        grading_logger.info('Loading grading request queue from json.')
 
-        if not os.path.exists(file_path):
-            grading_logger.info(f"{file_path} not found. Creating a new file.")
-            with open(file_path, 'w') as file:
-                json.dump({}, file)
+        self.queue = queue or JobQueue()
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
 
+        # Jobs queued by older versions in a JSON file
         try:
-            with open(file_path) as file:
-                self.data = json.load(file)
-        except json.JSONDecodeError as e:
-            grading_logger.error(f"Error decoding JSON from {file_path}: {e}")
-            self.data = {}
+            imported = self.queue.import_json(file_path)
+            if imported:
+                grading_logger.info(f"Moved {imported} grading requests from {file_path} to the job queue.")
+        except (OSError, json.JSONDecodeError) as e:
+            grading_logger.error(f"Error importing grading requests from {file_path}: {e}")
 
-        self.priority_queue = []
-        self.make_priority_queue()
+        self.load_requests_left()
+        self.workers = workers or self.grading_workers
+
+        # A resident grading service passes its own in-process 'grade' function, otherwise
+        # every job runs grade_once in a child forked from a warm worker pool
+        self.grade = grade
+        self.pool = WarmWorkerPool(max_workers=self.workers) if grade is None else None
+
+        if autostart:
+            self.start()
 
+    def load_requests_left(self):
+        """
+        Reads the daily request limit and returns the requests left for today, which are shared by
+        every worker through the job queue database and reset to the limit on a new day. The limit is
+        the sum of the limits of the API keys in rotation, so it shrinks while a key is taken out.
+        """
         try:
             with open(pathlib.Path('Keys', 'autograder_config.json')) as file:
                 config = json.load(file)
@@ -43,92 +70,213 @@ class GradeScheduler:
             grading_logger.error(f"Error decoding JSON from autograder_config.json: {e}")
             exit()
 
-        if config['last_used'] != str(datetime.datetime.now().date()):
-            config['requests_left'] = config['requests_limit']
-            config['last_used'] = str(datetime.datetime.now().date())
-            with open(pathlib.Path('Keys', 'autograder_config.json'), 'w') as config_file:
-                json.dump(config, config_file, indent=4)
-        
-        self.requests_left = config['requests_left']
+        pool = ApiPool.from_config(config)
+        try:
+            requests_limit = pool.requests_limit()
+            # Test case generation and other requests outside the queue take from the same quotas
+            available = pool.requests_left()
+        finally:
+            pool.close_connection()
+        # The config file seeds the shared budget the first time
+        seed = config.get('requests_left') if config.get('last_used') == str(datetime.datetime.now().date()) else None
+        self.requests_left = self.queue.set_budget(requests_limit, seed, available=available)
+        # With "tokens_limit" jobs are also admitted by their projected tokens against a daily token budget
+        self.token_budget = 'grading_tokens' if config.get('tokens_limit') else None
+        if self.token_budget is not None:
+            tokens_left = self.queue.set_budget(int(config['tokens_limit']), name=self.token_budget)
+            grading_logger.info(f"Tokens left initialized to {tokens_left}.")
+        self.batch_grading = bool(config.get('batch_grading', False))
+        self.grading_workers = max(1, int(config.get('grading_workers', GRADING_WORKERS)))
         grading_logger.info(f"Requests left initialized to {self.requests_left}.")
-
-        self.start()
-
-    def make_priority_queue(self):
-        for assignment_folder, students in self.data.items():
-            for student_email, question_numbers in students.items():
-                heapq.heappush(self.priority_queue, (int(question_numbers), assignment_folder, student_email))
-        grading_logger.debug(f"Priority queue created with {len(self.priority_queue)} items.")
+        return self.requests_left
 
     def start(self):
-        done = []  # tuples ("Assignment_Folder", "Student_email")
         grading_logger.info("Starting grading process.")
-        
-        while self.priority_queue:
-            req = self.pop_min_request()
-            if req is None:  # Check if there's an issue with the request
-                grading_logger.warning("No valid request to process.")
-                break
-            
-            if req[0] > self.requests_left:
-                self.add_to_queue(assignment_folder=req[1], student_email=req[2])
-                grading_logger.warning(f"Grading stopped due to insufficient requests left: {self.requests_left}.")
-                break
-            else:
-                self.requests_left -= int(req[0])
-                grading_logger.info(f"Grading {req[1]} for {req[2]} with {req[0]} requests.")
-                os.system(f'python grade_once.py {req[1]} {req[2]}')
-                done.append((req[1], req[2]))
-
-        self.stop(done)
-
-    def add_to_queue(self, student_email, assignment_folder):
-        question_numbers = self.how_many_requests_for(assignment_folder)
-        if assignment_folder in self.data:
-            if student_email in self.data[assignment_folder]:
-                grading_logger.debug(f"Resuming grading for {assignment_folder} {student_email}.")
-                self.start()
-            else:
-                self.data[assignment_folder][student_email] = question_numbers
-                heapq.heappush(self.priority_queue, (question_numbers, assignment_folder, student_email))
-                grading_logger.debug(f"Added to queue: {assignment_folder} {student_email}.")
-                self.start()
+        if self.grade is not None:
+            # A resident scheduler may run past midnight
+            self.load_requests_left()
+
+        if self.workers == 1:
+            self.drain(self.queue)
         else:
-            self.data[assignment_folder] = {student_email: question_numbers}
-            heapq.heappush(self.priority_queue, (question_numbers, assignment_folder, student_email))
-            grading_logger.debug(f"New Assignment task added to queue: {assignment_folder} {student_email}.")
-            self.start()
+            threads = [threading.Thread(target=self.drain, name=f'grading-worker-{i}') for i in range(self.workers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.stop()
+
+    def drain(self, queue=None):
+        """
+        Claims and grades jobs until none is left that the requests and tokens left cover.
+        """
+        # SQLite connections can only be used by the thread that made them
+        own_queue = queue is None
+        queue = queue or JobQueue()
+        ledger = TokenLedger()
+        worker = f"{self.worker}:{threading.current_thread().name}"
+        try:
+            while True:
+                job = queue.claim(worker, budget='grading', token_budget=self.token_budget)
+                if job is None:
+                    if queue.counts()['pending']:
+                        tokens_left = f", tokens left: {queue.requests_left(self.token_budget)}" if self.token_budget else ""
+                        grading_logger.warning(f"Grading stopped due to insufficient requests left: "
+                                               f"{queue.requests_left()}{tokens_left}.")
+                    break
+
+                grading_logger.info(f"Grading {job['assignment']} for {job['student_email']} with {job['requests']} requests "
+                                    f"(attempt {job['attempts']}).")
+                try:
+                    # Only the questions whose solutions changed, or all of them when 'questions' is None
+                    if self.grade is not None:
+                        exitcode = self.grade(job['student_email'], job['assignment'], job['questions'], job['id'],
+                                              job['updated'])
+                    else:
+                        self.pool.warm(job['assignment'])
+                        exitcode = self.pool.run(grade_once, job['student_email'], job['assignment'], None, job['questions'],
+                                                 job['id'], job['updated'])
+                except Exception as e:
+                    grading_logger.error(f"Grading {job['assignment']} for {job['student_email']} failed: {e}")
+                    exitcode = 1
+                # 'updated' is when the job was claimed, which tells this claim's requests from earlier attempts'.
+                # Fast tier, escalated and cached requests make the requests sent differ from the ones claimed
+                tokens_used = ledger.job_tokens(job['id'], job['updated'])
+                requests_used = ledger.job_requests(job['id'], job['updated'])
+                grading_logger.info(f"Grading {job['assignment']} for {job['student_email']} used {tokens_used} tokens "
+                                    f"(projected {job['tokens']}).")
+                if exitcode == 0:
+                    queue.complete(job['id'], tokens_used, self.token_budget, requests_used, 'grading')
+                elif exitcode == RATE_LIMITED:
+                    # Claiming more jobs would only wait for the same limits again
+                    grading_logger.warning(f"Grading {job['assignment']} for {job['student_email']} found no request "
+                                           f"capacity, putting it back in the queue.")
+                    queue.fail(job['id'], "rate limited", tokens_used, self.token_budget, count_attempt=False,
+                               requests_used=requests_used, budget='grading')
+                    break
+                else:
+                    grading_logger.error(f"Grading {job['assignment']} for {job['student_email']} exited with code {exitcode}.")
+                    queue.fail(job['id'], f"exit code {exitcode}", tokens_used, self.token_budget,
+                               requests_used=requests_used, budget='grading')
+        finally:
+            ledger.close_connection()
+            if own_queue:
+                queue.close_connection()
 
-    def stop(self, done):
+    def add_to_queue(self, student_email, assignment_folder, regrade=False):
+        if self.enqueue_job(self.queue, assignment_folder, student_email, regrade, self.batch_grading):
+            grading_logger.debug(f"Added to queue: {assignment_folder} {student_email}.")
+        else:
+            grading_logger.debug(f"Not added to queue: {assignment_folder} {student_email}.")
+        self.start()
+
+    def stop(self):
         grading_logger.info("Stopping Grader!!")
-        for assignment_folder, student_email in done:
-            del self.data[assignment_folder][student_email]
-        with open(pathlib.Path('Keys', 'grading_schedules.json'), "w") as file:
-            json.dump(self.data, file, indent=4)
+        self.requests_left = self.queue.requests_left()
+        # Keep the config file showing the shared budget
         with open(pathlib.Path('Keys', 'autograder_config.json')) as file:
             config = json.load(file)
             config['requests_left'] = self.requests_left
+            config['last_used'] = str(datetime.datetime.now().date())
             with open(pathlib.Path('Keys', 'autograder_config.json'), "w") as file:
                 json.dump(config, file, indent=4)
-        grading_logger.info(f"Grading stopped! Assignments remaining in queue: {len(self.priority_queue)}.")
-
-    def pop_min_request(self):
-        if self.priority_queue:
-            return heapq.heappop(self.priority_queue)
-        else:
-            grading_logger.error("Attempted to pop from an empty priority queue.")
-            return None
+        grading_logger.info(f"Grading stopped! Assignments remaining in queue: {self.queue.counts()['pending']}.")
 
     @staticmethod
-    def how_many_requests_for(folder):
+    def how_many_requests_for(folder, batch_grading=False, questions=None):
         with open(pathlib.Path('Input', folder, 'config.json')) as file:
-            requests = int(json.load(file)['n'])
+            requests = int(json.load(file)['n']) if questions is None else len(questions)
+            if batch_grading:
+                # All questions of a student are graded in one request
+                requests = min(requests, 1)
             grading_logger.debug(f"Requests needed for {folder}: {requests}")
             return requests
 
+    @staticmethod
+    def changed_questions(folder, student_email):
+        """
+        Returns the questions of a student's assignment whose solutions changed since they were last graded,
+        or None to grade all of them when none was graded before.
+        """
+        try:
+            with open(pathlib.Path('Input', folder, 'config.json')) as file:
+                config = json.load(file)
+            db = Connect_DB(pathlib.Path('database', 'data.db'))
+            try:
+                intern_id = db.get_intern_id(email=student_email)
+                assignment_id = db.get_assignment_id(config['assignment_topic'], config['subject_name'], config['batch_number'])
+                stored = db.get_question_grades(intern_id, assignment_id)
+            finally:
+                db.close_connection()
+            if not stored:
+                return None
+            hashes = GetInputs.solution_hashes(pathlib.Path('Input', folder), intern_id)
+        except Exception as e:
+            grading_logger.warning(f"Could not compare the solutions of {folder} for {student_email} with their last grading, "
+                                   f"grading all of them: {e}")
+            return None
+        return sorted(question_id for question_id, solution_hash in hashes.items()
+                      if stored.get(question_id, {}).get("solution_hash") != solution_hash)
+
+    @staticmethod
+    def enqueue_job(queue, folder, student_email, regrade=False, batch_grading=False):
+        """
+        Queues the questions of a student's assignment whose solutions changed since they were graded, or all
+        of them for a regrade. Returns False if none changed or the job was merged into the pending one.
+        """
+        questions = None if regrade else GradeScheduler.changed_questions(folder, student_email)
+        if questions == []:
+            grading_logger.info(f"No solution of {folder} for {student_email} changed since it was graded.")
+            return False
+
+        def cost(questions):
+            requests = GradeScheduler.how_many_requests_for(folder, batch_grading, questions)
+            return requests, GradeScheduler.projected_tokens(queue, folder, requests)
+
+        requests, tokens = cost(questions)
+        return queue.enqueue(folder, student_email, requests, deadline=GradeScheduler.deadline_of(folder),
+                             lane=LANE_REGRADE if regrade else LANE_SUBMISSION, tokens=tokens,
+                             questions=questions, cost=cost)
+
+    @staticmethod
+    def projected_tokens(queue, folder, requests):
+        """
+        Projects the tokens of a job from the tokens per request the assignment's recent jobs used.
+        """
+        per_request = queue.tokens_per_request(folder) or DEFAULT_TOKENS_PER_REQUEST
+        return round(per_request * requests)
+
+    @staticmethod
+    def deadline_of(folder):
+        """
+        Returns the 'deadline_date' of an assignment as an ISO date, or None if it has none.
+        """
+        with open(pathlib.Path('Input', folder, 'config.json')) as file:
+            deadline = json.load(file).get('deadline_date')
+        try:
+            return str(datetime.date.fromisoformat(deadline)) if deadline else None
+        except (TypeError, ValueError):
+            grading_logger.warning(f"Ignoring invalid deadline_date of {folder}: {deadline}")
+            return None
+
+def queue_grading(assignment_folder, student_email, regrade=False):
+    """
+    Adds a grading job for the changed solutions to the shared queue without grading it. Returns False if
+    none changed or it was merged into the pending job. Regrades requested by a teacher grade every question
+    and are claimed before every student submission.
+    """
+    with open(pathlib.Path('Keys', 'autograder_config.json')) as file:
+        batch_grading = bool(json.load(file).get('batch_grading', False))
+    queue = JobQueue()
+    try:
+        return GradeScheduler.enqueue_job(queue, assignment_folder, student_email, regrade, batch_grading)
+    finally:
+        queue.close_connection()
+
 if __name__ == '__main__':
-    if len(sys.argv) == 3:
+    if len(sys.argv) == 3 or (len(sys.argv) == 4 and sys.argv[3] == 'regrade'):
         scheduler = GradeScheduler()
-        scheduler.add_to_queue(assignment_folder=sys.argv[1], student_email=sys.argv[2])
+        scheduler.add_to_queue(assignment_folder=sys.argv[1], student_email=sys.argv[2], regrade=len(sys.argv) == 4)
     else:
-        grading_logger.error("Invalid arguments. Usage: python grade_scheduler.py <assignment_folder> <student_email>")
\ No newline at end of file
+        grading_logger.error("Invalid arguments. Usage: python grade_scheduler.py <assignment_folder> <student_email> [regrade]")
\ No newline at end of file
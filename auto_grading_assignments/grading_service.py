@@ -0,0 +1,105 @@
+import queue
+import sys
+import threading
+
+from backend.logger_config import setup_logger
+from backend.directory.run_test_cases import load_test_cases
+from grade_once import GradingResources, grade_once
+from grade_scheduler import GradeScheduler, queue_grading
+
+# Create a logger for grading
+grading_logger = setup_logger()
+
+
+class GradingService:
+    """
+    Resident grader. Loads the configuration, API client, database connections and SMTP session once,
+    and grades queued jobs with GradeScheduler's workers within the shared request budget.
+    """
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.resources = None
+        self.scheduler = None
+        self.thread = threading.Thread(target=self.serve, name='grading-service', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def enqueue(self, assignment_folder, student_email, regrade=False):
+        # Stored in the job queue right away, so workers that are already grading pick it up too
+        queue_grading(assignment_folder, student_email, regrade)
+        self.jobs.put(True)
+        grading_logger.info(f"Queued {'regrade' if regrade else 'grading'} of {assignment_folder} for {student_email}.")
+
+    def stop(self):
+        """
+        Grades the jobs queued so far and stops the service.
+        """
+        self.jobs.put(None)
+        self.thread.join()
+
+    def serve(self):
+        # Created in the service thread, which owns its SQLite connections
+        self.resources = GradingResources()
+        self.scheduler = GradeScheduler(autostart=False, grade=self.grade)
+        grading_logger.info("Grading service started.")
+        try:
+            # Jobs left in the queue by earlier runs
+            self.scheduler.start()
+            stopping = False
+            while not stopping:
+                # Wake up for new jobs and grade everything queued since
+                stopping = self.jobs.get() is None
+                while not self.jobs.empty():
+                    stopping = self.jobs.get() is None or stopping
+                try:
+                    self.scheduler.start()
+                except Exception as e:
+                    grading_logger.error(f"Grading service failed: {e}")
+        finally:
+            self.resources.close()
+            grading_logger.info("Grading service stopped.")
+
+    def grade(self, student_email, assignment_folder, question_ids=None, job_id=None, claimed=None):
+        """
+        Grades one job in this process, on one of the scheduler's worker threads. Returns an exit code
+        like a grading subprocess would.
+        """
+        try:
+            # Compiled test cases stay cached in the service between jobs
+            load_test_cases(assignment_folder)
+            grade_once(student_email, assignment_folder, resources=self.resources, question_ids=question_ids,
+                       job_id=job_id, claimed=claimed)
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            grading_logger.error(f"Grading {assignment_folder} for {student_email} failed: {e}")
+            return 1
+        return 0
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service():
+    """
+    Returns the grading service of this process, starting it on first use.
+    """
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = GradingService().start()
+        return _service
+
+
+if __name__ == '__main__':
+    if len(sys.argv) % 2 == 0:
+        grading_logger.error("Invalid arguments. Usage: python grading_service.py [<assignment_folder> <student_email> ...]")
+        sys.exit("Invalid arguments. Usage: python grading_service.py [<assignment_folder> <student_email> ...]")
+
+    service = GradingService().start()
+    for assignment_folder, student_email in zip(sys.argv[1::2], sys.argv[2::2]):
+        service.enqueue(assignment_folder, student_email)
+    service.stop()
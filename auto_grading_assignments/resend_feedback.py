@@ -0,0 +1,84 @@
+import json
+import os
+import sys
+
+from backend.api.mail import Mailer, compose_feedback, feedback_subject
+from backend.directory.getinput import GetInputs
+from database.DataBase import Connect_DB
+from backend.logger_config import setup_logger
+
+# Create a logger for grading
+grading_logger = setup_logger()
+
+
+def stored_feedback(assignment_folder, student_email):
+    """
+    Rebuilds a student's feedback email for an assignment from the stored grades of its questions,
+    without testing or grading anything again. Returns the subject and message, or None if nothing is stored.
+    """
+    assignment_directory = os.path.join('Input', assignment_folder)
+    with open(os.path.join(assignment_directory, 'config.json')) as file:
+        config = json.load(file)
+
+    db = Connect_DB(os.path.join('database', 'data.db'))
+    try:
+        assignment_id = db.get_assignment_id(assignment_topic=config['assignment_topic'],
+                                             subject_name=config['subject_name'],
+                                             batch_number=int(config['batch_number']))
+        student_id = db.get_intern_id(email=student_email)
+        stored = db.get_question_grades(student_id, assignment_id) if None not in (assignment_id, student_id) else {}
+    finally:
+        db.close_connection()
+    if not stored:
+        return None
+
+    # In the order the questions were graded in, then any stored for questions removed since
+    order = [question_id for question_id in GetInputs(dir=assignment_directory).questions if question_id in stored]
+    order += sorted(question_id for question_id in stored if question_id not in order)
+    feedback = compose_feedback(stored[question_id]["feedback"] for question_id in order)
+    return feedback_subject(config['assignment_topic']), feedback
+
+
+def resend_feedback(assignment_folder, student_email, mailer=None):
+    """
+    Emails a student the stored feedback of an assignment again. Returns False if it was never graded.
+    """
+    feedback = stored_feedback(assignment_folder, student_email)
+    if feedback is None:
+        grading_logger.warning(f"No stored grades of {assignment_folder} for {student_email} to resend.")
+        return False
+
+    own_mailer = mailer is None
+    if own_mailer:
+        with open(os.path.join('Keys', 'autograder_config.json')) as file:
+            config = json.load(file)
+        mailer = Mailer(config['smtp'], config['email'], config['password'])
+    try:
+        subject, message = feedback
+        mailer.send_feedback(to_email=student_email, subject=subject, feedback_message=message)
+    finally:
+        if own_mailer:
+            mailer.close()
+    grading_logger.info(f"Feedback of {assignment_folder} resent to {student_email}")
+    return True
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or len(sys.argv) % 2 == 0:
+        grading_logger.error("Invalid arguments. Usage: python resend_feedback.py <assignment_folder> <student_email> ...")
+        sys.exit("Invalid arguments. Usage: python resend_feedback.py <assignment_folder> <student_email> ...")
+
+    with open(os.path.join('Keys', 'autograder_config.json')) as file:
+        config = json.load(file)
+    mailer = Mailer(config['smtp'], config['email'], config['password'])
+    failed = False
+    try:
+        for assignment_folder, student_email in zip(sys.argv[1::2], sys.argv[2::2]):
+            try:
+                failed = not resend_feedback(assignment_folder, student_email, mailer) or failed
+            except Exception as e:
+                grading_logger.error(f"Failed to resend feedback of {assignment_folder} to {student_email}: {e}")
+                failed = True
+    finally:
+        mailer.close()
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,123 @@
+import sys
+import json
+import datetime
+import pathlib
+import sqlite3
+
+from database.job_queue import JobQueue, POLICIES, LANE_SUBMISSION
+
+# Days simulated past the last arrival before giving up on jobs that never fit the daily limit
+MAX_EXTRA_DAYS = 60
+
+
+def _deadline(assignment, deadlines):
+    if assignment not in deadlines:
+        try:
+            with open(pathlib.Path('Input', assignment, 'config.json')) as file:
+                deadlines[assignment] = json.load(file).get('deadline_date')
+        except (OSError, ValueError):
+            deadlines[assignment] = None
+    return deadlines[assignment]
+
+
+def load_history(path=pathlib.Path('database', 'jobs.db')):
+    """
+    Reads every job ever queued, from the job queue database or from a JSON list of jobs with
+    "assignment", "student_email", "requests", "created" (ISO date or timestamp) and optionally
+    "deadline" and "lane". Returns them sorted by arrival.
+    """
+    if str(path).endswith('.json'):
+        with open(path) as file:
+            rows = json.load(file)
+    else:
+        connection = sqlite3.connect(path)
+        connection.row_factory = sqlite3.Row
+        rows = [dict(row) for row in connection.execute('SELECT * FROM "grading_jobs" ORDER BY "created", "id"')]
+        connection.close()
+
+    deadlines = {}
+    jobs = []
+    for row in rows:
+        created = row['created']
+        if isinstance(created, str):
+            created = datetime.datetime.fromisoformat(created).timestamp()
+        jobs.append({
+            "assignment": row['assignment'],
+            "student_email": row['student_email'],
+            "requests": int(row['requests']),
+            "created": created,
+            "deadline": row.get('deadline') or _deadline(row['assignment'], deadlines),
+            "lane": row.get('lane', LANE_SUBMISSION),
+        })
+    return sorted(jobs, key=lambda job: job['created'])
+
+
+def simulate(jobs, requests_per_day, policy):
+    """
+    Replays the arrivals of 'jobs' day by day through a job queue claiming in the order of 'policy',
+    with 'requests_per_day' requests each day. Returns the daily totals and the day every job was graded.
+    """
+    queue = JobQueue(':memory:', policy=policy)
+    day = datetime.date.fromtimestamp(jobs[0]['created'])
+    last_arrival = datetime.date.fromtimestamp(jobs[-1]['created'])
+    arrivals = list(jobs)
+    graded = {}
+    days = []
+    while day <= last_arrival + datetime.timedelta(days=MAX_EXTRA_DAYS):
+        arrived = 0
+        while arrivals and datetime.date.fromtimestamp(arrivals[0]['created']) <= day:
+            job = arrivals.pop(0)
+            queue.enqueue(job['assignment'], job['student_email'], job['requests'], deadline=job['deadline'],
+                          lane=job['lane'], created=job['created'])
+            arrived += 1
+
+        left = requests_per_day
+        graded_today = 0
+        while True:
+            job = queue.claim('simulator', max_requests=left)
+            if job is None:
+                break
+            queue.complete(job['id'])
+            left -= job['requests']
+            graded_today += 1
+            graded[job['id']] = (job, day)
+
+        pending = queue.counts()['pending']
+        days.append({"day": str(day), "arrived": arrived, "graded": graded_today,
+                     "requests_used": requests_per_day - left, "pending": pending})
+        if not arrivals and not pending:
+            break
+        day += datetime.timedelta(days=1)
+    left_over = queue.counts()['pending']
+    queue.close_connection()
+    return days, list(graded.values()), left_over
+
+
+def summarize(graded, left_over):
+    waits = [(day - datetime.date.fromtimestamp(job['created'])).days for job, day in graded]
+    late = sum(1 for job, day in graded if job['deadline'] and str(day) > job['deadline'])
+    return {
+        "graded": len(graded),
+        "never_graded": left_over,
+        "graded_after_deadline": late,
+        "mean_wait_days": round(sum(waits) / len(waits), 2) if waits else 0,
+        "max_wait_days": max(waits, default=0),
+    }
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3) or not sys.argv[1].isdigit():
+        sys.exit("Usage: python simulate_schedule.py <requests_per_day> [jobs.db|jobs.json]")
+
+    requests_per_day = int(sys.argv[1])
+    jobs = load_history(sys.argv[2] if len(sys.argv) == 3 else pathlib.Path('database', 'jobs.db'))
+    if not jobs:
+        sys.exit("No jobs to replay.")
+
+    print(f"Replaying {len(jobs)} jobs with {requests_per_day} requests per day.")
+    for policy in POLICIES:
+        days, graded, left_over = simulate(jobs, requests_per_day, policy)
+        print(f"\nPolicy '{policy}': {json.dumps(summarize(graded, left_over))}")
+        print(f"{'day':<12}{'arrived':>8}{'graded':>8}{'used':>6}{'pending':>9}")
+        for row in days:
+            print(f"{row['day']:<12}{row['arrived']:>8}{row['graded']:>8}{row['requests_used']:>6}{row['pending']:>9}")